@@ -0,0 +1,201 @@
+import sys
+import time
+import heapq
+import subprocess
+from collections import Counter
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+import pandas as pd
+from loguru import logger
+
+from estado import EstadoCertidoes
+from planilha import normalizar_documento
+
+# === Configurações ===
+COL_CNPJ = "CNPJ"
+COL_VALIDADE = "VALIDADE CERTIDÃO"
+COL_STATUS = "STATUS"
+MARGEM_RENOVACAO_DIAS = 7  # renova o que vence dentro desta janela
+STATUS_REPROCESSAR = {"ERRO", "ERRO BAIXAR", "FALHA"}
+
+# === Configurações do agendador ===
+# aba → script do portal; o script recebe os CNPJs a renovar na linha de comando
+PORTAIS = {
+    "CDT": "app_cdt.py",
+    "CRF": "app_crf.py",
+    "PMM": "app_pmm.py",
+    "RFB": "app_rfb.py",
+    "SEFAZ CONT": "app_sefaz_cont.py",
+    "SEFAZ N CONT": "app_sefaz_n_cont.py",
+}
+ANTECEDENCIA_DIAS = 5               # renova esta quantidade de dias antes do vencimento
+LOTE_MAX = 20                       # CNPJs por execução de um portal
+LIMITE_DIARIO_POR_PORTAL = 300      # teto de emissões por portal/dia (espalha o atraso acumulado)
+INTERVALO_VERIFICACAO_SEG = 300
+ESPERA_REPROCESSO_SEG = 6 * 3600    # não tenta de novo o mesmo CNPJ antes disso
+ESPERA_REPROCESSO_MAX_SEG = 7 * 24 * 3600  # teto do back-off de quem segue sem validade após cada execução
+
+
+# === Planejamento incremental ===
+def interpretar_validades(serie: pd.Series) -> pd.Series:
+    """
+    Converte a coluna de validade para datetime de forma vetorizada. Aceita 'dd/mm/aaaa'
+    e 'aaaa-mm-dd' (datas do Excel lidas como texto); o resto (vazio, 'COM DÉBITO') vira NaT.
+    """
+    texto = serie.astype("string")
+    br = pd.to_datetime(texto.str.extract(r"(\d{2}/\d{2}/\d{4})", expand=False), format="%d/%m/%Y", errors="coerce")
+    iso = pd.to_datetime(texto.str.extract(r"(\d{4}-\d{2}-\d{2})", expand=False), format="%Y-%m-%d", errors="coerce")
+    return br.fillna(iso)
+
+
+def selecionar_pendentes(
+    df: pd.DataFrame,
+    margem_dias: int = MARGEM_RENOVACAO_DIAS,
+    hoje: date | None = None,
+    col_validade: str = COL_VALIDADE,
+    col_status: str = COL_STATUS,
+) -> pd.DataFrame:
+    """
+    Mantém só as linhas que precisam ir ao portal: sem validade (ou validade que não é
+    data), vencidas, vencendo dentro de `margem_dias` ou com status de erro.
+    """
+    if col_validade not in df.columns:
+        return df
+
+    limite = pd.Timestamp(hoje or date.today()) + pd.Timedelta(days=margem_dias)
+    validade = interpretar_validades(df[col_validade])
+    pendente = validade.isna() | (validade <= limite)
+    if col_status in df.columns:
+        pendente |= df[col_status].fillna("").astype(str).str.strip().str.upper().isin(STATUS_REPROCESSAR)
+
+    logger.info(
+        f"[Incremental] {int(pendente.sum())} de {len(df)} linha(s) vencidas, "
+        f"vencendo em até {margem_dias} dia(s), sem validade ou com erro."
+    )
+    return df.loc[pendente].copy()
+
+
+def filtrar_cnpjs(df: pd.DataFrame, cnpjs: list[str], col_cnpj: str = COL_CNPJ) -> pd.DataFrame:
+    """Mantém só as linhas dos documentos informados (comparação normalizada)."""
+    alvo = {normalizar_documento(c) for c in cnpjs}
+    return df.loc[df[col_cnpj].map(normalizar_documento).isin(alvo)].copy()
+
+
+# === Agendador por vencimento ===
+class AgendadorRenovacoes:
+    """
+    Processo contínuo que mantém uma fila de prioridade com todos os pares (CNPJ, portal),
+    ordenada pela data em que cada certidão deve ser renovada (validade - antecedência).
+    A cada ciclo despacha, em lotes pequenos, o que já está na hora para o script do portal,
+    com no máximo uma execução por portal e um teto diário de emissões.
+    """
+
+    def __init__(
+        self,
+        estado: EstadoCertidoes,
+        portais: dict[str, str] = PORTAIS,
+        antecedencia_dias: int = ANTECEDENCIA_DIAS,
+        lote_max: int = LOTE_MAX,
+        limite_diario: int = LIMITE_DIARIO_POR_PORTAL,
+    ):
+        self.estado = estado
+        self.portais = portais
+        self.antecedencia = timedelta(days=antecedencia_dias)
+        self.lote_max = lote_max
+        self.limite_diario = limite_diario
+
+        self._fila: list[tuple[datetime, str, str, str]] = []  # (renovar_em, aba, cnpj, documento)
+        self._execucoes: dict[str, subprocess.Popen] = {}
+        self._despachados: dict[tuple[str, str], float] = {}
+        self._falhas: Counter = Counter()  # (aba, cnpj) → despachos seguidos sem renovar a validade
+        self._cota: Counter = Counter()  # (aba, dia) → emissões despachadas
+
+    def _renovar_em(self, row: dict) -> datetime:
+        if not row["validade_iso"] or (row["status"] or "").strip().upper() in STATUS_REPROCESSAR:
+            return datetime.min  # sem validade ou com erro: já está atrasado
+        return datetime.fromisoformat(row["validade_iso"]) - self.antecedencia
+
+    def _espera(self, aba: str, cnpj: str) -> float:
+        # dobra a cada despacho que não renovou: "COM DÉBITO" ou falha de extração que se
+        # repete deixa de voltar ao portal a cada 6 h e passa a ser conferido até 1x/semana
+        falhas = self._falhas[(aba, cnpj)]
+        return min(ESPERA_REPROCESSO_SEG * 2 ** max(0, falhas - 1), ESPERA_REPROCESSO_MAX_SEG)
+
+    def recarregar(self, agora: datetime | None = None):
+        """Reconstrói a fila a partir do estado (o banco é a fonte da verdade)."""
+        agora = agora or datetime.now()
+        self.estado.sincronizar_planilha(list(self.portais))
+        self._fila = []
+        for row in self.estado.listar(list(self.portais)):
+            renovar_em = self._renovar_em(row)
+            if renovar_em > agora:
+                # renovada (ou ainda no prazo): zera o back-off
+                self._falhas.pop((row["aba"], row["cnpj"]), None)
+            self._fila.append((renovar_em, row["aba"], row["cnpj"], row["documento"] or row["cnpj"]))
+        heapq.heapify(self._fila)
+        # dias passados não voltam a ser consultados
+        for chave in [c for c in self._cota if c[1] < agora.date()]:
+            del self._cota[chave]
+
+    def despachar(self, agora: datetime | None = None) -> dict[str, list[str]]:
+        agora = agora or datetime.now()
+        self._coletar_finalizados()
+
+        lotes: dict[str, list[str]] = {}
+        while self._fila and self._fila[0][0] <= agora:
+            _, aba, cnpj, documento = heapq.heappop(self._fila)
+            lote = lotes.setdefault(aba, [])
+            if aba in self._execucoes or len(lote) >= self.lote_max:
+                continue
+            if time.monotonic() - self._despachados.get((aba, cnpj), float("-inf")) < self._espera(aba, cnpj):
+                continue
+            if self._cota[(aba, agora.date())] >= self.limite_diario:
+                continue
+            lote.append(documento)
+            self._cota[(aba, agora.date())] += 1
+            self._despachados[(aba, cnpj)] = time.monotonic()
+            self._falhas[(aba, cnpj)] += 1
+
+        for aba, documentos in lotes.items():
+            if documentos:
+                self._iniciar(aba, documentos)
+        return {aba: docs for aba, docs in lotes.items() if docs}
+
+    def _iniciar(self, aba: str, documentos: list[str]):
+        script = Path(__file__).with_name(self.portais[aba])
+        logger.info(f"[Agenda] {aba}: renovando {len(documentos)} CNPJ(s) via {script.name}")
+        self._execucoes[aba] = subprocess.Popen([sys.executable, str(script), *documentos])
+
+    def _coletar_finalizados(self):
+        for aba, proc in list(self._execucoes.items()):
+            if proc.poll() is not None:
+                nivel = "INFO" if proc.returncode == 0 else "WARNING"
+                logger.log(nivel, f"[Agenda] {aba}: execução terminou (código {proc.returncode}).")
+                del self._execucoes[aba]
+
+    def segundos_ate_proxima(self, agora: datetime | None = None) -> float:
+        agora = agora or datetime.now()
+        # com portal rodando, verifica com mais frequência para despachar o próximo lote logo que ele terminar
+        teto = 15.0 if self._execucoes else INTERVALO_VERIFICACAO_SEG
+        if not self._fila:
+            return teto
+        falta = (self._fila[0][0] - agora).total_seconds() if self._fila[0][0] > agora else 0
+        return max(5.0, min(teto, falta))
+
+    def executar(self):
+        logger.add("execucao_agenda.log", rotation="1 MB")
+        logger.info(f"[Agenda] Iniciado para: {', '.join(self.portais)}")
+        try:
+            while True:
+                self.recarregar()
+                self.despachar()
+                time.sleep(self.segundos_ate_proxima())
+        except KeyboardInterrupt:
+            logger.info("[Agenda] Interrompido; aguardando execuções em andamento gravarem.")
+            for proc in self._execucoes.values():
+                proc.wait()
+
+
+if __name__ == "__main__":
+    AgendadorRenovacoes(EstadoCertidoes()).executar()
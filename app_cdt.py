@@ -1,16 +1,20 @@
 import re
-import time
-import base64
+import sys
+import asyncio
 import traceback
-from datetime import datetime
 from pathlib import Path
-import requests
 
-import pandas as pd
-import fitz  # PyMuPDF
 from loguru import logger
-from playwright.sync_api import sync_playwright, TimeoutError as PWTimeout
-from openpyxl import load_workbook
+from playwright.sync_api import TimeoutError as PWTimeout
+from playwright.async_api import TimeoutError as PWTimeoutAsync
+
+from agenda import filtrar_cnpjs, selecionar_pendentes
+from captcha import API_KEY_2CAPTCHA, Solucao
+from estado_app import EstadoApp
+from motor_async import MotorAsync
+from ocr_captcha import confirmar_captcha, resolver_imagem
+from paralelo import executar_em_paralelo, executar_em_pipeline
+from pos_processamento import Resultado, Tarefa
 
 # === Configurações ===
 PLANILHA = Path("base_certidoes.xlsx")
@@ -20,12 +24,15 @@ COL_VALIDADE = "VALIDADE CERTIDÃO"
 COL_RAZAO = "RAZÃO SOCIAL"
 OUTPUT_DIR = Path("certidoes_baixadas") / ABA.replace(" ", "_")
 URL_CDT = "https://cndt-certidao.tst.jus.br/gerarCertidao.faces"
-TIMEOUT = 40_000
-REGEX_VALIDADE = r"Validade:\s*(\d{2}/\d{2}/\d{4})"
 MAX_TENTATIVAS_CNPJ = 6
 HEADLESS = False
-POLLING_2CAPTCHA_SEG = 5
-MAX_POLLS_2CAPTCHA = 50  
+WORKERS = 3  # navegadores simultâneos neste portal
+MOTOR = "pipeline"  # "threads" | "pipeline": captcha do próximo CNPJ resolvido enquanto o atual baixa | "async"
+CONCORRENCIA_ASYNC = 10
+MODO_INCREMENTAL = True
+MARGEM_RENOVACAO_DIAS = 7
+ORCAMENTO_ESPERAS = {"abertura": 40, "captcha": 10, "download": 15, "certidao": 20}  # segundos por etapa
+APP = EstadoApp(ABA, PLANILHA, ORCAMENTO_ESPERAS)
 
 # === Utilitários ===
 def normalizar_cnpj(doc: str) -> str:
@@ -38,87 +45,19 @@ def normalizar_cnpj(doc: str) -> str:
         return numeros
     raise ValueError(f"Documento inválido: {doc} → {numeros}")
 
-def extrair_validade_pdf(caminho_pdf: Path) -> str:
-    try:
-        with fitz.open(caminho_pdf) as doc:
-            texto = "\n".join(page.get_text() for page in doc)
-        match = re.search(REGEX_VALIDADE, texto, re.IGNORECASE)
-        if match:
-            return match.group(1)
-    except Exception as e:
-        logger.warning(f"Erro ao ler validade do PDF {caminho_pdf.name}: {e}")
-    return ""
-
-
-def salvar_valor_na_planilha(cnpj: str, nova_data: str, caminho: Path, aba: str):
-    wb = load_workbook(caminho)
-    ws = wb[aba]
-    colunas = {cell.value: idx for idx, cell in enumerate(next(ws.iter_rows(min_row=1, max_row=1)), start=1)}
-    idx_cnpj = colunas.get(COL_CNPJ)
-    idx_validade = colunas.get(COL_VALIDADE)
-
-    if not idx_cnpj or not idx_validade:
-        logger.error("Coluna CNPJ ou VALIDADE CERTIDÃO não encontrada.")
-        return
-
-    for row in ws.iter_rows(min_row=2):
-        val = str(row[idx_cnpj - 1].value)
-        if normalizar_cnpj(val) == normalizar_cnpj(cnpj):
-            row[idx_validade - 1].value = nova_data
-            break
-
-    wb.save(caminho)
-    wb.close()
-
-# === 2Captcha (image captcha) ===
-def resolver_captcha_2captcha(caminho_imagem: Path, api_key: str) -> str:
-    with open(caminho_imagem, "rb") as f:
-        b64 = base64.b64encode(f.read()).decode("utf-8")
-
-    payload = {
-        "key": api_key,
-        "method": "base64",
-        "body": b64,
-        "json": 1,
-    }
-    resp = requests.post("http://2captcha.com/in.php", data=payload, timeout=40)
-    resp.raise_for_status()
-    data = resp.json()
-    if data.get("status") != 1:
-        raise RuntimeError(f"Falha ao enfileirar captcha: {data}")
-
-    captcha_id = data["request"]
-
-    # Polling de resultado
-    for _ in range(MAX_POLLS_2CAPTCHA):
-        time.sleep(POLLING_2CAPTCHA_SEG)
-        res = requests.get(
-            "http://2captcha.com/res.php",
-            params={"key": api_key, "action": "get", "id": captcha_id, "json": 1},
-            timeout=40,
-        )
-        res.raise_for_status()
-        ans = res.json()
-        if ans.get("status") == 1:
-            return ans["request"].strip()
-        # Se não estiver pronto e não for CAPCHA_NOT_READY, trate como erro
-        if ans.get("request") != "CAPCHA_NOT_READY":
-            raise RuntimeError(f"Erro do 2Captcha: {ans}")
-
-    raise TimeoutError("Timeout aguardando solução do 2Captcha")
-
+def salvar_valor_na_planilha(cnpj: str, nova_data: str, **detalhes):
+    APP.estado.registrar(ABA, cnpj, validade=nova_data, **detalhes)
+    APP.gravador.registrar(ABA, cnpj, {COL_VALIDADE: nova_data})
 
 # === Baixa a certidão (download ou nova aba) ===
-def tentar_baixar_certidao(page, contexto, cnpj_limpo: str) -> Path | None:
-    temp_path = OUTPUT_DIR / f"temp_{cnpj_limpo}.pdf"
-
+def tentar_baixar_certidao(page, contexto, cnpj_limpo: str) -> bytes | None:
+    """Conteúdo do PDF emitido (download ou nova aba), sem gravar nada em OUTPUT_DIR."""
     # 1) Tenta evento de download direto
     try:
-        with page.expect_download(timeout=15000) as dl_info:
+        with APP.esperas.evento(page, "download", "download") as dl_info:
             page.get_by_role("button", name=re.compile("Emitir Certid[aã]o", re.I)).click()
         download = dl_info.value
-        download.save_as(str(temp_path))
-        return temp_path
+        return Path(download.path()).read_bytes()
     except PWTimeout:
         pass
     except Exception as e:
@@ -129,11 +68,11 @@ def tentar_baixar_certidao(page, contexto, cnpj_limpo: str) -> Path | None:
         with contexto.expect_page() as nova_aba_evento:
             page.get_by_role("button", name=re.compile("Emitir Certid[aã]o", re.I)).click()
         nova_aba = nova_aba_evento.value
-        nova_aba.wait_for_load_state("networkidle", timeout=20000)
+        APP.esperas.carregamento(nova_aba, "certidao", "networkidle")
         try:
-            nova_aba.pdf(path=str(temp_path), format="A4")
+            pdf_bytes = nova_aba.pdf(format="A4")
             nova_aba.close()
-            return temp_path
+            return pdf_bytes
         except Exception as e:
             logger.debug(f"pdf() falhou: {e}")
             evid = OUTPUT_DIR / f"screenshot_{cnpj_limpo}.png"
@@ -144,12 +83,189 @@ def tentar_baixar_certidao(page, contexto, cnpj_limpo: str) -> Path | None:
         return None
 
 
+def registrar_pdf(resultado: Resultado):
+    # roda neste processo quando o pós-processamento termina
+    if resultado.dados.validade:
+        salvar_valor_na_planilha(resultado.cnpj, resultado.dados.validade, pdf_path=resultado.destino, **resultado.detalhes)
+        logger.success(f"{resultado.cnpj} → Sucesso: {resultado.dados.resumo()}")
+    else:
+        logger.warning(f"{resultado.cnpj} → PDF salvo, mas não foi possível extrair validade.")
+
+
+def finalizar_pdf(pdf_bytes: bytes, cnpj_limpo: str, tentativas: int):
+    # extração, nome final e estado saem do navegador: ficam com o pós-processamento
+    APP.pos.enviar(
+        Tarefa(ABA, cnpj_limpo, pdf_bytes, OUTPUT_DIR, "cdt_{cnpj}_{validade}.pdf", detalhes={"tentativas": tentativas}),
+        registrar_pdf,
+    )
+
+
+# === Etapas de um CNPJ ===
+def preparar_captcha(page, cnpj: str) -> Path:
+    """Abre o formulário com o CNPJ preenchido e salva a imagem do captcha."""
+    cnpj_limpo = normalizar_cnpj(cnpj)
+    logger.info(f"Consultando CNPJ: {cnpj_limpo}")
+    APP.esperas.navegar(page, URL_CDT)
+
+    # Preenche o CNPJ (campo: "Registro no Cadastro Nacional...")
+    page.get_by_role("textbox", name=re.compile("Cadastro Nacional|CNPJ", re.I)).fill(cnpj_limpo)
+
+    # Aguarda o captcha renderizar (imagem visível e carregada)
+    captcha_img = page.get_by_role("img", name=re.compile("Captcha", re.I)).first
+    APP.esperas.imagem(page, captcha_img, "captcha")
+
+    # Captura a imagem do captcha
+    captcha_path = OUTPUT_DIR / f"captcha_{cnpj_limpo}.png"
+    captcha_img.screenshot(path=str(captcha_path))
+    return captcha_path
+
+
+def resolver_captcha(captcha_path: Path) -> Solucao:
+    solucao = resolver_imagem(ABA, captcha_path)
+    logger.info(f"{solucao.fonte} → '{solucao.texto}' ({solucao.latencia}s)")
+    return solucao
+
+
+def concluir_emissao(page, context, cnpj: str, captcha_path: Path, solucao: Solucao, tentativas: int) -> bool:
+    """Envia o captcha resolvido e baixa a certidão. False quando o portal não devolveu o PDF."""
+    cnpj_limpo = normalizar_cnpj(cnpj)
+
+    # Preenche o captcha
+    page.get_by_role("textbox", name=re.compile("Digite os caracteres|Captcha|caracteres exibidos", re.I)).fill(solucao.texto)
+
+    # Tenta emitir e obter o PDF
+    pdf_bytes = tentar_baixar_certidao(page, context, cnpj_limpo)
+
+    if pdf_bytes is None:
+        # Heurística: mensagem de erro de captcha → a próxima tentativa captura um captcha novo
+        try:
+            erro_visivel = page.locator(
+                "text=/inv[aá]lido|c[oó]digo incorreto|captcha|caracteres/i"
+            ).first.is_visible(timeout=1000)
+        except Exception:
+            erro_visivel = False
+
+        if erro_visivel:
+            confirmar_captcha(ABA, solucao, False, cnpj=cnpj_limpo)
+            logger.warning(f"{cnpj_limpo} → Captcha inválido/erro detectado (tentativa {tentativas}/{MAX_TENTATIVAS_CNPJ}).")
+        else:
+            logger.warning(f"{cnpj_limpo} → Sem PDF nem erro claro (tentativa {tentativas}/{MAX_TENTATIVAS_CNPJ}).")
+        return False
+
+    # Se chegou aqui, temos PDF (captcha aceito) → extrai validade e salva
+    confirmar_captcha(ABA, solucao, True, captcha_path, cnpj_limpo)
+    finalizar_pdf(pdf_bytes, cnpj_limpo, tentativas)
+    return True
+
+
+# === Fluxo de um CNPJ ===
+def processar_cnpj(page, context, cnpj: str):
+    cnpj_limpo = normalizar_cnpj(cnpj)
+
+    for tentativas in range(1, MAX_TENTATIVAS_CNPJ + 1):
+        try:
+            captcha_path = preparar_captcha(page, cnpj_limpo)
+            solucao = resolver_captcha(captcha_path)
+            if concluir_emissao(page, context, cnpj_limpo, captcha_path, solucao, tentativas):
+                return
+
+        except Exception as e:
+            motivo = f"{type(e).__name__}: {e}"
+            logger.error(f"{cnpj_limpo} → ERRO: {motivo}")
+            traceback.print_exc()
+            # Loop continua até atingir o MAX_TENTATIVAS_CNPJ
+
+    logger.error(f"{cnpj_limpo} → Excedeu o número máximo de tentativas.")
+
+
+# === Fluxo de um CNPJ (motor assíncrono) ===
+async def tentar_baixar_certidao_async(page, contexto, cnpj_limpo: str) -> bytes | None:
+    botao = page.get_by_role("button", name=re.compile("Emitir Certid[aã]o", re.I))
+
+    try:
+        async with APP.esperas.evento_async(page, "download", "download") as dl_info:
+            await botao.click()
+        download = await dl_info.value
+        caminho = await download.path()
+        return await asyncio.to_thread(Path(caminho).read_bytes)
+    except PWTimeoutAsync:
+        pass
+    except Exception as e:
+        logger.debug(f"Download direto falhou: {e}")
+
+    try:
+        async with contexto.expect_page() as nova_aba_evento:
+            await botao.click()
+        nova_aba = await nova_aba_evento.value
+        await APP.esperas.carregamento_async(nova_aba, "certidao", "networkidle")
+        try:
+            return await nova_aba.pdf(format="A4")
+        except Exception as e:
+            logger.debug(f"pdf() falhou: {e}")
+            await nova_aba.screenshot(path=str(OUTPUT_DIR / f"screenshot_{cnpj_limpo}.png"), full_page=True)
+            return None
+        finally:
+            await nova_aba.close()
+    except PWTimeoutAsync:
+        return None
+
+
+async def processar_cnpj_async(motor, page, context, cnpj: str):
+    cnpj_limpo = normalizar_cnpj(cnpj)
+
+    for tentativas in range(1, MAX_TENTATIVAS_CNPJ + 1):
+        try:
+            logger.info(f"Consultando CNPJ: {cnpj_limpo} (tentativa {tentativas}/{MAX_TENTATIVAS_CNPJ})")
+            await APP.esperas.navegar_async(page, URL_CDT)
+            await page.get_by_role("textbox", name=re.compile("Cadastro Nacional|CNPJ", re.I)).fill(cnpj_limpo)
+
+            captcha_img = page.get_by_role("img", name=re.compile("Captcha", re.I)).first
+            await APP.esperas.imagem_async(page, captcha_img, "captcha")
+            imagem = await captcha_img.screenshot(path=str(OUTPUT_DIR / f"captcha_{cnpj_limpo}.png"))
+            solucao = await motor.resolver_captcha_imagem(imagem, portal=ABA)
+            logger.info(f"{solucao.fonte} → '{solucao.texto}' ({solucao.latencia}s)")
+
+            await page.get_by_role("textbox", name=re.compile("Digite os caracteres|Captcha|caracteres exibidos", re.I)).fill(solucao.texto)
+
+            pdf_bytes = await tentar_baixar_certidao_async(page, context, cnpj_limpo)
+            if pdf_bytes is None:
+                # mesma heurística do fluxo síncrono: erro de captcha visível → solução rejeitada
+                try:
+                    erro_visivel = await page.locator(
+                        "text=/inv[aá]lido|c[oó]digo incorreto|captcha|caracteres/i"
+                    ).first.is_visible(timeout=1000)
+                except Exception:
+                    erro_visivel = False
+
+                if erro_visivel:
+                    await asyncio.to_thread(confirmar_captcha, ABA, solucao, False, cnpj=cnpj_limpo)
+                    logger.warning(f"{cnpj_limpo} → Captcha inválido/erro detectado (tentativa {tentativas}/{MAX_TENTATIVAS_CNPJ}).")
+                else:
+                    logger.warning(f"{cnpj_limpo} → Sem PDF nem erro claro (tentativa {tentativas}/{MAX_TENTATIVAS_CNPJ}).")
+                continue
+
+            # extração e gravação são bloqueantes: saem do event loop
+            await asyncio.to_thread(confirmar_captcha, ABA, solucao, True, imagem, cnpj_limpo)
+            await asyncio.to_thread(finalizar_pdf, pdf_bytes, cnpj_limpo, tentativas)
+            return
+
+        except Exception as e:
+            logger.error(f"{cnpj_limpo} → ERRO: {type(e).__name__}: {e}")
+
+    logger.error(f"{cnpj_limpo} → Excedeu o número máximo de tentativas.")
+
+
 # === Fluxo principal ===
-def processar_cdt():
+def processar_cdt(cnpjs: list[str] | None = None):
+    APP.iniciar()
     logger.add("execucaocdt.log", rotation="1 MB")
     logger.info(f"Iniciando automação da aba: {ABA}")
 
-    df = pd.read_excel(PLANILHA, sheet_name=ABA, dtype=str)
+    df = APP.estado.carregar_aba(ABA, PLANILHA)
+    if cnpjs is not None:
+        df = filtrar_cnpjs(df, cnpjs)
+    elif MODO_INCREMENTAL:
+        df = selecionar_pendentes(df, MARGEM_RENOVACAO_DIAS)
     df = df[[COL_RAZAO, COL_CNPJ, COL_VALIDADE]].dropna(subset=[COL_CNPJ])
     cnpjs = df[COL_CNPJ].drop_duplicates().tolist()
 
@@ -159,96 +275,36 @@ def processar_cdt():
         logger.error("Defina API_KEY_2CAPTCHA (variável de ambiente ou no código) antes de executar.")
         return
 
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=HEADLESS)
-        context = browser.new_context(accept_downloads=True)
-        page = context.new_page()            
-
-        for cnpj in cnpjs:
-            cnpj_limpo = normalizar_cnpj(cnpj)
-            tentativas = 0
-
-            while tentativas < MAX_TENTATIVAS_CNPJ:
-                tentativas += 1
-                try:
-                    logger.info(f"Consultando CNPJ: {cnpj_limpo} (tentativa {tentativas}/{MAX_TENTATIVAS_CNPJ})")
-                    page.goto(URL_CDT, timeout=TIMEOUT)
-                    page.wait_for_load_state("domcontentloaded", timeout=10000)
-
-                    # Preenche o CNPJ (campo: "Registro no Cadastro Nacional...")
-                    page.get_by_role("textbox", name=re.compile("Cadastro Nacional|CNPJ", re.I)).fill(cnpj_limpo)
-
-                    # Aguarda o captcha renderizar
-                    time.sleep(1.5)
-
-                    # Captura a imagem do captcha
-                    captcha_img = page.get_by_role("img", name=re.compile("Captcha", re.I)).first
-                    captcha_path = OUTPUT_DIR / f"captcha_{cnpj_limpo}.png"
-                    captcha_img.screenshot(path=str(captcha_path))
-
-                    # Resolve com 2Captcha (image captcha)
-                    texto_captcha = resolver_captcha_2captcha(captcha_path, API_KEY_2CAPTCHA)
-                    logger.info(f"2Captcha → '{texto_captcha}'")
-
-                    # Preenche o captcha
-                    page.get_by_role("textbox", name=re.compile("Digite os caracteres|Captcha|caracteres exibidos", re.I)).fill(texto_captcha)
-                    time.sleep(0.6)
-
-                    # Tenta emitir e obter o PDF
-                    temp_pdf = tentar_baixar_certidao(page, context, cnpj_limpo)
-
-                    if temp_pdf is None:
-                        # Heurística: se há mensagem de erro de captcha, recarrega e tenta novamente
-                        try:
-                            erro_visivel = page.locator(
-                                "text=/inv[aá]lido|c[oó]digo incorreto|captcha|caracteres/i"
-                            ).first.is_visible(timeout=1000)
-                        except Exception:
-                            erro_visivel = False
-
-                        if erro_visivel:
-                            logger.warning("Captcha inválido/erro detectado. Recarregando captcha…")
-                            try:
-                                captcha_img.click()  # muitos sites recarregam a imagem ao clicar
-                            except Exception:
-                                pass
-                            time.sleep(1.2)
-                            continue  # próxima tentativa
-
-                        logger.warning("Sem PDF nem erro claro; tentando novamente…")
-                        continue
-
-                    # Se chegou aqui, temos PDF → extrai validade e salva
-                    validade = extrair_validade_pdf(temp_pdf)
-                    if validade:
-                        salvar_valor_na_planilha(cnpj_limpo, validade, PLANILHA, ABA)
-                        validade_formatada = datetime.strptime(validade, "%d/%m/%Y").strftime("%Y%m%d")
-                        destino_pdf = OUTPUT_DIR / f"cdt_{cnpj_limpo}_{validade_formatada}.pdf"
-                        temp_pdf.replace(destino_pdf)
-                        logger.success(f"{cnpj_limpo} → Sucesso: validade {validade}")
-                    else:
-                        destino_pdf = OUTPUT_DIR / f"erro_{cnpj_limpo}.pdf"
-                        temp_pdf.replace(destino_pdf)
-                        logger.warning(f"{cnpj_limpo} → PDF salvo, mas não foi possível extrair validade.")
-
-                    # Sucesso → sair do loop de tentativas
-                    break
-
-                except Exception as e:
-                    motivo = f"{type(e).__name__}: {e}"
-                    logger.error(f"{cnpj_limpo} → ERRO: {motivo}")
-                    traceback.print_exc()
-                    # Loop continua até atingir o MAX_TENTATIVAS_CNPJ
-
-            else:
-                logger.error(f"{cnpj_limpo} → Excedeu o número máximo de tentativas.")
-
-        context.close()
-        browser.close()
+    if MOTOR == "async":
+        motor = MotorAsync(CONCORRENCIA_ASYNC, headless=HEADLESS, opcoes_contexto={"accept_downloads": True}, nome=ABA)
+        motor.executar(cnpjs, processar_cnpj_async)
+    elif MOTOR == "pipeline":
+        executar_em_pipeline(
+            cnpjs,
+            preparar=preparar_captcha,
+            resolver=resolver_captcha,
+            concluir=concluir_emissao,
+            max_tentativas=MAX_TENTATIVAS_CNPJ,
+            workers=WORKERS,
+            headless=HEADLESS,
+            opcoes_contexto={"accept_downloads": True},
+            nome=ABA,
+        )
+    else:
+        executar_em_paralelo(
+            cnpjs,
+            processar_cnpj,
+            workers=WORKERS,
+            headless=HEADLESS,
+            opcoes_contexto={"accept_downloads": True},
+            nome=ABA,
+        )
 
+    APP.pos.aguardar()
+    APP.gravador.flush()
     logger.info("Processo concluído.")
 
 
 # === Execução ===
 if __name__ == "__main__":
-    processar_cdt()
+    processar_cdt(cnpjs=sys.argv[1:] or None)
@@ -1,16 +1,27 @@
 import os
 import re
+import sys
 import time
 import base64
+import asyncio
 import traceback
 from datetime import datetime
 from pathlib import Path
-import requests
 
-import pandas as pd
 from loguru import logger
-from playwright.sync_api import sync_playwright, TimeoutError as PWTimeout
-from openpyxl import load_workbook
+from playwright.sync_api import TimeoutError as PWTimeout
+from playwright.async_api import TimeoutError as PWTimeoutAsync
+
+from agenda import filtrar_cnpjs, selecionar_pendentes
+from captcha import API_KEY_2CAPTCHA, Solucao
+from esperas import Esperas
+from estado import EstadoCertidoes
+from estrategias import Estrategias
+from extracao import extrair_certidao_html
+from motor_async import MotorAsync
+from ocr_captcha import confirmar_captcha, resolver_imagem
+from paralelo import executar_em_paralelo, executar_em_pipeline
+from planilha import GravadorPlanilha
 
 # =====================
 # Configurações
@@ -23,113 +34,415 @@ COL_RAZAO = "RAZÃO SOCIAL"
 COL_STATUS = "STATUS"
 OUTPUT_DIR = Path("certidoes_baixadas") / ABA.replace(" ", "_")
 URL_CRF = "https://consulta-crf.caixa.gov.br/consultacrf/pages/consultaEmpregador.jsf"
-TIMEOUT = 40_000
-REGEX_VALIDADE_FINAL = r"Validade:\s*\d{2}/\d{2}/\d{4}\s*a\s*(\d{2}/\d{2}/\d{4})"
 
-POLLING_2CAPTCHA_SEG = 2
-MAX_POLLS_2CAPTCHA = 50 
 MAX_TENTATIVAS_CNPJ = 6
 HEADLESS = False    
+WORKERS = 2
+MOTOR = "pipeline"  # "threads" | "pipeline": captcha do próximo CNPJ resolvido enquanto o atual consulta | "async"
+CONCORRENCIA_ASYNC = 10
+MODO_INCREMENTAL = True
+MARGEM_RENOVACAO_DIAS = 7
+ORCAMENTO_ESPERAS = {  # segundos por etapa
+    "abertura": 40, "formulario": 8, "captcha": 10, "consulta": 20,
+    "link": 3, "detalhe": 15, "nova_aba": 8, "certidao": 15,
+}
+ESTADO = EstadoCertidoes()
+ESPERAS = Esperas(ABA, ORCAMENTO_ESPERAS)
+ESTRATEGIAS_RADIO = Estrategias(ABA, "radio_cnpj")
+GRAVADOR = GravadorPlanilha(PLANILHA, criar_colunas=True)
+_INICIO: dict[str, float] = {}  # CNPJ → início da primeira tentativa (duração gravada no estado)
+# o JSF re-renderiza o formulário após o radio/captcha: só digita quando o campo aceita entrada
+JS_CAMPO_EDITAVEL = "sel => { const el = document.querySelector(sel); return !!el && !el.disabled && !el.readOnly; }"
+SEL_INSCRICAO = "#mainForm\\:txtInscricao1"
+SEL_CAPTCHA = "#mainForm\\:txtCaptcha"
+JS_CAPTCHA_PRONTO = "() => (document.querySelector(\"img[alt='Codigo2']\")?.src || '').startsWith('data:image')"
+# marca o radio "CNPJ" pelo label (última estratégia, quando os cliques falham)
+JS_RADIO_CNPJ = """
+    (() => {
+        const lbl = [...document.querySelectorAll('label')]
+          .find(l => /\\bCNPJ\\b/i.test(l.textContent || ''));
+        if (!lbl) return false;
+        const forId = lbl.getAttribute('for');
+        let input = null;
+        if (forId) input = document.getElementById(forId);
+        if (!input) {
+          input = lbl.previousElementSibling && lbl.previousElementSibling.type === 'radio'
+            ? lbl.previousElementSibling
+            : (lbl.nextElementSibling && lbl.nextElementSibling.type === 'radio'
+              ? lbl.nextElementSibling : null);
+        }
+        if (!input) return false;
+        input.checked = true;
+        input.dispatchEvent(new Event('change', {bubbles: true}));
+        input.dispatchEvent(new Event('input', {bubbles: true}));
+        return true;
+    })();
+"""
+# grava o valor direto no input (quando a digitação não "pegou")
+JS_FORCAR_VALOR = """([sel, val]) => {
+    const el = document.querySelector(sel);
+    if (!el) return;
+    el.focus();
+    el.value = val;
+    el.dispatchEvent(new Event('input', { bubbles: true }));
+    el.dispatchEvent(new Event('change', { bubbles: true }));
+    el.blur();
+}"""
+
+def salvar_validade_status_na_planilha(cnpj: str, validade: str | None, status: str, **detalhes):
+    # VALIDADE e STATUS são criadas pelo gravador caso não existam na aba
+    valores = {COL_STATUS: status}
+    if validade:
+        valores[COL_VALIDADE] = validade
+        detalhes["validade"] = validade
+    ESTADO.registrar(ABA, cnpj, status=status, **detalhes)
+    GRAVADOR.registrar(ABA, cnpj, valores)
 
-def _abrir_ws(caminho: Path, aba: str):
-    wb = load_workbook(caminho)
-    if aba not in wb.sheetnames:
-        raise ValueError(f"Aba '{aba}' não encontrada em {caminho}.")
-    ws = wb[aba]
-    return wb, ws
-
-
-def _mapear_cabecalhos(ws):
-    colunas = {cell.value: idx for idx, cell in enumerate(next(ws.iter_rows(min_row=1, max_row=1)), start=1)}
-    return colunas
-
-
-def _garantir_coluna_status(ws, colunas):
-    if COL_STATUS not in colunas:
-        # cria na próxima coluna
-        nova_idx = ws.max_column + 1
-        ws.cell(row=1, column=nova_idx, value=COL_STATUS)
-        colunas[COL_STATUS] = nova_idx
+# =====================
+# Etapas de um CNPJ (FGTS/CRF)
+# =====================
 
+def preparar_captcha(page, cnpj: str) -> Path:
+    """Abre a consulta com o CNPJ preenchido e salva o captcha (base64 embutido na <img>)."""
+    cnpj_limpo = re.sub(r"\D", "", str(cnpj)).zfill(14)
+    _INICIO.setdefault(cnpj_limpo, time.monotonic())
+    logger.info(f"Consultando CRF (FGTS) – CNPJ {cnpj_limpo}")
+    ESPERAS.navegar(page, URL_CRF)
+
+    # --- Seleciona CNPJ e preenche inscrição (a estratégia que funcionou por último vai primeiro) ---
+    def por_label():
+        page.get_by_label(re.compile(r"\bCNPJ\b", re.I)).check()
+        return True
+
+    def texto_label():
+        lbl = page.locator("label:has-text('CNPJ')").first
+        ESPERAS.visivel(lbl, "formulario")
+        lbl.click()
+        return True
+
+    def xpath_label():
+        page.locator("xpath=//label[contains(normalize-space(),'CNPJ')]").first.click()
+        return True
+
+    def js():
+        return page.evaluate(JS_RADIO_CNPJ)
+
+    ESTRATEGIAS_RADIO.executar({
+        "label": por_label,
+        "texto_label": texto_label,
+        "xpath_label": xpath_label,
+        "js": js,
+    })
+
+    campo = page.locator(SEL_INSCRICAO)
+    ESPERAS.visivel(campo, "formulario")
+    ESPERAS.condicao(page, JS_CAMPO_EDITAVEL, "formulario", arg=SEL_INSCRICAO)
+    try:
+        campo.click()
+        campo.fill("")
+        campo.fill(cnpj_limpo)
+        campo.press("Tab")
+    except Exception as e:
+        logger.debug(f"Falha ao digitar no campo Inscrição: {e}")
+
+    try:
+        valor = campo.input_value(timeout=2000)
+    except Exception:
+        valor = ""
+    if re.sub(r"\\D", "", valor) != cnpj_limpo:
+        try:
+            page.evaluate(JS_FORCAR_VALOR, [SEL_INSCRICAO, cnpj_limpo])
+            logger.info("Valor do campo Inscrição forçado via JS.")
+        except Exception as e:
+            logger.warning(f"Fallback JS para Inscrição falhou: {e}")
+
+    # --- Captura o captcha (2Captcha image) ---
+    # Captura base64 direto da tag <img>, assim que o src embutido estiver presente
+    img_element = page.locator("img[alt='Codigo2']").first
+    ESPERAS.condicao(page, JS_CAPTCHA_PRONTO, "captcha")
+    base64_src = img_element.get_attribute("src")
+
+    if not base64_src.startswith("data:image"):
+        raise ValueError("A imagem captcha não está em base64 embutido!")
+
+    # Extrai base64 puro (remove cabeçalho 'data:image/png;base64,')
+    base64_data = base64_src.split(",")[1]
+    captcha_path = OUTPUT_DIR / f"captcha_{cnpj_limpo}.png"
+
+    # Decodifica e salva localmente
+    with open(captcha_path, "wb") as f:
+        f.write(base64.b64decode(base64_data))
+    return captcha_path
+
+
+def resolver_captcha(captcha_path: Path) -> Solucao:
+    solucao = resolver_imagem(ABA, captcha_path)
+    logger.info(f"{solucao.fonte} → '{solucao.texto}' ({solucao.latencia}s)")
+    return solucao
+
+
+def concluir_consulta(page, context, cnpj: str, captcha_path: Path, solucao: Solucao, tentativas: int) -> bool:
+    """Envia o captcha resolvido e abre o certificado. False quando a consulta não retornou o link."""
+    cnpj_limpo = re.sub(r"\D", "", str(cnpj)).zfill(14)
+    texto_captcha = solucao.texto
+
+    # --- PREENCHE O CAPTCHA (campo id 'mainForm:txtCaptcha') ---
+    cap = page.locator(SEL_CAPTCHA)
+    ESPERAS.visivel(cap, "formulario")
+    ESPERAS.condicao(page, JS_CAMPO_EDITAVEL, "formulario", arg=SEL_CAPTCHA)
+    try:
+        cap.click()
+        cap.fill("")
+        cap.fill(texto_captcha)
+        cap.press("Tab")
+    except Exception as e:
+        logger.debug(f"Falha ao digitar no captcha: {e}")
+    try:
+        val_cap = cap.input_value(timeout=1000)
+    except Exception:
+        val_cap = ""
+    esperado = re.sub(r"\\W", "", texto_captcha or "").strip()
+    recebido = re.sub(r"\\W", "", val_cap or "").strip()
+    if recebido != esperado and esperado:
+        try:
+            page.evaluate(JS_FORCAR_VALOR, [SEL_CAPTCHA, esperado])
+            logger.info("Captcha setado via JS (fallback).")
+        except Exception as e:
+            logger.warning(f"Fallback JS no captcha falhou: {e}")
+
+    # --- Consultar ---
+    page.get_by_role("button", name=re.compile("Consultar", re.I)).click()
+    ESPERAS.carregamento(page, "consulta", "networkidle")
+
+    # Verifica se apareceu o link do certificado
+    # Verifica se apareceu o link do certificado pelo ID específico
+    link_cert = page.locator("#mainForm\\:j_id51")
+
+    try:
+        ESPERAS.visivel(link_cert, "link")
+    except PWTimeout:
+        screenshot_err = OUTPUT_DIR / f"crf_{cnpj_limpo}_erro_consulta.png"
+        page.screenshot(path=str(screenshot_err), full_page=True)
+        confirmar_captcha(ABA, solucao, False, cnpj=cnpj_limpo)
+        logger.warning(f"{cnpj_limpo} → Consulta não retornou link do certificado (tentativa {tentativas}/{MAX_TENTATIVAS_CNPJ}).")
+        return False
+
+    # Segue para o certificado (captcha aceito)
+    confirmar_captcha(ABA, solucao, True, captcha_path, cnpj_limpo)
+    link_cert.click()
+    ESPERAS.carregamento(page, "detalhe", "networkidle")
+
+    # Pode abrir nova aba ou ficar na mesma (o evento é aguardado a partir do clique)
+    temp_img = OUTPUT_DIR / f"crf_{cnpj_limpo}_certidao.png"
+    temp_pdf = OUTPUT_DIR / f"crf_{cnpj_limpo}_certidao.pdf"
+    try:
+        with ESPERAS.evento(context, "page", "nova_aba") as nova:
+            try:
+                page.get_by_role("button", name=re.compile("Visualizar", re.I)).click()
+            except Exception:
+                page.locator("#mainForm\\:btnVisualizar").click()
+    except PWTimeout:
+        cert_page = page
+    else:
+        cert_page = nova.value
+        ESPERAS.carregamento(cert_page, "certidao", "networkidle")
+
+    # Evidências
+    try:
+        cert_page.screenshot(path=str(temp_img), full_page=True)
+    except Exception as e:
+        logger.debug(f"Falha ao tirar screenshot: {e}")
+    try:
+        cert_page.pdf(path=str(temp_pdf), format="A4")
+    except Exception:
+        pass
+
+    # Validade (HTML): padrões do CRF em extracao.PADROES, vale a data final
+    dados = extrair_certidao_html(cert_page.content(), ABA)
+    salvar_validade_status_na_planilha(
+        cnpj_limpo, dados.validade or None, "OK",
+        tentativas=tentativas, duracao_seg=round(time.monotonic() - _INICIO.pop(cnpj_limpo, time.monotonic()), 1),
+    )
+    logger.success(f"CNPJ {cnpj_limpo} → Sucesso (status OK, {dados.resumo()})")
+    return True
+
+
+def registrar_falha(cnpj: str, tentativas: int, erro: Exception | None = None):
+    # ERRO: a última tentativa terminou em exceção; FALHA: o portal recusou todas
+    cnpj_limpo = re.sub(r"\D", "", str(cnpj)).zfill(14)
+    salvar_validade_status_na_planilha(
+        cnpj_limpo, None, "ERRO" if erro else "FALHA",
+        tentativas=tentativas, duracao_seg=round(time.monotonic() - _INICIO.pop(cnpj_limpo, time.monotonic()), 1),
+    )
 
-def salvar_validade_status_na_planilha(cnpj: str, validade: str | None, status: str):
-    wb, ws = _abrir_ws(PLANILHA, ABA)
-    colunas = _mapear_cabecalhos(ws)
 
-    # Garante coluna VALIDADE e STATUS existirem
-    if COL_CNPJ not in colunas:
-        raise ValueError(f"Coluna '{COL_CNPJ}' não encontrada na aba {ABA}.")
-    if COL_VALIDADE not in colunas:
-        # cria VALIDADE se não existir
-        nova_idx = ws.max_column + 1
-        ws.cell(row=1, column=nova_idx, value=COL_VALIDADE)
-        colunas[COL_VALIDADE] = nova_idx
+# =====================
+# Fluxo de um CNPJ (FGTS/CRF)
+# =====================
 
-    _garantir_coluna_status(ws, colunas)
+def processar_cnpj(page, context, cnpj: str):
+    cnpj_limpo = re.sub(r"\D", "", str(cnpj)).zfill(14)
+    erro = None
 
-    idx_cnpj = colunas[COL_CNPJ]
-    idx_validade = colunas[COL_VALIDADE]
-    idx_status = colunas[COL_STATUS]
+    for tentativas in range(1, MAX_TENTATIVAS_CNPJ + 1):
+        try:
+            captcha_path = preparar_captcha(page, cnpj_limpo)
+            solucao = resolver_captcha(captcha_path)
+            if concluir_consulta(page, context, cnpj_limpo, captcha_path, solucao, tentativas):
+                return
+            erro = None
+        except Exception as e:
+            motivo = f"{type(e).__name__}: {e}"
+            logger.error(f"{cnpj_limpo} → ERRO: {motivo}")
+            traceback.print_exc()
+            erro = e
 
-    for row in ws.iter_rows(min_row=2):
-        val = str(row[idx_cnpj - 1].value)
-        if re.sub(r"\D", "", str(val)).zfill(14) == re.sub(r"\D", "", str(cnpj)).zfill(14):
-            if validade:
-                row[idx_validade - 1].value = validade
-            row[idx_status - 1].value = status
-            break
+    registrar_falha(cnpj_limpo, MAX_TENTATIVAS_CNPJ, erro)
 
-    wb.save(PLANILHA)
-    wb.close()
 
 # =====================
-# 2Captcha – image captcha
+# Fluxo de um CNPJ (motor assíncrono)
 # =====================
 
-def resolver_captcha_2captcha(caminho_imagem: Path, api_key: str) -> str:
-    with open(caminho_imagem, "rb") as f:
-        b64 = base64.b64encode(f.read()).decode("utf-8")
-
-    payload = {"key": api_key, "method": "base64", "body": b64, "json": 1}
-    resp = requests.post("http://2captcha.com/in.php", data=payload, timeout=40)
-    resp.raise_for_status()
-    data = resp.json()
-    if data.get("status") != 1:
-        raise RuntimeError(f"Falha ao enfileirar captcha: {data}")
-
-    captcha_id = data["request"]
-
-    for _ in range(MAX_POLLS_2CAPTCHA):
-        time.sleep(POLLING_2CAPTCHA_SEG)
-        res = requests.get(
-            "http://2captcha.com/res.php",
-            params={"key": api_key, "action": "get", "id": captcha_id, "json": 1},
-            timeout=40,
-        )
-        res.raise_for_status()
-        ans = res.json()
-        if ans.get("status") == 1:
-            return ans["request"].strip()
-        if ans.get("request") != "CAPCHA_NOT_READY":
-            raise RuntimeError(f"Erro 2Captcha: {ans}")
+async def digitar_async(page, sel: str, valor: str, esperado: str) -> None:
+    """Digita no campo; se o valor lido não bater com `esperado`, grava via JS."""
+    campo = page.locator(sel)
+    try:
+        await campo.click()
+        await campo.fill("")
+        await campo.fill(valor)
+        await campo.press("Tab")
+    except Exception as e:
+        logger.debug(f"Falha ao digitar em {sel}: {e}")
+    try:
+        lido = await campo.input_value(timeout=1000)
+    except Exception:
+        lido = ""
+    if esperado and re.sub(r"\W", "", lido) != esperado:
+        try:
+            await page.evaluate(JS_FORCAR_VALOR, [sel, esperado])
+            logger.info(f"Valor de {sel} forçado via JS.")
+        except Exception as e:
+            logger.warning(f"Fallback JS em {sel} falhou: {e}")
+
+
+async def preparar_captcha_async(page, cnpj_limpo: str) -> bytes:
+    logger.info(f"Consultando CRF (FGTS) – CNPJ {cnpj_limpo}")
+    await ESPERAS.navegar_async(page, URL_CRF)
+
+    async def por_label():
+        await page.get_by_label(re.compile(r"\bCNPJ\b", re.I)).check()
+        return True
+
+    async def texto_label():
+        lbl = page.locator("label:has-text('CNPJ')").first
+        await ESPERAS.visivel_async(lbl, "formulario")
+        await lbl.click()
+        return True
+
+    async def xpath_label():
+        await page.locator("xpath=//label[contains(normalize-space(),'CNPJ')]").first.click()
+        return True
+
+    async def js():
+        return await page.evaluate(JS_RADIO_CNPJ)
+
+    await ESTRATEGIAS_RADIO.executar_async({
+        "label": por_label,
+        "texto_label": texto_label,
+        "xpath_label": xpath_label,
+        "js": js,
+    })
+
+    await ESPERAS.visivel_async(page.locator(SEL_INSCRICAO), "formulario")
+    await ESPERAS.condicao_async(page, JS_CAMPO_EDITAVEL, "formulario", arg=SEL_INSCRICAO)
+    await digitar_async(page, SEL_INSCRICAO, cnpj_limpo, cnpj_limpo)
+
+    await ESPERAS.condicao_async(page, JS_CAPTCHA_PRONTO, "captcha")
+    src = await page.locator("img[alt='Codigo2']").first.get_attribute("src")
+    if not src.startswith("data:image"):
+        raise ValueError("A imagem captcha não está em base64 embutido!")
+    return base64.b64decode(src.split(",")[1])
+
+
+async def concluir_consulta_async(page, context, cnpj_limpo: str, imagem: bytes, solucao: Solucao, tentativas: int) -> bool:
+    await ESPERAS.visivel_async(page.locator(SEL_CAPTCHA), "formulario")
+    await ESPERAS.condicao_async(page, JS_CAMPO_EDITAVEL, "formulario", arg=SEL_CAPTCHA)
+    await digitar_async(page, SEL_CAPTCHA, solucao.texto, re.sub(r"\W", "", solucao.texto or ""))
+
+    await page.get_by_role("button", name=re.compile("Consultar", re.I)).click()
+    await ESPERAS.carregamento_async(page, "consulta", "networkidle")
+
+    link_cert = page.locator("#mainForm\\:j_id51")
+    try:
+        await ESPERAS.visivel_async(link_cert, "link")
+    except PWTimeoutAsync:
+        await page.screenshot(path=str(OUTPUT_DIR / f"crf_{cnpj_limpo}_erro_consulta.png"), full_page=True)
+        await asyncio.to_thread(confirmar_captcha, ABA, solucao, False, cnpj=cnpj_limpo)
+        logger.warning(f"{cnpj_limpo} → Consulta não retornou link do certificado (tentativa {tentativas}/{MAX_TENTATIVAS_CNPJ}).")
+        return False
+
+    await asyncio.to_thread(confirmar_captcha, ABA, solucao, True, imagem, cnpj_limpo)
+    await link_cert.click()
+    await ESPERAS.carregamento_async(page, "detalhe", "networkidle")
+
+    try:
+        async with ESPERAS.evento_async(context, "page", "nova_aba") as nova:
+            try:
+                await page.get_by_role("button", name=re.compile("Visualizar", re.I)).click()
+            except Exception:
+                await page.locator("#mainForm\\:btnVisualizar").click()
+    except PWTimeoutAsync:
+        cert_page = page
+    else:
+        cert_page = await nova.value
+        await ESPERAS.carregamento_async(cert_page, "certidao", "networkidle")
+
+    try:
+        await cert_page.screenshot(path=str(OUTPUT_DIR / f"crf_{cnpj_limpo}_certidao.png"), full_page=True)
+    except Exception as e:
+        logger.debug(f"Falha ao tirar screenshot: {e}")
+    try:
+        await cert_page.pdf(path=str(OUTPUT_DIR / f"crf_{cnpj_limpo}_certidao.pdf"), format="A4")
+    except Exception:
+        pass
+
+    # extração e gravação são bloqueantes: saem do event loop
+    dados = await asyncio.to_thread(extrair_certidao_html, await cert_page.content(), ABA)
+    await asyncio.to_thread(
+        salvar_validade_status_na_planilha,
+        cnpj_limpo, dados.validade or None, "OK",
+        tentativas=tentativas, duracao_seg=round(time.monotonic() - _INICIO.pop(cnpj_limpo, time.monotonic()), 1),
+    )
+    logger.success(f"CNPJ {cnpj_limpo} → Sucesso (status OK, {dados.resumo()})")
+    return True
+
+
+async def processar_cnpj_async(motor, page, context, cnpj: str):
+    cnpj_limpo = re.sub(r"\D", "", str(cnpj)).zfill(14)
+    _INICIO.setdefault(cnpj_limpo, time.monotonic())
+    erro = None
+
+    for tentativas in range(1, MAX_TENTATIVAS_CNPJ + 1):
+        try:
+            imagem = await preparar_captcha_async(page, cnpj_limpo)
+            solucao = await motor.resolver_captcha_imagem(imagem, portal=ABA)
+            logger.info(f"{solucao.fonte} → '{solucao.texto}' ({solucao.latencia}s)")
+            if await concluir_consulta_async(page, context, cnpj_limpo, imagem, solucao, tentativas):
+                return
+            erro = None
+        except Exception as e:
+            logger.error(f"{cnpj_limpo} → ERRO: {type(e).__name__}: {e}")
+            erro = e
+
+    await asyncio.to_thread(registrar_falha, cnpj_limpo, MAX_TENTATIVAS_CNPJ, erro)
 
-    raise TimeoutError("Timeout aguardando solução do 2Captcha")
-
-# =====================
-# Coleta de validade (página HTML final)
-# =====================
-
-def extrair_validade_do_html(page_html: str) -> str | None:
-    m = re.search(REGEX_VALIDADE_FINAL, page_html, flags=re.IGNORECASE)
-    if m:
-        return m.group(1)  # data final
-    return None
 
 # =====================
 # Fluxo principal (FGTS/CRF)
 # =====================
 
-def processar_crf():
+def processar_crf(cnpjs: list[str] | None = None):
     logger.add("execucaocrf.log", rotation="1 MB")
     logger.info(f"Iniciando automação da aba: {ABA}")
 
@@ -137,240 +450,48 @@ def processar_crf():
         logger.error("Defina API_KEY_2CAPTCHA (env API_KEY_2CAPTCHA) antes de executar.")
         return
 
-    df = pd.read_excel(PLANILHA, sheet_name=ABA, dtype=str)
+    df = ESTADO.carregar_aba(ABA, PLANILHA)
+    if cnpjs is not None:
+        df = filtrar_cnpjs(df, cnpjs)
+    elif MODO_INCREMENTAL:
+        df = selecionar_pendentes(df, MARGEM_RENOVACAO_DIAS)
     df = df[[COL_RAZAO, COL_CNPJ]].dropna(subset=[COL_CNPJ])
     cnpjs = df[COL_CNPJ].drop_duplicates().tolist()
 
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=HEADLESS, args=["--start-maximized"])
-        context = browser.new_context(accept_downloads=True, no_viewport=True)
-        page = context.new_page()
-
-        for cnpj in cnpjs:
-            cnpj_limpo = re.sub(r"\D", "", str(cnpj)).zfill(14)
-            tentativas = 0
-            status_final = "FALHA"
-            validade_final = None
-
-            while tentativas < MAX_TENTATIVAS_CNPJ:
-                tentativas += 1
-                try:
-                    logger.info(f"Consultando CRF (FGTS) – CNPJ {cnpj_limpo} [tentativa {tentativas}/{MAX_TENTATIVAS_CNPJ}]")
-                    page.goto(URL_CRF, timeout=TIMEOUT)
-                    page.wait_for_load_state("domcontentloaded", timeout=1500)
-
-                    # --- Seleciona CNPJ e preenche inscrição ---
-                    radio_ok = False
-                    try:
-                        page.get_by_label(re.compile(r"\bCNPJ\b", re.I)).check()
-                        radio_ok = True
-                    except Exception:
-                        try:
-                            lbl = page.locator("label:has-text('CNPJ')").first
-                            lbl.wait_for(state="visible", timeout=8000)
-                            lbl.click()
-                            radio_ok = True
-                        except Exception:
-                            try:
-                                page.locator("xpath=//label[contains(normalize-space(),'CNPJ')]").first.click()
-                                radio_ok = True
-                            except Exception:
-                                radio_ok = False
-
-                    if not radio_ok:
-                        try:
-                            page.evaluate("""
-                                (() => {
-                                    const lbl = [...document.querySelectorAll('label')]
-                                      .find(l => /\\bCNPJ\\b/i.test(l.textContent || ''));
-                                    if (!lbl) return false;
-                                    const forId = lbl.getAttribute('for');
-                                    let input = null;
-                                    if (forId) input = document.getElementById(forId);
-                                    if (!input) {
-                                      input = lbl.previousElementSibling && lbl.previousElementSibling.type === 'radio'
-                                        ? lbl.previousElementSibling
-                                        : (lbl.nextElementSibling && lbl.nextElementSibling.type === 'radio'
-                                          ? lbl.nextElementSibling : null);
-                                    }
-                                    if (!input) return false;
-                                    input.checked = true;
-                                    input.dispatchEvent(new Event('change', {bubbles: true}));
-                                    input.dispatchEvent(new Event('input', {bubbles: true}));
-                                    return true;
-                                })();
-                            """)
-                        except Exception:
-                            pass
-
-                    campo = page.locator("#mainForm\\:txtInscricao1")
-                    campo.wait_for(state="visible", timeout=8000)
-                    page.wait_for_timeout(400)
-                    try:
-                        campo.click()
-                        campo.fill("")
-                        campo.fill(cnpj_limpo)
-                        campo.press("Tab")
-                    except Exception as e:
-                        logger.debug(f"Falha ao digitar no campo Inscrição: {e}")
-
-                    try:
-                        valor = campo.input_value(timeout=2000)
-                    except Exception:
-                        valor = ""
-                    if re.sub(r"\\D", "", valor) != cnpj_limpo:
-                        try:
-                            page.evaluate(
-                                """(sel, val) => {
-                                    const el = document.querySelector(sel);
-                                    if (!el) return;
-                                    el.focus();
-                                    el.value = val;
-                                    el.dispatchEvent(new Event('input', { bubbles: true }));
-                                    el.dispatchEvent(new Event('change', { bubbles: true }));
-                                    el.blur();
-                                }""",
-                                "#mainForm\\:txtInscricao1", cnpj_limpo
-                            )
-                            logger.info("Valor do campo Inscrição forçado via JS.")
-                        except Exception as e:
-                            logger.warning(f"Fallback JS para Inscrição falhou: {e}")
-
-                    # --- Captura e resolve o captcha (2Captcha image) ---
-                    time.sleep(0.3)
-                    # Captura base64 direto da tag <img>
-                    img_element = page.locator("img[alt='Codigo2']").first
-                    base64_src = img_element.get_attribute("src")
-
-                    if not base64_src.startswith("data:image"):
-                        raise ValueError("A imagem captcha não está em base64 embutido!")
-
-                    # Extrai base64 puro (remove cabeçalho 'data:image/png;base64,')
-                    base64_data = base64_src.split(",")[1]
-                    captcha_path = OUTPUT_DIR / f"captcha_{cnpj_limpo}.png"
-
-                    # Decodifica e salva localmente
-                    with open(captcha_path, "wb") as f:
-                        f.write(base64.b64decode(base64_data))
-
-
-                    texto_captcha = resolver_captcha_2captcha(captcha_path, API_KEY_2CAPTCHA)
-                    logger.info(f"2Captcha → '{texto_captcha}'")
-
-                    # --- PREENCHE O CAPTCHA (campo id 'mainForm:txtCaptcha') ---
-                    sel_cap = "#mainForm\\:txtCaptcha"
-                    cap = page.locator(sel_cap)
-                    cap.wait_for(state="visible", timeout=8000)
-                    page.wait_for_timeout(150)
-                    try:
-                        cap.click()
-                        cap.fill("")
-                        cap.fill(texto_captcha)
-                        cap.press("Tab")
-                    except Exception as e:
-                        logger.debug(f"Falha ao digitar no captcha: {e}")
-                    try:
-                        val_cap = cap.input_value(timeout=1000)
-                    except Exception:
-                        val_cap = ""
-                    esperado = re.sub(r"\\W", "", texto_captcha or "").strip()
-                    recebido = re.sub(r"\\W", "", val_cap or "").strip()
-                    if recebido != esperado and esperado:
-                        try:
-                            page.evaluate(
-                                """(sel, val) => {
-                                    const el = document.querySelector(sel);
-                                    if (!el) return;
-                                    el.focus();
-                                    el.value = val;
-                                    el.dispatchEvent(new Event('input', { bubbles: true }));
-                                    el.dispatchEvent(new Event('change', { bubbles: true }));
-                                    el.blur();
-                                }""",
-                                sel_cap, esperado
-                            )
-                            logger.info("Captcha setado via JS (fallback).")
-                        except Exception as e:
-                            logger.warning(f"Fallback JS no captcha falhou: {e}")
-
-                    # --- Consultar ---
-                    page.get_by_role("button", name=re.compile("Consultar", re.I)).click()
-                    page.wait_for_load_state("networkidle", timeout=20000)
-
-                    # Verifica se apareceu o link do certificado
-                    # Verifica se apareceu o link do certificado pelo ID específico
-                    link_cert = page.locator("#mainForm\\:j_id51")
-
-                    try:
-                        link_cert.wait_for(state="visible", timeout=3000)
-                    except PWTimeout:
-                        screenshot_err = OUTPUT_DIR / f"crf_{cnpj_limpo}_erro_consulta.png"
-                        page.screenshot(path=str(screenshot_err), full_page=True)
-                        logger.warning("Consulta não retornou link do certificado; tentando novamente…")
-                        try:
-                            img_element.click()
-                        except Exception:
-                            pass
-                        time.sleep(1.2)
-                        continue
-
-                    # Segue para o certificado
-                    link_cert.click()
-                    page.wait_for_load_state("networkidle", timeout=15000)
-
-                    try:
-                        page.get_by_role("button", name=re.compile("Visualizar", re.I)).click()
-                    except Exception:
-                        page.locator("#mainForm\\:btnVisualizar").click()
-
-                    # Pode abrir nova aba ou ficar na mesma
-                    temp_img = OUTPUT_DIR / f"crf_{cnpj_limpo}_certidao.png"
-                    temp_pdf = OUTPUT_DIR / f"crf_{cnpj_limpo}_certidao.pdf"
-                    try:
-                        with context.expect_page(timeout=8000) as nova:
-                            pass
-                    except PWTimeout:
-                        cert_page = page
-                    else:
-                        cert_page = nova.value
-                        cert_page.wait_for_load_state("networkidle", timeout=1500)
-
-                    # Evidências
-                    try:
-                        cert_page.screenshot(path=str(temp_img), full_page=True)
-                    except Exception as e:
-                        logger.debug(f"Falha ao tirar screenshot: {e}")
-                    try:
-                        cert_page.pdf(path=str(temp_pdf), format="A4")
-                    except Exception:
-                        pass
-
-                    # Validade (HTML)
-                    html = cert_page.content()
-                    validade = extrair_validade_do_html(html)
-                    if validade:
-                        validade_final = validade
-
-                    status_final = "OK"
-                    logger.success(f"CNPJ {cnpj_limpo} → Sucesso (status OK)")
-                    break
-
-                except Exception as e:
-                    motivo = f"{type(e).__name__}: {e}"
-                    logger.error(f"{cnpj_limpo} → ERRO: {motivo}")
-                    traceback.print_exc()
-                    status_final = "ERRO"
-
-            # Atualiza planilha
-            salvar_validade_status_na_planilha(cnpj_limpo, validade_final, status_final)
-
-        context.close()
-        browser.close()
+    navegador = {
+        "workers": WORKERS,
+        "headless": HEADLESS,
+        "opcoes_launch": {"args": ["--start-maximized"]},
+        "opcoes_contexto": {"accept_downloads": True, "no_viewport": True},
+        "nome": ABA,
+    }
+    if MOTOR == "async":
+        motor = MotorAsync(
+            CONCORRENCIA_ASYNC,
+            headless=HEADLESS,
+            opcoes_launch=navegador["opcoes_launch"],
+            opcoes_contexto=navegador["opcoes_contexto"],
+            nome=ABA,
+        )
+        motor.executar(cnpjs, processar_cnpj_async)
+    elif MOTOR == "pipeline":
+        executar_em_pipeline(
+            cnpjs,
+            preparar=preparar_captcha,
+            resolver=resolver_captcha,
+            concluir=concluir_consulta,
+            desistir=registrar_falha,
+            max_tentativas=MAX_TENTATIVAS_CNPJ,
+            **navegador,
+        )
+    else:
+        executar_em_paralelo(cnpjs, processar_cnpj, **navegador)
 
+    GRAVADOR.flush()
     logger.info("Processo concluído (CRF/FGTS).")
 
 
 if __name__ == "__main__":
-    processar_crf()
+    processar_crf(cnpjs=sys.argv[1:] or None)
@@ -1,15 +1,18 @@
 from playwright.sync_api import sync_playwright, TimeoutError as PWTimeout
-import time
-import requests
 import re
 import traceback
 from datetime import datetime
 from pathlib import Path
 
-import pandas as pd
-import fitz  # PyMuPDF
 from loguru import logger
-from openpyxl import load_workbook
+
+from agenda import selecionar_pendentes
+from captcha import PoolTokens, cliente_2captcha
+from documentos import gravar_atomico
+from esperas import Esperas
+from estado import EstadoCertidoes
+from extracao import extrair_certidao
+from planilha import GravadorPlanilha
 
 # === Configurações (TJAM Falência) ===
 PLANILHA = Path("base_certidoes.xlsx")
@@ -21,7 +24,13 @@ OUTPUT_DIR = Path("certidoes_baixadas") / ABA.replace(" ", "_")
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
 URL_SITE = 'https://consultasaj.tjam.jus.br/sco/abrirCadastro.do'
-REGEX_VALIDADE = r"VÁLIDA ATÉ:\s*(\d{2}/\d{2}/\d{4})"
+MODO_INCREMENTAL = True
+MARGEM_RENOVACAO_DIAS = 7
+TOKENS_ANTECIPADOS = 4  # reCAPTCHAs resolvidos à frente do envio dos formulários
+ORCAMENTO_ESPERAS = {"envio": 30, "caixa": 30, "email": 15, "nova_aba": 15}  # segundos por etapa
+ESTADO = EstadoCertidoes()
+ESPERAS = Esperas(ABA, ORCAMENTO_ESPERAS)
+GRAVADOR = GravadorPlanilha(PLANILHA)
 
 # === Config Webmail / Roundcube ===
 OUTPUT_EMAIL_DIR = Path("certidoes_email")
@@ -29,61 +38,27 @@ OUTPUT_EMAIL_DIR.mkdir(parents=True, exist_ok=True)
 
 ASSUNTO_CERTIDAO = "Pedido de Certidão disponível para Download"
 RE_LINK_TJAM = re.compile(r"^https://consultasaj\.tjam\.jus\.br", re.I)
+SEL_LISTA_EMAILS = "#messagelist"
+SEL_CORPO_EMAIL = "#messagebody"
 
 # === Utilitários ===
 def normalizar_cnpj(cnpj: str) -> str:
     return re.sub(r"\D", "", str(cnpj)).zfill(14)
 
-def extrair_validade_pdf(caminho_pdf: Path) -> str:
-    try:
-        with fitz.open(caminho_pdf) as doc:
-            texto = "\n".join(page.get_text() for page in doc)
-        match = re.search(REGEX_VALIDADE, texto, re.IGNORECASE)
-        if match:
-            return match.group(1)
-    except Exception as e:
-        logger.warning(f"Erro ao ler validade do PDF {caminho_pdf.name}: {e}")
-    return ""
-
-def salvar_valor_na_planilha(cnpj: str, nova_data: str, caminho: Path, aba: str):
-    wb = load_workbook(caminho)
-    ws = wb[aba]
-    colunas = {cell.value: idx for idx, cell in enumerate(next(ws.iter_rows(min_row=1, max_row=1)), start=1)}
-    idx_cnpj = colunas.get(COL_CNPJ)
-    idx_validade = colunas.get(COL_VALIDADE)
-
-    if not idx_cnpj or not idx_validade:
-        logger.error("Coluna CNPJ ou VALIDADE CERTIDAO não encontrada.")
-        return
-
-    for row in ws.iter_rows(min_row=2):
-        val = str(row[idx_cnpj - 1].value)
-        if normalizar_cnpj(val) == normalizar_cnpj(cnpj):
-            row[idx_validade - 1].value = nova_data
-            break
-
-    wb.save(caminho)
-    wb.close()
-
-# === 2Captcha ===
-def solicitar_captcha(api_key, sitekey, url):
-    payload = {'key': api_key, 'method': 'userrecaptcha', 'googlekey': sitekey, 'pageurl': url, 'json': 1}
-    resposta = requests.post('http://2captcha.com/in.php', data=payload)
-    return resposta.json().get('request')
-
-def obter_resultado(api_key, captcha_id, tentativas=30, intervalo=7):
-    for tentativa in range(tentativas):
-        time.sleep(intervalo)
-        payload = {'key': api_key, 'action': 'get', 'id': captcha_id, 'json': 0}
-        resposta = requests.get('http://2captcha.com/res.php', params=payload)
-        print(f"[DEBUG] Tentativa {tentativa+1} - Retorno da API: {resposta.text}")
-        if 'OK|' in resposta.text:
-            return resposta.text.split('|')[1]
-        elif 'CAPCHA_NOT_READY' in resposta.text:
-            continue
-        else:
-            raise ValueError(f"[2Captcha] Resposta inesperada: {resposta.text}")
-    raise TimeoutError("Captcha não resolvido após várias tentativas.")
+def salvar_valor_na_planilha(cnpj: str, nova_data: str, **detalhes):
+    ESTADO.registrar(ABA, cnpj, validade=nova_data, **detalhes)
+    GRAVADOR.registrar(ABA, cnpj, {COL_VALIDADE: nova_data})
+
+def registrar_certidao(cnpj: str | None, destino: Path, pdf_bytes: bytes):
+    # a validade do PDF recebido por e-mail é o que o modo incremental usa na próxima execução
+    dados = extrair_certidao(pdf_bytes, ABA)
+    if not dados.validade:
+        logger.warning(f"[Webmail] {destino.name}: não foi possível extrair validade.")
+    elif cnpj is None:
+        logger.warning(f"[Webmail] {destino.name}: CNPJ não identificado no link; validade {dados.validade} não registrada.")
+    else:
+        salvar_valor_na_planilha(cnpj, dados.validade, pdf_path=destino)
+        logger.success(f"[Webmail] {cnpj} → {dados.resumo()}")
 
 # === TJAM: preenchimento e envio ===
 def automatizar_com_token(token_resolvido, cnpj: str, razao_social: str, context):
@@ -109,7 +84,11 @@ def automatizar_com_token(token_resolvido, cnpj: str, razao_social: str, context
     page.check("input[type='checkbox'][value='true']")
     page.click("input[name='pbEnviar']")
 
-    time.sleep(4)
+    # a página de resultado traz o botão "Novo"; sem ele, o print fica como evidência do que veio
+    try:
+        ESPERAS.visivel(page.locator("input[name='pbNovo']"), "envio")
+    except PWTimeout:
+        logger.warning(f"[TJAM] {cnpj}: resultado do envio não apareceu em {ORCAMENTO_ESPERAS['envio']}s.")
     filename = f"{normalizar_cnpj(cnpj)}.png"
     page.screenshot(path=str(OUTPUT_DIR / filename), full_page=True)
 
@@ -121,6 +100,12 @@ def automatizar_com_token(token_resolvido, cnpj: str, razao_social: str, context
     page.close()
 
 # === Roundcube: baixar as certidões do dia (com print/pdf da página do TJAM) ===
+def aguardar_caixa(page):
+    try:
+        ESPERAS.visivel(page.locator(SEL_LISTA_EMAILS), "caixa")
+    except PWTimeout:
+        logger.warning("[Webmail] Lista de e-mails não apareceu; seguindo.")
+
 def baixar_certidoes_email(context):
     page = context.new_page()
     logger.info("[Webmail] Acessando login...")
@@ -144,7 +129,7 @@ def baixar_certidoes_email(context):
         page.get_by_role("link", name="Caixa de entrada").click()
     except Exception:
         pass
-    time.sleep(2)
+    aguardar_caixa(page)
 
     hoje_label = "Hoje"  # Roundcube mostra "Hoje HH:MM"
     processed_ids = set()
@@ -182,14 +167,17 @@ def baixar_certidoes_email(context):
             except Exception:
                 row.click(click_count=2)
 
-            time.sleep(2)
+            try:
+                ESPERAS.primeiro("email", corpo=page.locator(SEL_CORPO_EMAIL), link=page.get_by_role("link", name=RE_LINK_TJAM))
+            except PWTimeout:
+                pass
 
             # confere se estamos vendo a mensagem certa
             try:
                 if not page.get_by_text(ASSUNTO_CERTIDAO).first.is_visible():
                     # volta e segue
                     page.get_by_role("link", name="Caixa de entrada").click()
-                    time.sleep(1)
+                    aguardar_caixa(page)
                     continue
             except Exception:
                 pass
@@ -202,13 +190,13 @@ def baixar_certidoes_email(context):
                     page.get_by_role("link", name="Caixa de entrada").click()
                 except Exception:
                     page.go_back()
-                time.sleep(1)
+                aguardar_caixa(page)
                 processed_ids.add(rid)
                 encontrado_para_processar = True
                 continue
 
             try:
-                with context.expect_page(timeout=15000) as nova_pg_evt:
+                with ESPERAS.evento(context, "page", "nova_aba") as nova_pg_evt:
                     link_loc.first.click()
                 cert_page = nova_pg_evt.value
             except PWTimeout:
@@ -217,7 +205,7 @@ def baixar_certidoes_email(context):
                     page.get_by_role("link", name="Caixa de entrada").click()
                 except Exception:
                     page.go_back()
-                time.sleep(1)
+                aguardar_caixa(page)
                 processed_ids.add(rid)
                 encontrado_para_processar = True
                 continue
@@ -235,13 +223,17 @@ def baixar_certidoes_email(context):
             ts = datetime.now().strftime("%Y%m%d_%H%M%S")
             destino = OUTPUT_EMAIL_DIR / f"tjam_falencia_{cnpj_num}_{ts}.pdf"
             try:
-                cert_page.pdf(path=str(destino), format="A4")
+                pdf_bytes = cert_page.pdf(format="A4")
+                gravar_atomico(destino, pdf_bytes)
                 logger.success(f"[Webmail] Certidão salva: {destino}")
             except Exception as e:
                 # fallback: screenshot em PNG
+                pdf_bytes = None
                 destino_png = OUTPUT_EMAIL_DIR / f"tjam_falencia_{cnpj_num}_{ts}.png"
                 cert_page.screenshot(path=str(destino_png), full_page=True)
                 logger.warning(f"[Webmail] Falha no PDF ({e}). Salvo screenshot: {destino_png}")
+            if pdf_bytes:
+                registrar_certidao(cnpj_num if m else None, destino, pdf_bytes)
 
             # fecha a aba da certidão
             try:
@@ -254,7 +246,7 @@ def baixar_certidoes_email(context):
                 page.get_by_role("link", name="Caixa de entrada").click()
             except Exception:
                 page.go_back()
-            time.sleep(1)
+            aguardar_caixa(page)
 
             processed_ids.add(rid)
             encontrado_para_processar = True
@@ -267,12 +259,22 @@ def baixar_certidoes_email(context):
 
 # === Execução principal (com reprocessamento de falhas no captcha) ===
 if __name__ == '__main__':
-    df = pd.read_excel(PLANILHA, sheet_name=ABA)
+    df = ESTADO.carregar_aba(ABA, PLANILHA)
+    if MODO_INCREMENTAL:
+        df = selecionar_pendentes(df, MARGEM_RENOVACAO_DIAS)
     df[COL_CNPJ] = df[COL_CNPJ].astype(str).apply(normalizar_cnpj)
 
     falhas_captcha = []  # (cnpj, razao)
 
-    with sync_playwright() as p:
+    # o token só depende do sitekey + URL: os próximos já ficam sendo resolvidos enquanto um formulário é enviado
+    tokens = PoolTokens(
+        lambda: cliente_2captcha().recaptcha(SITEKEY, URL_SITE).result().texto,
+        tamanho=TOKENS_ANTECIPADOS,
+        restantes=len(df),
+        nome=ABA,
+    )
+
+    with tokens, sync_playwright() as p:
         browser = p.chromium.launch(headless=False)
         context = browser.new_context(accept_downloads=True)
 
@@ -282,9 +284,7 @@ if __name__ == '__main__':
             razao = row[COL_RAZAO]
 
             try:
-                logger.info(f"[Captcha] Solicitando resolução para CNPJ {cnpj}...")
-                captcha_id = solicitar_captcha(API_KEY_2CAPTCHA, SITEKEY, URL_SITE)
-                token = obter_resultado(API_KEY_2CAPTCHA, captcha_id)
+                token = tokens.obter()
                 logger.info(f"[Captcha] Token recebido. Enviando pedido: {razao}")
                 automatizar_com_token(token, cnpj, razao, context)
             except Exception as e:
@@ -295,10 +295,10 @@ if __name__ == '__main__':
         # 2ª rodada só dos que falharam
         if falhas_captcha:
             logger.info(f"[Reprocessamento] Tentando novamente {len(falhas_captcha)} CNPJ(s).")
+            tokens.demandar(len(falhas_captcha))
             for cnpj, razao in falhas_captcha:
                 try:
-                    captcha_id = solicitar_captcha(API_KEY_2CAPTCHA, SITEKEY, URL_SITE)
-                    token = obter_resultado(API_KEY_2CAPTCHA, captcha_id)
+                    token = tokens.obter()
                     automatizar_com_token(token, cnpj, razao, context)
                     logger.success(f"[Reprocessamento] {cnpj} concluído.")
                 except Exception as e:
@@ -310,5 +310,4 @@ if __name__ == '__main__':
         context.close()
         browser.close()
 
-        print("[3] Token recebido. Automatizando para:", razao)
-        automatizar_com_token(token, cnpj, razao)
+    GRAVADOR.flush()
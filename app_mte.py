@@ -1,15 +1,16 @@
 import re
-import time
-import requests
 import traceback
 from datetime import datetime
 from pathlib import Path
 
 import pandas as pd
-import fitz  # PyMuPDF
 from loguru import logger
 from playwright.sync_api import sync_playwright, TimeoutError as PWTimeout
-from openpyxl import load_workbook
+
+from captcha import PoolTokens, cliente_2captcha
+from esperas import Esperas
+from estado import EstadoCertidoes
+from planilha import GravadorPlanilha
 
 # === Configurações ===
 PLANILHA = Path("base_certidoes.xlsx")
@@ -19,72 +20,20 @@ COL_VALIDADE = "VALIDADE CERTIDÃO"
 COL_RAZAO = "RAZÃO SOCIAL"
 OUTPUT_DIR = Path("certidoes_baixadas") / ABA.replace(" ", "_")
 URL_MTE = "https://eprocesso.sit.trabalho.gov.br/Entrar?ReturnUrl=%2FCertidao%2FEmitir"
+URL_LOGIN_GOVBR = "https://sso.acesso.gov.br/login"  # pageurl do hCaptcha, conhecida antes de abrir o navegador
 TIMEOUT = 40_000
-REGEX_VALIDADE = r"Válida até:\s*(\d{2}/\d{2}/\d{4})"
+ORCAMENTO_ESPERAS = {"hcaptcha": 15}  # segundos por etapa
+ESTADO = EstadoCertidoes()
+ESPERAS = Esperas(ABA, ORCAMENTO_ESPERAS)
+GRAVADOR = GravadorPlanilha(PLANILHA)
 
 # === Funções utilitárias ===
 def normalizar_cnpj(cnpj: str) -> str:
     return re.sub(r"\D", "", str(cnpj)).zfill(14)
 
-def extrair_validade_pdf(caminho_pdf: Path) -> str:
-    try:
-        with fitz.open(caminho_pdf) as doc:
-            texto = "\n".join(page.get_text() for page in doc)
-        match = re.search(REGEX_VALIDADE, texto, re.IGNORECASE)
-        if match:
-            return match.group(1)
-    except Exception as e:
-        logger.warning(f"Erro ao ler validade do PDF {caminho_pdf.name}: {e}")
-    return ""
-
-def salvar_valor_na_planilha(cnpj: str, nova_data: str, caminho: Path, aba: str):
-    wb = load_workbook(caminho)
-    ws = wb[aba]
-    colunas = {cell.value: idx for idx, cell in enumerate(next(ws.iter_rows(min_row=1, max_row=1)), start=1)}
-    idx_cnpj = colunas.get(COL_CNPJ)
-    idx_validade = colunas.get(COL_VALIDADE)
-
-    if not idx_cnpj or not idx_validade:
-        logger.error("Coluna CNPJ ou VALIDADE CERTIDAO não encontrada.")
-        return
-
-    for row in ws.iter_rows(min_row=2):
-        val = str(row[idx_cnpj - 1].value)
-        if normalizar_cnpj(val) == normalizar_cnpj(cnpj):
-            row[idx_validade - 1].value = nova_data
-            break
-
-    wb.save(caminho)
-    wb.close()
-
-# === Funções 2Captcha para hCaptcha ===
-def solicitar_hcaptcha(api_key, sitekey, url):
-    payload = {
-        "key": api_key,
-        "method": "hcaptcha",
-        "sitekey": sitekey,
-        "pageurl": url,
-        "json": 1
-    }
-    resp = requests.post("http://2captcha.com/in.php", data=payload).json()
-    if resp.get("status") != 1:
-        raise RuntimeError(f"[2Captcha] Falha ao enviar captcha: {resp}")
-    return resp["request"]
-
-def obter_resultado(api_key, captcha_id, tentativas=30, intervalo=7):
-    for tentativa in range(tentativas):
-        time.sleep(intervalo)
-        resp = requests.get("http://2captcha.com/res.php", params={
-            "key": api_key,
-            "action": "get",
-            "id": captcha_id,
-            "json": 1
-        }).json()
-        if resp.get("status") == 1:
-            return resp["request"]
-        if resp.get("request") != "CAPCHA_NOT_READY":
-            raise RuntimeError(f"[2Captcha] Erro inesperado: {resp}")
-    raise TimeoutError("Captcha não resolvido a tempo pelo 2Captcha.")
+def salvar_valor_na_planilha(cnpj: str, nova_data: str, **detalhes):
+    ESTADO.registrar(ABA, cnpj, validade=nova_data, **detalhes)
+    GRAVADOR.registrar(ABA, cnpj, {COL_VALIDADE: nova_data})
 
 # === Fluxo principal ===
 def processar_mte():
@@ -93,7 +42,16 @@ def processar_mte():
 
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
-    with sync_playwright() as p:
+    # o hCaptcha do gov.br não depende do CPF: a solução começa enquanto o navegador abre e chega ao login
+    logger.info("Enviando hCaptcha para 2Captcha...")
+    tokens = PoolTokens(
+        lambda: cliente_2captcha().hcaptcha(SITEKEY_HCAPTCHA, URL_LOGIN_GOVBR).result().texto,
+        tamanho=1,
+        restantes=1,
+        nome=ABA,
+    )
+
+    with tokens, sync_playwright() as p:
         browser = p.chromium.launch(headless=False)
         context = browser.new_context(
             user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
@@ -116,12 +74,12 @@ def processar_mte():
             campo_cpf = page.get_by_role("textbox", name="Digite seu CPF")
             campo_cpf.fill("")
             campo_cpf.type(CPF_LOGIN)
-            time.sleep(1)
 
-            # Solicita resolução do hCaptcha
-            logger.info("Enviando hCaptcha para 2Captcha...")
-            captcha_id = solicitar_hcaptcha(API_KEY_2CAPTCHA, SITEKEY_HCAPTCHA, page.url)
-            token_resolvido = obter_resultado(API_KEY_2CAPTCHA, captcha_id)
+            # o token vai no textarea do hCaptcha: espera o widget criá-lo
+            ESPERAS.condicao(page, "() => !!document.querySelector(\"textarea[name='h-captcha-response']\")", "hcaptcha")
+
+            # Token do hCaptcha (já em resolução desde o início)
+            token_resolvido = tokens.obter()
             logger.success("Token hCaptcha resolvido com sucesso!")
 
             # Injeta token no campo h-captcha-response
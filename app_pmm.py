@@ -1,18 +1,22 @@
 import re
-import time
-import base64
+import sys
+import asyncio
 import traceback
-from datetime import datetime
 from pathlib import Path
-import requests
 
-import pandas as pd
-import fitz  
 from loguru import logger
-from playwright.sync_api import sync_playwright, TimeoutError as PWTimeout
-from openpyxl import load_workbook
+from playwright.sync_api import TimeoutError as PWTimeout
+from playwright.async_api import TimeoutError as PWTimeoutAsync
 from uuid import uuid4
 
+from agenda import filtrar_cnpjs, selecionar_pendentes
+from documentos import gravar_atomico
+from estado_app import EstadoApp
+from motor_async import MotorAsync
+from ocr_captcha import confirmar_captcha, resolver_imagem
+from paralelo import executar_em_paralelo
+from pos_processamento import Resultado, Tarefa
+
 # === Configurações ===
 PLANILHA = Path("base_certidoes.xlsx")
 ABA = "PMM"
@@ -21,66 +25,29 @@ COL_VALIDADE = "VALIDADE CERTIDÃO"
 COL_RAZAO = "RAZÃO SOCIAL"
 OUTPUT_DIR = Path("certidoes_baixadas") / ABA.replace(" ", "_")
 URL_PMM = "https://semefatende.manaus.am.gov.br/servicoJanela.php?servico=1412"
-TIMEOUT = 40_000
-REGEX_VALIDADE = r"VÁLIDA ATÉ \s*(\d{2}/\d{2}/\d{4})"
+WORKERS = 2
+MOTOR = "threads"  # ou "async"
+CONCORRENCIA_ASYNC = 10
+MODO_INCREMENTAL = True
+MARGEM_RENOVACAO_DIAS = 7
+ORCAMENTO_ESPERAS = {"abertura": 40, "captcha": 15, "nova_aba": 150, "carregamento": 150}  # segundos por etapa
+APP = EstadoApp(ABA, PLANILHA, ORCAMENTO_ESPERAS, estrategias=("radio_cnpj",))
 
 # === Funções utilitárias ===
 def normalizar_cnpj(cnpj: str) -> str:
     return re.sub(r"\D", "", str(cnpj)).zfill(14)
 
-def extrair_validade_pdf(caminho_pdf: Path) -> str:
-    try:
-        with fitz.open(caminho_pdf) as doc:
-            texto = "\n".join(page.get_text() for page in doc)
-        match = re.search(REGEX_VALIDADE, texto, re.IGNORECASE)
-        if match:
-            return match.group(1)
-    except Exception as e:
-        logger.warning(f"Erro ao ler validade do PDF {caminho_pdf.name}: {e}")
-    return ""
-
-def salvar_valor_na_planilha(cnpj: str, nova_data: str, caminho: Path, aba: str):
-    wb = load_workbook(caminho)
-    ws = wb[aba]
-    colunas = {cell.value: idx for idx, cell in enumerate(next(ws.iter_rows(min_row=1, max_row=1)), start=1)}
-    idx_cnpj = colunas.get(COL_CNPJ)
-    idx_validade = colunas.get(COL_VALIDADE)
-
-    if not idx_cnpj or not idx_validade:
-        logger.error("Coluna CNPJ ou VALIDADE CERTIDAO não encontrada.")
-        return
-
-    for row in ws.iter_rows(min_row=2):
-        val = str(row[idx_cnpj - 1].value)
-        if normalizar_cnpj(val) == normalizar_cnpj(cnpj):
-            row[idx_validade - 1].value = nova_data
-            break
-
-    wb.save(caminho)
-    wb.close()
-
-def resolver_captcha_2captcha(caminho_imagem: Path, api_key: str) -> str:
-    with open(caminho_imagem, "rb") as f:
-        b64 = base64.b64encode(f.read()).decode("utf-8")
-    payload = {"key": api_key, "method": "base64", "body": b64, "json": 1}
-    r = requests.post("http://2captcha.com/in.php", data=payload, timeout=40)
-    r.raise_for_status()
-    data = r.json()
-    if data.get("status") != 1:
-        raise RuntimeError(f"Falha ao enviar captcha: {data}")
-    cap_id = data["request"]
-    for _ in range(40):
-        time.sleep(5)
-        res = requests.get(
-            "http://2captcha.com/res.php",
-            params={"key": api_key, "action": "get", "id": cap_id, "json": 1},
-            timeout=40,
-        ).json()
-        if res.get("status") == 1:
-            return re.sub(r"\W", "", res["request"]).strip()
-        if res.get("request") != "CAPCHA_NOT_READY":
-            raise RuntimeError(f"Erro 2Captcha: {res}")
-    raise TimeoutError("Timeout aguardando solução do 2Captcha")
+def salvar_valor_na_planilha(cnpj: str, nova_data: str, **detalhes):
+    APP.estado.registrar(ABA, cnpj, validade=nova_data, **detalhes)
+    APP.gravador.registrar(ABA, cnpj, {COL_VALIDADE: nova_data})
+
+def registrar_pdf(resultado: Resultado):
+    # roda neste processo quando o pós-processamento termina
+    if resultado.dados.validade:
+        salvar_valor_na_planilha(resultado.cnpj, resultado.dados.validade, pdf_path=resultado.destino)
+        logger.success(f"{resultado.cnpj} → Sucesso: {resultado.dados.resumo()}")
+    else:
+        logger.warning(f"{resultado.cnpj} → Não foi possível extrair validade.")
 
 def _log_frames(page):
     # opcional: ajuda a diagnosticar se há iframes
@@ -92,82 +59,145 @@ def _log_frames(page):
     except Exception:
         pass
 
+# === Cache de frames ===
+class CacheFrames:
+    """
+    Frame onde cada seletor foi achado na navegação atual da página. Qualquer
+    navegação, inclusão ou remoção de frame limpa o cache. Um acerto custa uma
+    consulta (confirma que o elemento segue lá); numa falta, os frames que já
+    tinham outros seletores são consultados antes dos demais.
+    """
+
+    def __init__(self, page):
+        self.page = page
+        self._frames: dict[str, object] = {}
+        self._diagnosticado = False
+        for evento in ("framenavigated", "frameattached", "framedetached"):
+            page.on(evento, self._invalidar)
+
+    def _invalidar(self, _frame=None):
+        self._frames.clear()
+        self._diagnosticado = False
+
+    def diagnosticar(self):
+        # _log_frames uma vez por navegação, não a cada busca
+        if not self._diagnosticado:
+            _log_frames(self.page)
+            self._diagnosticado = True
+
+    def frame_com(self, css: str):
+        fr = self._frames.get(css)
+        if fr is not None:
+            try:
+                if fr.locator(css).count():
+                    return fr
+            except Exception:
+                pass
+            del self._frames[css]
+
+        conhecidos = list(dict.fromkeys(self._frames.values()))
+        for fr in conhecidos + [f for f in self.page.frames if f not in conhecidos]:
+            try:
+                if fr.locator(css).count():
+                    self._frames[css] = fr
+                    return fr
+            except Exception:
+                continue
+        return None
+
+    async def frame_com_async(self, css: str):
+        # mesma busca de frame_com, para páginas da playwright.async_api
+        fr = self._frames.get(css)
+        if fr is not None:
+            try:
+                if await fr.locator(css).count():
+                    return fr
+            except Exception:
+                pass
+            del self._frames[css]
+
+        conhecidos = list(dict.fromkeys(self._frames.values()))
+        for fr in conhecidos + [f for f in self.page.frames if f not in conhecidos]:
+            try:
+                if await fr.locator(css).count():
+                    self._frames[css] = fr
+                    return fr
+            except Exception:
+                continue
+        return None
+
+
+def _cache_frames(page) -> CacheFrames:
+    # o cache fica na própria página: os handlers de page.on prendem o cache à página,
+    # então ele é liberado junto com ela (num mapa global ficaria vivo para sempre).
+    # Cada página é usada por uma só thread, então não há corrida na criação.
+    cache = getattr(page, "_cache_frames_pmm", None)
+    if cache is None:
+        cache = CacheFrames(page)
+        page._cache_frames_pmm = cache
+    return cache
+
 def _first_frame_with(page, css):
-    # procura o seletor em todos os frames (raiz + iframes)
-    try:
-        if page.locator(css).count():
-            return page
-    except Exception:
-        pass
-    for fr in page.frames:
-        try:
-            if fr.locator(css).count():
-                return fr
-        except Exception:
-            continue
-    return None
+    # procura o seletor em todos os frames (raiz + iframes), com cache por navegação
+    return _cache_frames(page).frame_com(css)
 
 def selecionar_radio_cnpj(page):
     """
     Seleciona o radio 'CNPJ' usando várias estratégias:
-    id do input, label[for=...], role-accessible name e, por fim, click via JS.
+    id do input, label[for=...], role-accessible name, click via JS e texto do label.
+    A que funcionou por último é tentada primeiro (ranking em APP.estrategias["radio_cnpj"]).
     Retorna o frame (page ou iframe) onde o radio foi encontrado.
     """
     page.wait_for_load_state("domcontentloaded", timeout=15000)
-    _log_frames(page)
+    _cache_frames(page).diagnosticar()
 
     # id real visto no seu HTML: #VTIPOFILTRO3
-    fr = _first_frame_with(page, "#VTIPOFILTRO3")
-    if fr:
+    def pelo_id(marcar):
+        fr = _first_frame_with(page, "#VTIPOFILTRO3")
+        if not fr:
+            return None
         radio = fr.locator("#VTIPOFILTRO3")
         radio.wait_for(state="attached", timeout=8000)
-
-        # 1) check nativo
-        try:
-            radio.scroll_into_view_if_needed()
-            radio.check()
-            if radio.is_checked():
-                return fr
-        except Exception:
-            pass
-
-        # 2) clicar no label vinculado
-        try:
-            fr.locator("label[for='VTIPOFILTRO3']").scroll_into_view_if_needed()
-            fr.locator("label[for='VTIPOFILTRO3']").click()
-            if radio.is_checked():
-                return fr
-        except Exception:
-            pass
-
-        # 3) role + accessible name
-        try:
-            fr.get_by_role("radio", name=re.compile(r"\bCNPJ\b", re.I)).check()
-            if radio.is_checked():
-                return fr
-        except Exception:
-            pass
-
-        # 4) JS direto (contorna overlay/handlers)
-        try:
-            fr.eval_on_selector("#VTIPOFILTRO3", "el => el.click()")
-            if radio.is_checked():
-                return fr
-        except Exception:
-            pass
-
-    # fallback por texto do label (caso id mude)
-    fr = _first_frame_with(page, "label:has-text('CNPJ')")
-    if fr:
+        marcar(fr, radio)
+        return fr if radio.is_checked() else None
+
+    # 1) check nativo
+    def check_nativo(fr, radio):
+        radio.scroll_into_view_if_needed()
+        radio.check()
+
+    # 2) clicar no label vinculado
+    def label_vinculado(fr, radio):
+        fr.locator("label[for='VTIPOFILTRO3']").scroll_into_view_if_needed()
+        fr.locator("label[for='VTIPOFILTRO3']").click()
+
+    # 3) role + accessible name
+    def role(fr, radio):
+        fr.get_by_role("radio", name=re.compile(r"\bCNPJ\b", re.I)).check()
+
+    # 4) JS direto (contorna overlay/handlers)
+    def js(fr, radio):
+        fr.eval_on_selector("#VTIPOFILTRO3", "el => el.click()")
+
+    # 5) texto do label (caso id mude)
+    def label_texto():
+        fr = _first_frame_with(page, "label:has-text('CNPJ')")
+        if not fr:
+            return None
         fr.locator("label:has-text('CNPJ')").click()
-        try:
-            r2 = fr.get_by_role("radio", name=re.compile(r"\bCNPJ\b", re.I))
-            if r2 and r2.is_checked():
-                return fr
-        except Exception:
-            pass
-
-    raise RuntimeError("Não foi possível selecionar o radio 'CNPJ'. Verifique se há iframe/overlay.")
+        r2 = fr.get_by_role("radio", name=re.compile(r"\bCNPJ\b", re.I))
+        return fr if r2.is_checked() else None
+
+    fr = APP.estrategias["radio_cnpj"].executar({
+        "check_nativo": lambda: pelo_id(check_nativo),
+        "label_for": lambda: pelo_id(label_vinculado),
+        "role": lambda: pelo_id(role),
+        "js": lambda: pelo_id(js),
+        "label_texto": label_texto,
+    })
+    if fr is None:
+        raise RuntimeError("Não foi possível selecionar o radio 'CNPJ'. Verifique se há iframe/overlay.")
+    return fr
 
 def preencher_cnpj_no_campo(fr, cnpj_limpo):
     """
@@ -180,8 +210,7 @@ def preencher_cnpj_no_campo(fr, cnpj_limpo):
     campo.click()
     campo.fill("")          # limpa
     campo.type(cnpj_limpo)  # digitação real lida melhor com máscaras
-    campo.press("Tab")      # dispara onblur/validação
-    time.sleep(0.3)
+    campo.press("Tab")      # dispara onblur/validação (print_captcha espera a imagem aparecer)
 
 # seletores padrão (ajuste se necessário)
 SEL_CAPTCHA_IMG = "img[src*='/Captcha/images/']"
@@ -192,7 +221,7 @@ SEL_CAPTCHA_INPUTS = [
 
 def print_captcha(fr, out_path: Path = None) -> Path:
     el = fr.locator("img[src*='/Captcha/images/']").first
-    el.wait_for(state="visible", timeout=15000)  # aumentamos o timeout aqui
+    APP.esperas.visivel(el, "captcha")
     if not out_path:
         out_path = Path(f"./captcha_temp_{uuid4().hex[:6]}.png")
     out_path.parent.mkdir(parents=True, exist_ok=True)
@@ -222,112 +251,254 @@ def preencher_captcha(fr, texto_captcha: str) -> None:
     except Exception as e:
         raise RuntimeError(f"[Captcha] Não foi possível preencher com '{texto_captcha}': {e}")
 
-# === Função principal ===
-def processar_pmm():
-    logger.add("execucaopmm.log", rotation="1 MB")
-    logger.info(f"Iniciando automação da aba: {ABA}")
+# === Fluxo de um CNPJ ===
+def processar_cnpj(page, context, cnpj: str):
+    cnpj_limpo = normalizar_cnpj(cnpj)
 
-    df = pd.read_excel(PLANILHA, sheet_name=ABA, dtype=str)
-    df = df[[COL_RAZAO, COL_CNPJ, COL_VALIDADE]].dropna(subset=[COL_CNPJ])
-    cnpjs = df[COL_CNPJ].drop_duplicates().tolist()
+    try:
+        APP.esperas.navegar(page, URL_PMM)
 
-    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+        # Seleciona o radio CNPJ (retorna o frame correto)
+        fr = selecionar_radio_cnpj(page)
 
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=False)
-        context = browser.new_context(viewport={"width": 1920, "height": 1080})
-        page = context.new_page()
+        # Preenche o campo do CNPJ no mesmo frame
+        preencher_cnpj_no_campo(fr, cnpj_limpo)
 
-        for cnpj in cnpjs:
-            cnpj_limpo = normalizar_cnpj(cnpj)
+        # Localiza o frame que contém o captcha
+        fr = _first_frame_with(page, "img[src*='/Captcha/images/']")
+        if not fr:
+            raise RuntimeError("[Captcha] Não foi possível localizar o frame contendo a imagem do captcha.")
 
-            try:
-                page.goto(URL_PMM, timeout=TIMEOUT)
-                page.wait_for_load_state("domcontentloaded", timeout=15000)
+        # Captura e salva o captcha
+        captcha_path = print_captcha(fr, OUTPUT_DIR / f"captcha_{cnpj_limpo}.png")
 
-                # Seleciona o radio CNPJ (retorna o frame correto)
-                fr = selecionar_radio_cnpj(page)
+        # Resolve o captcha (OCR local; 2Captcha se a confiança for baixa)
+        solucao = resolver_imagem(ABA, captcha_path)
+        texto_captcha = re.sub(r"\W", "", solucao.texto)
+        logger.info(f"{solucao.fonte} → '{texto_captcha}' ({solucao.latencia}s)")
 
-                # Preenche o campo do CNPJ no mesmo frame
-                preencher_cnpj_no_campo(fr, cnpj_limpo)
+        # Preenche o captcha no campo correto
+        preencher_captcha(fr, texto_captcha)
 
-                # Localiza o frame que contém o captcha
-                fr = _first_frame_with(page, "img[src*='/Captcha/images/']")
-                if not fr:
-                    raise RuntimeError("[Captcha] Não foi possível localizar o frame contendo a imagem do captcha.")
+        fr = _first_frame_with(page, "input[name='BTNCONSULTAR']")
+        if not fr:
+            raise RuntimeError("[Botão] Não foi possível encontrar o frame com o botão 'Consultar'.")
 
-                # Captura e salva o captcha
-                captcha_path = print_captcha(fr, OUTPUT_DIR / f"captcha_{cnpj_limpo}.png")
+        try:
+            fr.wait_for_selector("input[name='BTNCONSULTAR']", state="visible", timeout=10000)
 
-                # Resolve o captcha com 2Captcha
-                texto_captcha = resolver_captcha_2captcha(captcha_path, API_KEY_2CAPTCHA)
+            with APP.esperas.evento(context, "page", "nova_aba") as nova_pagina_evento:
+                fr.eval_on_selector("input[name='BTNCONSULTAR']", "el => el.click()")
 
-                # Preenche o captcha no campo correto
-                preencher_captcha(fr, texto_captcha)
+            nova_aba = nova_pagina_evento.value
+            APP.esperas.carregamento(nova_aba, "carregamento", "networkidle")
+            logger.info(f"[Nova aba] Página carregada com sucesso: {nova_aba.url}")
+            confirmar_captcha(ABA, solucao, True, captcha_path, cnpj_limpo)
 
-                fr = _first_frame_with(page, "input[name='BTNCONSULTAR']")
-                if not fr:
-                    raise RuntimeError("[Botão] Não foi possível encontrar o frame com o botão 'Consultar'.")
+        except PWTimeout:
+            confirmar_captcha(ABA, solucao, False, cnpj=cnpj_limpo)
+            raise RuntimeError(f"[Erro] A nova aba não foi aberta após clicar em 'Consultar' dentro de {ORCAMENTO_ESPERAS['nova_aba']} segundos.")
 
-                try:
-                    fr.wait_for_selector("input[name='BTNCONSULTAR']", timeout=10000)
 
-                    time.sleep(1)  
-                    with context.expect_page(timeout=150000) as nova_pagina_evento:
-                        fr.eval_on_selector("input[name='BTNCONSULTAR']", "el => el.click()")
+        # Exporta o PDF e extrai validade
+        # Verifica se a certidão não foi emitida por motivo de débito/restrição
+        try:
+            alerta = nova_aba.locator("div.alert.alert-warning").text_content(timeout=5000)
+            if alerta and "não foi possível emitir a certidão" in alerta.lower():
+                salvar_valor_na_planilha(cnpj_limpo, "COM DÉBITO", status="COM DÉBITO")
+                logger.warning(f"{cnpj_limpo} → Certidão com débito detectada.")
 
-                    time.sleep(5)  
-                    nova_aba = nova_pagina_evento.value
-                    nova_aba.wait_for_load_state("networkidle", timeout=150000)
-                    logger.info(f"[Nova aba] Página carregada com sucesso: {nova_aba.url}")
+                # Salva a tela como evidência em PDF
+                gravar_atomico(OUTPUT_DIR / f"pmm_{cnpj_limpo}_com_debito.pdf", nova_aba.pdf(format="A4"))
 
-                except PWTimeout:
-                    raise RuntimeError("[Erro] A nova aba não foi aberta após clicar em 'Consultar' dentro de 30 segundos.")
+                nova_aba.close()
+                return  # pula para o próximo CNPJ
+        except Exception as e:
+            logger.debug(f"[Alerta] Nenhum alerta de débito encontrado: {e}")
 
 
-                # Exporta o PDF e extrai validade
-                # Verifica se a certidão não foi emitida por motivo de débito/restrição
-                try:
-                    alerta = nova_aba.locator("div.alert.alert-warning").text_content(timeout=5000)
-                    if alerta and "não foi possível emitir a certidão" in alerta.lower():
-                        salvar_valor_na_planilha(cnpj_limpo, "COM DÉBITO", PLANILHA, ABA)
-                        logger.warning(f"{cnpj_limpo} → Certidão com débito detectada.")
+        # PDF gerado em memória: validade, nome final e estado ficam com o pós-processamento
+        APP.pos.enviar(Tarefa(ABA, cnpj_limpo, nova_aba.pdf(format="A4"), OUTPUT_DIR, "pmm_{cnpj}_{validade}.pdf"), registrar_pdf)
+        nova_aba.close()
+
+    except Exception as e:
+        motivo = f"{type(e).__name__}: {e}"
+        logger.error(f"{cnpj_limpo} → ERRO: {motivo}")
+        traceback.print_exc()
 
-                        # Salva a tela como evidência em PDF
-                        temp_path = OUTPUT_DIR / f"pmm_{cnpj_limpo}_com_debito.pdf"
-                        nova_aba.pdf(path=str(temp_path), format="A4")
 
-                        nova_aba.close()
-                        continue  # pula para o próximo CNPJ
-                except Exception as e:
-                    logger.debug(f"[Alerta] Nenhum alerta de débito encontrado: {e}")
+# === Fluxo de um CNPJ (motor assíncrono) ===
+async def selecionar_radio_cnpj_async(page):
+    """Como `selecionar_radio_cnpj`, com as mesmas estratégias e o mesmo ranking."""
+    await page.wait_for_load_state("domcontentloaded", timeout=15000)
+    _cache_frames(page).diagnosticar()
 
+    async def pelo_id(marcar):
+        fr = await _cache_frames(page).frame_com_async("#VTIPOFILTRO3")
+        if not fr:
+            return None
+        radio = fr.locator("#VTIPOFILTRO3")
+        await radio.wait_for(state="attached", timeout=8000)
+        await marcar(fr, radio)
+        return fr if await radio.is_checked() else None
+
+    async def check_nativo(fr, radio):
+        await radio.scroll_into_view_if_needed()
+        await radio.check()
+
+    async def label_vinculado(fr, radio):
+        await fr.locator("label[for='VTIPOFILTRO3']").scroll_into_view_if_needed()
+        await fr.locator("label[for='VTIPOFILTRO3']").click()
+
+    async def role(fr, radio):
+        await fr.get_by_role("radio", name=re.compile(r"\bCNPJ\b", re.I)).check()
+
+    async def js(fr, radio):
+        await fr.eval_on_selector("#VTIPOFILTRO3", "el => el.click()")
+
+    async def label_texto():
+        fr = await _cache_frames(page).frame_com_async("label:has-text('CNPJ')")
+        if not fr:
+            return None
+        await fr.locator("label:has-text('CNPJ')").click()
+        r2 = fr.get_by_role("radio", name=re.compile(r"\bCNPJ\b", re.I))
+        return fr if await r2.is_checked() else None
+
+    fr = await APP.estrategias["radio_cnpj"].executar_async({
+        "check_nativo": lambda: pelo_id(check_nativo),
+        "label_for": lambda: pelo_id(label_vinculado),
+        "role": lambda: pelo_id(role),
+        "js": lambda: pelo_id(js),
+        "label_texto": label_texto,
+    })
+    if fr is None:
+        raise RuntimeError("Não foi possível selecionar o radio 'CNPJ'. Verifique se há iframe/overlay.")
+    return fr
+
+async def preencher_cnpj_no_campo_async(fr, cnpj_limpo):
+    campo = fr.locator("#vNRFILTRO")
+    await campo.wait_for(state="visible", timeout=10000)
+    await campo.scroll_into_view_if_needed()
+    await campo.click()
+    await campo.fill("")
+    await campo.type(cnpj_limpo)
+    await campo.press("Tab")
+
+async def preencher_captcha_async(fr, texto_captcha: str) -> None:
+    for sel in SEL_CAPTCHA_INPUTS:
+        try:
+            loc = fr.locator(sel)
+            if await loc.count() and await loc.is_visible():
+                await loc.scroll_into_view_if_needed()
+                await loc.fill("")
+                await loc.fill(texto_captcha)
+                await loc.press("Tab")
+                logger.info(f"[Captcha] Preenchido com '{texto_captcha}' via seletor '{sel}'")
+                return
+        except Exception as e:
+            logger.warning(f"[Captcha] Falha ao tentar preencher com seletor {sel}: {e}")
 
-                validade = extrair_validade_pdf(temp_path)
-                if validade:
-                    salvar_valor_na_planilha(cnpj_limpo, validade, PLANILHA, ABA)
-                    validade_formatada = datetime.strptime(validade, "%d/%m/%Y").strftime("%Y%m%d")
-                    nome_arquivo = f"pmm_{cnpj_limpo}_{validade_formatada}.pdf"
-                    destino_pdf = OUTPUT_DIR / nome_arquivo
-                    temp_path.rename(destino_pdf)
-                    logger.success(f"{cnpj_limpo} → Sucesso: validade {validade}")
-                else:
-                    destino_pdf = OUTPUT_DIR / f"erro_{cnpj_limpo}.pdf"
-                    temp_path.rename(destino_pdf)
-                    logger.warning(f"{cnpj_limpo} → Não foi possível extrair validade.")
+    try:
+        loc = fr.locator("label:has-text('Insira o código') ~ input").first
+        await loc.fill("")
+        await loc.fill(texto_captcha)
+        await loc.press("Tab")
+    except Exception as e:
+        raise RuntimeError(f"[Captcha] Não foi possível preencher com '{texto_captcha}': {e}")
 
-                nova_aba.close()
+async def processar_cnpj_async(motor, page, context, cnpj: str):
+    cnpj_limpo = normalizar_cnpj(cnpj)
 
-            except Exception as e:
-                motivo = f"{type(e).__name__}: {e}"
-                logger.error(f"{cnpj_limpo} → ERRO: {motivo}")
-                traceback.print_exc()
+    try:
+        await APP.esperas.navegar_async(page, URL_PMM)
+        fr = await selecionar_radio_cnpj_async(page)
+        await preencher_cnpj_no_campo_async(fr, cnpj_limpo)
+
+        fr = await _cache_frames(page).frame_com_async(SEL_CAPTCHA_IMG)
+        if not fr:
+            raise RuntimeError("[Captcha] Não foi possível localizar o frame contendo a imagem do captcha.")
+        el = fr.locator(SEL_CAPTCHA_IMG).first
+        await APP.esperas.visivel_async(el, "captcha")
+        imagem = await el.screenshot(path=str(OUTPUT_DIR / f"captcha_{cnpj_limpo}.png"))
+
+        solucao = await motor.resolver_captcha_imagem(imagem, portal=ABA)
+        texto_captcha = re.sub(r"\W", "", solucao.texto)
+        logger.info(f"{solucao.fonte} → '{texto_captcha}' ({solucao.latencia}s)")
+        await preencher_captcha_async(fr, texto_captcha)
+
+        fr = await _cache_frames(page).frame_com_async("input[name='BTNCONSULTAR']")
+        if not fr:
+            raise RuntimeError("[Botão] Não foi possível encontrar o frame com o botão 'Consultar'.")
 
-        context.close()
-        browser.close()
+        try:
+            await fr.wait_for_selector("input[name='BTNCONSULTAR']", state="visible", timeout=10000)
+            async with APP.esperas.evento_async(context, "page", "nova_aba") as nova_pagina_evento:
+                await fr.eval_on_selector("input[name='BTNCONSULTAR']", "el => el.click()")
+            nova_aba = await nova_pagina_evento.value
+            await APP.esperas.carregamento_async(nova_aba, "carregamento", "networkidle")
+            logger.info(f"[Nova aba] Página carregada com sucesso: {nova_aba.url}")
+            await asyncio.to_thread(confirmar_captcha, ABA, solucao, True, imagem, cnpj_limpo)
+        except PWTimeoutAsync:
+            await asyncio.to_thread(confirmar_captcha, ABA, solucao, False, cnpj=cnpj_limpo)
+            raise RuntimeError(f"[Erro] A nova aba não foi aberta após clicar em 'Consultar' dentro de {ORCAMENTO_ESPERAS['nova_aba']} segundos.")
+
+        try:
+            alerta = await nova_aba.locator("div.alert.alert-warning").text_content(timeout=5000)
+            if alerta and "não foi possível emitir a certidão" in alerta.lower():
+                await asyncio.to_thread(salvar_valor_na_planilha, cnpj_limpo, "COM DÉBITO", status="COM DÉBITO")
+                logger.warning(f"{cnpj_limpo} → Certidão com débito detectada.")
+                evidencia = await nova_aba.pdf(format="A4")
+                await asyncio.to_thread(gravar_atomico, OUTPUT_DIR / f"pmm_{cnpj_limpo}_com_debito.pdf", evidencia)
+                await nova_aba.close()
+                return
+        except Exception as e:
+            logger.debug(f"[Alerta] Nenhum alerta de débito encontrado: {e}")
+
+        # enviar() pode esperar vaga na fila do pós-processamento: fora do event loop
+        pdf_bytes = await nova_aba.pdf(format="A4")
+        await asyncio.to_thread(
+            APP.pos.enviar, Tarefa(ABA, cnpj_limpo, pdf_bytes, OUTPUT_DIR, "pmm_{cnpj}_{validade}.pdf"), registrar_pdf
+        )
+        await nova_aba.close()
+
+    except Exception as e:
+        logger.error(f"{cnpj_limpo} → ERRO: {type(e).__name__}: {e}")
+
+
+# === Função principal ===
+def processar_pmm(cnpjs: list[str] | None = None):
+    APP.iniciar()
+    logger.add("execucaopmm.log", rotation="1 MB")
+    logger.info(f"Iniciando automação da aba: {ABA}")
+
+    df = APP.estado.carregar_aba(ABA, PLANILHA)
+    if cnpjs is not None:
+        df = filtrar_cnpjs(df, cnpjs)
+    elif MODO_INCREMENTAL:
+        df = selecionar_pendentes(df, MARGEM_RENOVACAO_DIAS)
+    df = df[[COL_RAZAO, COL_CNPJ, COL_VALIDADE]].dropna(subset=[COL_CNPJ])
+    cnpjs = df[COL_CNPJ].drop_duplicates().tolist()
+
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
+    opcoes_contexto = {"viewport": {"width": 1920, "height": 1080}}
+    if MOTOR == "async":
+        motor = MotorAsync(CONCORRENCIA_ASYNC, headless=False, opcoes_contexto=opcoes_contexto, nome=ABA)
+        motor.executar(cnpjs, processar_cnpj_async)
+    else:
+        executar_em_paralelo(
+            cnpjs,
+            processar_cnpj,
+            workers=WORKERS,
+            headless=False,
+            opcoes_contexto=opcoes_contexto,
+            nome=ABA,
+        )
+
+    APP.pos.aguardar()
+    APP.gravador.flush()
     logger.info("Processo concluído.")
 
 
 if __name__ == "__main__":
-    processar_pmm()
+    processar_pmm(cnpjs=sys.argv[1:] or None)
@@ -1,13 +1,20 @@
-from playwright.sync_api import sync_playwright
+import sys
 import time
 import re
+import asyncio
 import traceback
-from datetime import datetime
+from datetime import date, datetime, timedelta
 from pathlib import Path
-import pandas as pd
-import fitz  # PyMuPDF
 from loguru import logger
-from openpyxl import load_workbook
+from playwright.sync_api import sync_playwright
+
+from agenda import filtrar_cnpjs, selecionar_pendentes
+from estado_app import EstadoApp
+from extracao import PADROES, extrair_certidao
+from motor_async import MotorAsync
+from paralelo import executar_em_paralelo
+from pos_processamento import Resultado, Tarefa
+from rfb_api import ClienteApiRfb, ErroApiRfb, GravadorChamadas, RecusaRfb
 
 # === Configurações ===
 PLANILHA = Path("base_certidoes.xlsx")
@@ -19,145 +26,382 @@ OUTPUT_DIR = Path("certidoes_baixadas") / ABA.replace(" ", "_")
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
 URL_RFB = "https://servicos.receitafederal.gov.br/servico/certidoes/#/home/cnpj"
-REGEX_VALIDADE = r"Válida até (\d{2}/\d{2}/\d{4})"
+WORKERS = 2
+MOTOR = "threads"  # ou "async" (só para o que sobrar da API)
+CONCORRENCIA_ASYNC = 10
+MODO_INCREMENTAL = True
+MARGEM_RENOVACAO_DIAS = 7
+MODO_API = True              # grava as chamadas da SPA num CNPJ e repete as demais direto no backend
+TENTATIVAS_GRAVACAO = 3      # CNPJs emitidos pela interface até conseguir gravar o backend
+REAPROVEITAR_CERTIDAO = True # usa o PDF local ou a certidão válida que o portal já tem, em vez de emitir outra
+RE_BAIXAR_EXISTENTE = re.compile(r"Baixar|Download|Visualizar|Imprimir|2ª via", re.I)
+RE_FECHAR_DIALOGO = re.compile(r"Fechar|Cancelar|Voltar", re.I)
+ORCAMENTO_ESPERAS = {"resultado": 30, "download": 60, "formulario": 10}  # segundos por etapa
+APP = EstadoApp(ABA, PLANILHA, ORCAMENTO_ESPERAS, estrategias=("campo_cnpj",))
 
 # === Funções utilitárias ===
 def normalizar_cnpj(cnpj: str) -> str:
     return re.sub(r"\D", "", str(cnpj)).zfill(14)
 
-def extrair_validade_pdf(caminho_pdf: Path) -> str:
+def salvar_valor_na_planilha(cnpj: str, nova_data: str, status: str, **detalhes):
+    APP.estado.registrar(ABA, cnpj, validade=nova_data, status=status, **detalhes)
+    APP.gravador.registrar(ABA, cnpj, {COL_VALIDADE: nova_data, COL_STATUS: status})
+
+def caminho_certidao(cnpj: str) -> Path:
+    return OUTPUT_DIR / f"{cnpj}_RFB_{datetime.now().strftime('%Y%m%d')}.pdf"
+
+def registrar_certidao(resultado: Resultado):
+    # roda neste processo quando o pós-processamento termina
+    salvar_valor_na_planilha(resultado.cnpj, resultado.dados.validade, "OK", pdf_path=resultado.destino)
+    logger.info(f"Certidão salva: {resultado.destino.name}")
+
+def entregar_certidao(cnpj: str, conteudo: bytes):
+    # o nome não depende da validade: sem ela o PDF é gravado igual, com validade vazia
+    APP.pos.enviar(Tarefa(ABA, cnpj, conteudo, OUTPUT_DIR, caminho_certidao(cnpj).name, nome_erro=None), registrar_certidao)
+
+# === Certidão já válida ===
+def certidao_local_valida(cnpj: str, validade: str | None = None) -> tuple[Path, str] | None:
+    """
+    PDF já baixado para o CNPJ (o do estado ou algum de OUTPUT_DIR, do mais novo para o
+    mais antigo). Com `validade`, exige a mesma validade; sem ela, uma validade além de
+    MARGEM_RENOVACAO_DIAS.
+    """
+    candidatos = sorted(OUTPUT_DIR.glob(f"{cnpj}_RFB_*.pdf"), key=lambda p: p.stat().st_mtime, reverse=True)
+    registro = APP.estado.obter(ABA, cnpj)
+    if registro and registro.get("pdf_path") and Path(registro["pdf_path"]).exists():
+        do_estado = Path(registro["pdf_path"])
+        candidatos = [do_estado] + [c for c in candidatos if c.resolve() != do_estado.resolve()]
+
+    limite = date.today() + timedelta(days=MARGEM_RENOVACAO_DIAS)
+    for caminho in candidatos:
+        encontrada = extrair_certidao(caminho, ABA).validade
+        if not encontrada:
+            continue
+        if validade is not None:
+            if encontrada == validade:
+                return caminho, encontrada
+        elif datetime.strptime(encontrada, "%d/%m/%Y").date() > limite:
+            return caminho, encontrada
+    return None
+
+def usar_certidao_local(cnpj: str, validade: str | None = None) -> bool:
+    local = certidao_local_valida(cnpj, validade)
+    if not local:
+        return False
+    caminho_pdf, validade = local
+    salvar_valor_na_planilha(cnpj, validade, "OK", pdf_path=caminho_pdf)
+    logger.info(f"{cnpj}: certidão válida até {validade} já baixada ({caminho_pdf.name}); sem nova emissão.")
+    return True
+
+def fechar_dialogo(page, dialogo):
     try:
-        with fitz.open(caminho_pdf) as doc:
-            texto = "\n".join(page.get_text() for page in doc)
-        match = re.search(REGEX_VALIDADE, texto, re.IGNORECASE)
-        if match:
-            return match.group(1)
-    except Exception as e:
-        logger.warning(f"Erro ao ler validade do PDF {caminho_pdf.name}: {e}")
-    return ""
-
-def salvar_valor_na_planilha(cnpj: str, nova_data: str, status: str, caminho: Path, aba: str):
-    wb = load_workbook(caminho)
-    ws = wb[aba]
-    colunas = {cell.value: idx for idx, cell in enumerate(next(ws.iter_rows(min_row=1, max_row=1)), start=1)}
-    idx_cnpj = colunas.get(COL_CNPJ)
-    idx_validade = colunas.get(COL_VALIDADE)
-    idx_status = colunas.get(COL_STATUS)
-
-    if not idx_cnpj:
-        logger.error("Coluna CNPJ não encontrada.")
-        return
-
-    for row in ws.iter_rows(min_row=2):
-        val = str(row[idx_cnpj - 1].value)
-        if normalizar_cnpj(val) == normalizar_cnpj(cnpj):
-            if idx_validade:
-                row[idx_validade - 1].value = nova_data
-            if idx_status:
-                row[idx_status - 1].value = status
-            break
-
-    wb.save(caminho)
-    wb.close()
+        dialogo.get_by_role("button", name=RE_FECHAR_DIALOGO).first.click(timeout=3000)
+    except Exception:
+        page.keyboard.press("Escape")
+
+def reaproveitar_certidao(page, dialogo, cnpj: str) -> bool:
+    """
+    Diante de "Certidão Válida Encontrada": usa o PDF local com a validade informada no
+    diálogo ou baixa a certidão existente pelo próprio diálogo. False quando nenhum dos
+    dois é possível (segue a emissão de uma nova).
+    """
+    # a primeira data do diálogo costuma ser a emissão: vale a que segue o "Válida até"
+    achada = PADROES[ABA].validade.search(" ".join(dialogo.first.inner_text().split()))
+    if not (achada and usar_certidao_local(cnpj, achada.group(1))):
+        botao = dialogo.get_by_role("button", name=RE_BAIXAR_EXISTENTE)
+        if not botao.count():
+            return False
+        with page.expect_download(timeout=60000) as info:
+            botao.first.click()
+        logger.info(f"Baixando certidão válida já existente para {cnpj}...")
+        entregar_certidao(cnpj, Path(info.value.path()).read_bytes())
+    fechar_dialogo(page, dialogo)
+    return True
 
 # === Nova função robusta para preencher o CNPJ ===
 def preencher_cnpj(page, cnpj: str):
-    try:
-        campo = page.locator("input[name='niContribuinte']").first
+    def digitar(campo):
         campo.wait_for(state="visible", timeout=5000)
         campo.fill("")
         campo.type(cnpj)
         return True
-    except Exception:
-        pass
+
+    def nos_frames():
+        for frame in page.frames:
+            try:
+                campo = frame.locator("input[name='niContribuinte']").first
+                if campo.count():
+                    return digitar(campo)
+            except Exception:
+                continue
+        return False
+
+    # a estratégia que funcionou por último é tentada primeiro
+    if not APP.estrategias["campo_cnpj"].executar({
+        "nome": lambda: digitar(page.locator("input[name='niContribuinte']").first),
+        "placeholder": lambda: digitar(page.locator("input[placeholder='Informe o CNPJ']").first),
+        "frames": nos_frames,
+    }):
+        raise RuntimeError("Campo de CNPJ não encontrado.")
+    return True
+
+# === Fluxo de um CNPJ ===
+def abrir_portal(page):
+    page.goto(URL_RFB)
+    page.wait_for_load_state("networkidle")
+
+def processar_cnpj(page, context, cnpj: str):
+    logger.info(f"Processando CNPJ {cnpj}...")
+
+    erro = page.locator(".msg-resultado").filter(has_text="Não foi possível concluir a ação")
+    sucesso = page.locator(".msg-resultado").filter(has_text="A certidão foi emitida com sucesso")
+    dialogo = page.locator(".br-dialog").filter(has_text="Certidão Válida Encontrada")
+    # o download pode sair antes da mensagem de sucesso: guarda o evento desde o clique
+    downloads = []
+    guardar_download = downloads.append
+    page.on("download", guardar_download)
 
     try:
-        campo = page.locator("input[placeholder='Informe o CNPJ']").first
-        campo.wait_for(state="visible", timeout=5000)
-        campo.fill("")
-        campo.type(cnpj)
-        return True
+        # Preenche CNPJ (o clique abaixo já espera o botão habilitar)
+        preencher_cnpj(page, cnpj)
+
+        # Clica em "+ Nova Certidão" e espera o portal responder
+        page.get_by_role("button", name="+ Nova Certidão").click()
+        resultado = APP.esperas.primeiro("resultado", erro=erro, dialogo=dialogo, sucesso=sucesso)
+
+        # Se aparecer a confirmação de certidão já existente → reaproveitar ou clicar novamente
+        if resultado == "dialogo":
+            if REAPROVEITAR_CERTIDAO and reaproveitar_certidao(page, dialogo, cnpj):
+                return
+            page.get_by_role("button", name="+ Nova Certidão").click()
+            resultado = APP.esperas.primeiro("resultado", erro=erro, sucesso=sucesso)
+
+        # Verifica se deu erro
+        if resultado == "erro":
+            logger.warning(f"Erro ao processar {cnpj}")
+            salvar_valor_na_planilha(cnpj, "", "ERRO BAIXAR")
+            return
+
+        # Sucesso: o download é disparado automaticamente (às vezes antes do resultado aparecer)
+        if downloads:
+            download = downloads[-1]
+        else:
+            with APP.esperas.evento(page, "download", "download") as info:
+                pass
+            download = info.value
+        logger.info(f"Baixando certidão para {cnpj}...")
+        entregar_certidao(cnpj, Path(download.path()).read_bytes())
+
+        # Volta para nova certidão
+        if page.get_by_role("button", name="+ Nova Certidão").count():
+            page.get_by_role("button", name="+ Nova Certidão").click()
+            APP.esperas.visivel(page.locator("input[name='niContribuinte'], input[placeholder='Informe o CNPJ']").first, "formulario")
+
+    except Exception as e:
+        logger.error(f"Erro no processamento do CNPJ {cnpj}: {e}")
+        traceback.print_exc()
+        salvar_valor_na_planilha(cnpj, "", "ERRO BAIXAR")
+    finally:
+        page.remove_listener("download", guardar_download)
+
+
+# === Fluxo de um CNPJ (motor assíncrono) ===
+async def abrir_portal_async(page):
+    await page.goto(URL_RFB)
+    await page.wait_for_load_state("networkidle")
+
+async def fechar_dialogo_async(page, dialogo):
+    try:
+        await dialogo.get_by_role("button", name=RE_FECHAR_DIALOGO).first.click(timeout=3000)
     except Exception:
-        pass
+        await page.keyboard.press("Escape")
 
-    for frame in page.frames:
-        try:
-            campo = frame.locator("input[name='niContribuinte']").first
-            if campo.count():
-                campo.wait_for(state="visible", timeout=5000)
-                campo.fill("")
-                campo.type(cnpj)
-                return True
-        except Exception:
-            continue
+async def baixar_e_entregar(cnpj: str, download):
+    # leitura do arquivo e fila do pós-processamento ficam fora do event loop
+    conteudo = await asyncio.to_thread(Path(await download.path()).read_bytes)
+    await asyncio.to_thread(entregar_certidao, cnpj, conteudo)
 
-    raise RuntimeError("Campo de CNPJ não encontrado.")
+async def reaproveitar_certidao_async(page, dialogo, cnpj: str) -> bool:
+    """Como `reaproveitar_certidao`; a busca do PDF local (PyMuPDF + banco) roda numa thread."""
+    achada = PADROES[ABA].validade.search(" ".join((await dialogo.first.inner_text()).split()))
+    if not (achada and await asyncio.to_thread(usar_certidao_local, cnpj, achada.group(1))):
+        botao = dialogo.get_by_role("button", name=RE_BAIXAR_EXISTENTE)
+        if not await botao.count():
+            return False
+        async with page.expect_download(timeout=60000) as info:
+            await botao.first.click()
+        logger.info(f"Baixando certidão válida já existente para {cnpj}...")
+        await baixar_e_entregar(cnpj, await info.value)
+    await fechar_dialogo_async(page, dialogo)
+    return True
 
-# === Fluxo principal ===
-def processar_certidoes():
-    df = pd.read_excel(PLANILHA, sheet_name=ABA)
-    df[COL_CNPJ] = df[COL_CNPJ].astype(str).apply(normalizar_cnpj)
+async def preencher_cnpj_async(page, cnpj: str):
+    async def digitar(campo):
+        await campo.wait_for(state="visible", timeout=5000)
+        await campo.fill("")
+        await campo.type(cnpj)
+        return True
+
+    async def nos_frames():
+        for frame in page.frames:
+            try:
+                campo = frame.locator("input[name='niContribuinte']").first
+                if await campo.count():
+                    return await digitar(campo)
+            except Exception:
+                continue
+        return False
+
+    if not await APP.estrategias["campo_cnpj"].executar_async({
+        "nome": lambda: digitar(page.locator("input[name='niContribuinte']").first),
+        "placeholder": lambda: digitar(page.locator("input[placeholder='Informe o CNPJ']").first),
+        "frames": nos_frames,
+    }):
+        raise RuntimeError("Campo de CNPJ não encontrado.")
+    return True
+
+async def processar_cnpj_async(motor, page, context, cnpj: str):
+    logger.info(f"Processando CNPJ {cnpj}...")
+
+    erro = page.locator(".msg-resultado").filter(has_text="Não foi possível concluir a ação")
+    sucesso = page.locator(".msg-resultado").filter(has_text="A certidão foi emitida com sucesso")
+    dialogo = page.locator(".br-dialog").filter(has_text="Certidão Válida Encontrada")
+    downloads = []
+    guardar_download = downloads.append
+    page.on("download", guardar_download)
+
+    try:
+        await preencher_cnpj_async(page, cnpj)
+
+        await page.get_by_role("button", name="+ Nova Certidão").click()
+        resultado = await APP.esperas.primeiro_async("resultado", erro=erro, dialogo=dialogo, sucesso=sucesso)
+
+        if resultado == "dialogo":
+            if REAPROVEITAR_CERTIDAO and await reaproveitar_certidao_async(page, dialogo, cnpj):
+                return
+            await page.get_by_role("button", name="+ Nova Certidão").click()
+            resultado = await APP.esperas.primeiro_async("resultado", erro=erro, sucesso=sucesso)
 
+        if resultado == "erro":
+            logger.warning(f"Erro ao processar {cnpj}")
+            await asyncio.to_thread(salvar_valor_na_planilha, cnpj, "", "ERRO BAIXAR")
+            return
+
+        if downloads:
+            download = downloads[-1]
+        else:
+            async with APP.esperas.evento_async(page, "download", "download") as info:
+                pass
+            download = await info.value
+        logger.info(f"Baixando certidão para {cnpj}...")
+        await baixar_e_entregar(cnpj, download)
+
+        if await page.get_by_role("button", name="+ Nova Certidão").count():
+            await page.get_by_role("button", name="+ Nova Certidão").click()
+            await APP.esperas.visivel_async(page.locator("input[name='niContribuinte'], input[placeholder='Informe o CNPJ']").first, "formulario")
+
+    except Exception as e:
+        logger.error(f"Erro no processamento do CNPJ {cnpj}: {e}")
+        await asyncio.to_thread(salvar_valor_na_planilha, cnpj, "", "ERRO BAIXAR")
+    finally:
+        page.remove_listener("download", guardar_download)
+
+
+# === Backend direto (sem interface) ===
+def gravar_backend(cnpjs: list[str]) -> tuple[ClienteApiRfb | None, list[str]]:
+    """
+    Emite pela interface, com as requisições gravadas, até TENTATIVAS_GRAVACAO CNPJs,
+    parando no primeiro que render um modelo de chamadas com PDF. Devolve o cliente
+    (com os cookies da sessão) e os CNPJs que ainda faltam.
+    """
+    restantes = list(cnpjs)
     with sync_playwright() as p:
         browser = p.chromium.launch(headless=False)
         context = browser.new_context(accept_downloads=True)
         page = context.new_page()
-        page.goto(URL_RFB)
-        page.wait_for_load_state("networkidle")
+        try:
+            abrir_portal(page)
+            for _ in range(min(TENTATIVAS_GRAVACAO, len(restantes))):
+                cnpj = restantes.pop(0)
+                gravador = GravadorChamadas(page)
+                try:
+                    processar_cnpj(page, context, cnpj)
+                    modelo = gravador.modelo(cnpj)
+                finally:
+                    gravador.parar()
+                if modelo:
+                    return ClienteApiRfb(modelo, context.cookies()), restantes
+        finally:
+            context.close()
+            browser.close()
+    return None, restantes
 
-        for _, row in df.iterrows():
-            cnpj = row[COL_CNPJ]
-            logger.info(f"Processando CNPJ {cnpj}...")
+def processar_via_api(cnpjs: list[str]) -> list[str]:
+    """Emite direto no backend da SPA. Devolve os CNPJs que ficam para a interface."""
+    cliente, restantes = gravar_backend(cnpjs)
+    if cliente is None:
+        logger.warning(f"[{ABA}] Não foi possível gravar o backend; seguindo pela interface.")
+        return restantes
+    logger.info(f"[{ABA}] Backend gravado: {cliente.descrever()}")
 
+    inicio = time.monotonic()
+    emitidos = 0
+    try:
+        while restantes:
+            cnpj = restantes[0]
             try:
-                # Preenche CNPJ
-                preencher_cnpj(page, cnpj)
-                time.sleep(1)
-
-                # Clica em "+ Nova Certidão"
-                page.get_by_role("button", name="+ Nova Certidão").click()
-                time.sleep(5)
-
-                # Verifica se deu erro
-                if page.locator(".msg-resultado").filter(
-                        has_text="Não foi possível concluir a ação"
-                    ).count() > 0:
-                    logger.warning(f"Erro ao processar {cnpj}")
-                    salvar_valor_na_planilha(cnpj, "", "ERRO BAIXAR", PLANILHA, ABA)
-                    continue
-
-                # Se aparecer a confirmação de certidão já existente → clicar novamente
-                if page.locator(".br-dialog").filter(
-                        has_text="Certidão Válida Encontrada"
-                    ).count() > 0:
-                    page.get_by_role("button", name="+ Nova Certidão").click()
-                    time.sleep(5)
-
-                # Verifica mensagem de sucesso
-                if page.locator(".msg-resultado").filter(
-                        has_text="A certidão foi emitida com sucesso"
-                    ).count() > 0:
-                    # se o download for disparado automaticamente, prefira esperar o evento
-                    download = page.wait_for_event("download", timeout=60000)
-                    logger.info(f"Baixando certidão para {cnpj}...")
-                    caminho_pdf = OUTPUT_DIR / f"{cnpj}_RFB_{datetime.now().strftime('%Y%m%d')}.pdf"
-                    download.save_as(str(caminho_pdf))
-                    validade = extrair_validade_pdf(caminho_pdf)
-                    salvar_valor_na_planilha(cnpj, validade, "OK", PLANILHA, ABA)
-                    logger.info(f"Certidão salva: {caminho_pdf.name}")
-
-                # Volta para nova certidão
-                if page.get_by_role("button", name="+ Nova Certidão").count():
-                    page.get_by_role("button", name="+ Nova Certidão").click()
-                    time.sleep(2)
-
-            except Exception as e:
-                logger.error(f"Erro no processamento do CNPJ {cnpj}: {e}")
-                traceback.print_exc()
-                salvar_valor_na_planilha(cnpj, "", "ERRO BAIXAR", PLANILHA, ABA)
-
-        browser.close()
+                conteudo = cliente.emitir(cnpj)
+            except RecusaRfb as e:
+                logger.warning(f"Erro ao processar {cnpj}: {e}")
+                salvar_valor_na_planilha(cnpj, "", "ERRO BAIXAR")
+            except ErroApiRfb as e:
+                logger.warning(f"[{ABA}] Backend divergiu da gravação em {cnpj} ({e}); {len(restantes)} CNPJ(s) voltam para a interface.")
+                break
+            else:
+                entregar_certidao(cnpj, conteudo)
+                emitidos += 1
+            restantes.pop(0)
+    finally:
+        cliente.fechar()
+
+    if emitidos:
+        logger.info(f"[{ABA}] {emitidos} certidão(ões) pelo backend em {time.monotonic() - inicio:.1f}s.")
+    return restantes
+
+
+# === Fluxo principal ===
+def processar_certidoes(cnpjs: list[str] | None = None):
+    APP.iniciar()
+    df = APP.estado.carregar_aba(ABA, PLANILHA)
+    if cnpjs is not None:
+        df = filtrar_cnpjs(df, cnpjs)
+    elif MODO_INCREMENTAL:
+        df = selecionar_pendentes(df, MARGEM_RENOVACAO_DIAS)
+    df[COL_CNPJ] = df[COL_CNPJ].astype(str).apply(normalizar_cnpj)
+
+    pendentes = df[COL_CNPJ].drop_duplicates().tolist()
+    if REAPROVEITAR_CERTIDAO:
+        pendentes = [cnpj for cnpj in pendentes if not usar_certidao_local(cnpj)]
+    if MODO_API and pendentes:
+        pendentes = processar_via_api(pendentes)
+
+    if MOTOR == "async":
+        motor = MotorAsync(CONCORRENCIA_ASYNC, headless=False, opcoes_contexto={"accept_downloads": True}, nome=ABA)
+        motor.executar(pendentes, processar_cnpj_async, preparar_pagina=abrir_portal_async)
+    else:
+        executar_em_paralelo(
+            pendentes,
+            processar_cnpj,
+            workers=WORKERS,
+            headless=False,
+            opcoes_contexto={"accept_downloads": True},
+            preparar_pagina=abrir_portal,
+            nome=ABA,
+        )
+
+    APP.pos.aguardar()
+    APP.gravador.flush()
 
 # === Execução ===
 if __name__ == "__main__":
-    processar_certidoes()
+    processar_certidoes(cnpjs=sys.argv[1:] or None)
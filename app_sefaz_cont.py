@@ -1,14 +1,18 @@
 import re
-import time
+import sys
+import asyncio
 import traceback
-from datetime import datetime
 from pathlib import Path
 
-import pandas as pd
-import fitz  # PyMuPDF
 from loguru import logger
-from playwright.sync_api import sync_playwright, TimeoutError as PWTimeout
-from openpyxl import load_workbook
+from playwright.sync_api import sync_playwright
+
+from agenda import filtrar_cnpjs, selecionar_pendentes
+from esperas import Esperas
+from estado import EstadoCertidoes
+from motor_async import MotorAsync
+from planilha import GravadorPlanilha
+from sefaz_http import ClienteSefazHttp, FinalizadorSefaz
 
 # === Configurações ===
 PLANILHA = Path("base_certidoes.xlsx")
@@ -18,72 +22,106 @@ COL_VALIDADE = "VALIDADE CERTIDÃO"
 COL_RAZAO = "RAZÃO SOCIAL"
 OUTPUT_DIR = Path("certidoes_baixadas") / ABA.replace(" ", "_")
 URL_SEFAZ_CONT = "https://sistemas.sefaz.am.gov.br/GAE/mnt/dividaAtiva/certidaoNegativa/emitirCertidaoNegativaNaoContPortal.do"
-TIMEOUT = 40_000
-REGEX_VALIDADE = r"Válida até:\s*(\d{2}/\d{2}/\d{4})"
+MOTOR = "navegador"  # "navegador": um browser, um documento por vez | "async"
+CONCORRENCIA_ASYNC = 20
+MODO_HTTP = True  # emite por HTTP puro; o navegador só processa o que falhar
+CONCORRENCIA_HTTP = 16
+MODO_INCREMENTAL = True
+MARGEM_RENOVACAO_DIAS = 7
+ORCAMENTO_ESPERAS = {"abertura": 40, "certidao": 15}  # segundos por etapa
+ESTADO = EstadoCertidoes()
+ESPERAS = Esperas(ABA, ORCAMENTO_ESPERAS)
+GRAVADOR = GravadorPlanilha(PLANILHA)
 
 def limpar_cnpj(doc: str) -> str:
-    return re.sub(r"D", "", str(doc))
-
-def extrair_validade_pdf(caminho_pdf:Path) -> str:
-    try:
-        with fitz.open(caminho_pdf) as doc:
-            texto = "\n".join(page.get_text() for page in doc)
-        match = re.search(REGEX_VALIDADE, texto, re.IGNORECASE)
-        if match:
-            return match.group(1)
-    except Exception as e:
-        logger.warning(f"Erro ao ler validade do PDF {caminho_pdf.name}: {e}")
-    return ""
-
-def salvar_valor_na_planilha(doc: str, nova_data: str, caminho: Path, aba: str):
-    wb = load_workbook(caminho)
-    ws = wb[aba]
-    colunas = {cell.value: idx for idx, cell in enumerate(next(ws.iter_rows(min_row=1, max_row=1)), start=1)}
-    idx_cnpj = colunas.get(COL_CNPJ)
-    idx_validade = colunas.get(COL_VALIDADE)
-
-    if not idx_cnpj or not idx_validade:
-        logger.error("Coluna CNPJ ou VALIDADE CERTIDAO não encontrada.")
-        return
+    return re.sub(r"\D", "", str(doc))
 
-    for row in ws.iter_rows(min_row=2):
-        val = str(row[idx_cnpj - 1].value)
-        if limpar_cnpj(val) == limpar_cnpj(doc):
-            row[idx_validade - 1].value = nova_data
-            break
+def tipo_documento(doc: str) -> str | None:
+    return {11: "CPF", 14: "CNPJ"}.get(len(doc))
 
-    wb.save(caminho)
-    wb.close()
-    
-def processar_sefaz_contribuinte():
+def salvar_valor_na_planilha(doc: str, nova_data: str, **detalhes):
+    ESTADO.registrar(ABA, doc, validade=nova_data, **detalhes)
+    GRAVADOR.registrar(ABA, doc, {COL_VALIDADE: nova_data})
+
+FINALIZADOR = FinalizadorSefaz(ABA, "sefaz_contribuinte", OUTPUT_DIR, salvar_valor_na_planilha)
+
+def processar_sefaz_contribuinte(cnpjs: list[str] | None = None):
     logger.add("execucao.log", rotation="1 MB")
     logger.info(f"Iniciando automação da aba: {ABA}")
     
-    df = pd.read_excel(PLANILHA, sheet_name=ABA, dtype=str)
+    df = ESTADO.carregar_aba(ABA, PLANILHA)
+    if cnpjs is not None:
+        df = filtrar_cnpjs(df, cnpjs)
+    elif MODO_INCREMENTAL:
+        df = selecionar_pendentes(df, MARGEM_RENOVACAO_DIAS)
     df = df[[COL_RAZAO, COL_CNPJ, COL_VALIDADE]].dropna(subset=[COL_CNPJ])
     documentos = df[COL_CNPJ].drop_duplicates().to_list()
     
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-    
+
+    if MODO_HTTP:
+        validos = [d for d in map(limpar_cnpj, documentos) if tipo_documento(d)]
+        invalidos = [d for d in documentos if not tipo_documento(limpar_cnpj(d))]
+        cliente = ClienteSefazHttp(URL_SEFAZ_CONT, CONCORRENCIA_HTTP, nome=ABA)
+        documentos = cliente.emitir_em_lote(validos, FINALIZADOR.finalizar_emissao_http) + invalidos
+
+    if documentos and MOTOR == "async":
+        MotorAsync(CONCORRENCIA_ASYNC, headless=False, nome=ABA).executar(documentos, processar_documento_async)
+    elif documentos:
+        processar_no_navegador(documentos)
+
+    GRAVADOR.flush()
+    logger.info("Processo concluído.")
+
+def processar_no_navegador(documentos: list[str]):
     with sync_playwright() as p:
         browser = p.chromium.launch(headless=False)
         context = browser.new_context()
         page = context.new_page()
         
         for doc_bruto in documentos:
-            doc = limpar_cnpj(doc_bruto)
-            
-            if len(doc) == 11:
-                tipo = "CPF"
-                
-            elif len(doc) == 14:
-                tipo = "CNPJ"
-                
-            else: 
-                logger.warning(f"{doc_bruto} -> Documento inválido (não é um CPF nem CNPJ). Pulando.")
-                continue
-            
-            try: 
-                logger.info(f"Consultando {tipo}: {doc}")
-                page.goto(URL_SEFAZ_CONT, timeout=TIMEOUT)
-                page.get_by_label("").fill(doc)
+            processar_documento(page, doc_bruto)
+
+        context.close()
+        browser.close()
+
+def processar_documento(page, doc_bruto: str):
+    doc = limpar_cnpj(doc_bruto)
+    tipo = tipo_documento(doc)
+    if not tipo:
+        logger.warning(f"{doc_bruto} -> Documento inválido (não é um CPF nem CNPJ). Pulando.")
+        return
+
+    try: 
+        logger.info(f"Consultando {tipo}: {doc}")
+        ESPERAS.navegar(page, URL_SEFAZ_CONT, ate="load")
+        page.get_by_label("CPF ou CNPJ:").fill(doc)
+        page.get_by_label("CND completa").check()
+        page.get_by_role("button", name="Emitir").click()
+        ESPERAS.carregamento(page, "certidao", "networkidle")
+        FINALIZADOR.finalizar_pdf(doc, page.pdf(format="A4"))
+
+    except Exception as e:
+        logger.error(f"{doc} -> ERRO: {type(e).__name__}: {e}")
+        traceback.print_exc()
+
+# === Fluxo de um documento (motor assíncrono) ===
+async def processar_documento_async(motor, page, context, doc_bruto: str):
+    doc = limpar_cnpj(doc_bruto)
+    tipo = tipo_documento(doc)
+    if not tipo:
+        logger.warning(f"{doc_bruto} -> Documento inválido (não é um CPF nem CNPJ). Pulando.")
+        return
+
+    logger.info(f"Consultando {tipo}: {doc}")
+    await ESPERAS.navegar_async(page, URL_SEFAZ_CONT, ate="load")
+    await page.get_by_label("CPF ou CNPJ:").fill(doc)
+    await page.get_by_label("CND completa").check()
+    await page.get_by_role("button", name="Emitir").click()
+    await ESPERAS.carregamento_async(page, "certidao", "networkidle")
+    pdf_bytes = await page.pdf(format="A4")
+    # extração e gravação são bloqueantes: saem do event loop
+    await asyncio.to_thread(FINALIZADOR.finalizar_pdf, doc, pdf_bytes)
+
+if __name__ == "__main__":
+    processar_sefaz_contribuinte(cnpjs=sys.argv[1:] or None)
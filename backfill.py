@@ -0,0 +1,151 @@
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+
+from loguru import logger
+
+from estado import BANCO, COL_VALIDADE, PLANILHA, EstadoCertidoes, validade_para_iso
+from extracao import PADROES, extrair_certidao, extrair_certidao_html
+from planilha import GravadorPlanilha, normalizar_documento
+from pos_processamento import PROCESSOS
+
+# === Configurações ===
+ARQUIVO = Path("certidoes_baixadas")
+LOTE_PROCESSO = 32  # arquivos por envio a cada processo (menos idas e voltas no pool)
+
+# (padrão do nome, a data do nome é a validade?) — nomes gravados pelos apps
+NOMES = (
+    (re.compile(r"^(?:sefaz_n_contribuinte|sefaz_contribuinte|pmm|cdt)_(\d{11,14})_(\d{8})\.(?:pdf|html)$", re.I), True),
+    (re.compile(r"^(\d{11,14})_RFB_(\d{8})\.pdf$", re.I), False),   # data da emissão, não da validade
+    (re.compile(r"^crf_(\d{14})_certidao\.pdf$", re.I), False),
+    (re.compile(r"^erro_(\d{11,14})\.(?:pdf|html)$", re.I), False),  # reavalia com os padrões atuais
+)
+
+
+@dataclass
+class Achado:
+    aba: str
+    cnpj: str
+    validade: str   # dd/mm/aaaa
+    caminho: str
+
+
+# === Varredura ===
+def _aba_da_pasta(pasta: Path) -> str | None:
+    # OUTPUT_DIR de cada app é certidoes_baixadas/<ABA com _ no lugar de espaço>
+    return next((aba for aba in PADROES if aba.replace(" ", "_") == pasta.name), None)
+
+
+def listar_arquivos(abas: list[str] | None = None) -> tuple[list[Achado], list[tuple[str, str, str]]]:
+    """
+    Classifica os arquivos do acervo pelo nome: os que já trazem a validade viram achados
+    direto; os demais (aba, cnpj, caminho) precisam ter o conteúdo lido.
+    """
+    pelo_nome: list[Achado] = []
+    para_ler: list[tuple[str, str, str]] = []
+    if not ARQUIVO.is_dir():
+        return pelo_nome, para_ler
+    for pasta in sorted(p for p in ARQUIVO.iterdir() if p.is_dir()):
+        aba = _aba_da_pasta(pasta)
+        if aba is None or (abas and aba not in abas):
+            continue
+        with os.scandir(pasta) as entradas:
+            for entrada in entradas:
+                for padrao, data_e_validade in NOMES:
+                    achado = padrao.match(entrada.name)
+                    if not achado:
+                        continue
+                    if data_e_validade:
+                        validade = datetime.strptime(achado.group(2), "%Y%m%d").strftime("%d/%m/%Y")
+                        pelo_nome.append(Achado(aba, achado.group(1), validade, entrada.path))
+                    else:
+                        para_ler.append((aba, achado.group(1), entrada.path))
+                    break
+    return pelo_nome, para_ler
+
+
+def ler_arquivo(item: tuple[str, str, str]) -> Achado | None:
+    """Roda nos processos do pool: validade pelo conteúdo (PDF ou HTML) com o motor de extração."""
+    aba, cnpj, caminho = item
+    origem = Path(caminho)
+    if origem.suffix.lower() == ".html":
+        validade = extrair_certidao_html(origem.read_bytes(), aba).validade
+    else:
+        validade = extrair_certidao(origem, aba).validade
+    return Achado(aba, cnpj, validade, caminho) if validade else None
+
+
+# === Consolidação ===
+def mais_recentes(achados) -> dict[tuple[str, str], Achado]:
+    """Maior validade por (aba, CNPJ); entre validades iguais fica o primeiro arquivo visto."""
+    melhores: dict[tuple[str, str], Achado] = {}
+    for achado in achados:
+        chave = (achado.aba, normalizar_documento(achado.cnpj))
+        atual = melhores.get(chave)
+        if atual is None or validade_para_iso(achado.validade) > validade_para_iso(atual.validade):
+            melhores[chave] = achado
+    return melhores
+
+
+def reconstruir(abas: list[str] | None = None, ler_conteudo: bool = False, forcar: bool = False,
+                simular: bool = False, banco: Path = BANCO, planilha: Path = PLANILHA) -> int:
+    """
+    Varre o acervo, fica com a validade mais recente de cada (CNPJ, aba) e grava tudo de
+    uma vez no estado e na planilha. Sem `forcar`, não troca uma validade do estado que
+    já seja igual ou mais nova, nem um texto como "COM DÉBITO". `ler_conteudo` confere
+    também os PDFs cuja validade está no nome. Retorna quantas linhas foram (ou seriam,
+    com `simular`) atualizadas.
+    """
+    inicio = time.monotonic()
+    pelo_nome, para_ler = listar_arquivos(abas)
+    if ler_conteudo:
+        para_ler += [(a.aba, a.cnpj, a.caminho) for a in pelo_nome]
+        pelo_nome = []
+    logger.info(f"[Backfill] {len(pelo_nome) + len(para_ler)} arquivo(s); {len(para_ler)} com leitura do conteúdo.")
+
+    lidos: list[Achado] = []
+    if para_ler:
+        with ProcessPoolExecutor(min(PROCESSOS, len(para_ler))) as executor:
+            lidos = [a for a in executor.map(ler_arquivo, para_ler, chunksize=LOTE_PROCESSO) if a]
+    melhores = mais_recentes(pelo_nome + lidos)
+
+    estado = EstadoCertidoes(banco)
+    atuais = {(r["aba"], r["cnpj"]): (r["validade"], r["validade_iso"]) for r in estado.listar(abas)}
+
+    def desatualizado(chave, achado: Achado) -> bool:
+        validade, iso = atuais.get(chave, (None, None))
+        if forcar or not validade:
+            return True
+        return iso is not None and validade_para_iso(achado.validade) > iso
+
+    novos = [a for chave, a in melhores.items() if desatualizado(chave, a)]
+    logger.info(
+        f"[Backfill] {len(melhores)} (CNPJ, aba) com validade no acervo; {len(novos)} a atualizar "
+        f"({time.monotonic() - inicio:.1f}s de varredura)."
+    )
+    if simular or not novos:
+        return len(novos)
+
+    estado.registrar_lote((a.aba, a.cnpj, {"validade": a.validade, "pdf_path": a.caminho}) for a in novos)
+    # um único flush: a planilha é aberta e salva uma vez só
+    gravador = GravadorPlanilha(planilha, max_pendentes=len(novos) + 1, intervalo_seg=None)
+    for a in novos:
+        gravador.registrar(a.aba, a.cnpj, {COL_VALIDADE: a.validade})
+    gravador.flush()
+    logger.success(f"[Backfill] {len(novos)} validade(s) reconstruída(s) em {time.monotonic() - inicio:.1f}s.")
+    return len(novos)
+
+
+# === Linha de comando ===
+if __name__ == "__main__":
+    opcoes = {a for a in sys.argv[1:] if a.startswith("--")}
+    abas = [a for a in sys.argv[1:] if not a.startswith("--")] or None
+    if opcoes - {"--conteudo", "--forcar", "--simular"}:
+        print("uso: python backfill.py [ABA...] [--conteudo] [--forcar] [--simular]")
+        sys.exit(1)
+    reconstruir(abas, ler_conteudo="--conteudo" in opcoes, forcar="--forcar" in opcoes, simular="--simular" in opcoes)
@@ -0,0 +1,362 @@
+import os
+import asyncio
+import base64
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
+
+import requests
+from loguru import logger
+from requests.adapters import HTTPAdapter
+
+# === Configurações ===
+API_KEY_2CAPTCHA = os.getenv("API_KEY_2CAPTCHA", "")
+URL_2CAPTCHA_IN = "http://2captcha.com/in.php"
+URL_2CAPTCHA_RES = "http://2captcha.com/res.php"
+TIMEOUT_HTTP_SEG = 40
+TIMEOUT_SOLUCAO_SEG = 300
+# tempo médio inicial de solução por tipo; corrigido pela média móvel do que for observado
+MEDIA_INICIAL_SEG = {"imagem": 12.0, "recaptcha": 35.0, "hcaptcha": 35.0}
+PESO_MEDIA = 0.3            # peso da última solução na média móvel
+PRIMEIRA_CONSULTA_MIN_SEG = 5
+INTERVALO_CONSULTA_MIN_SEG = 2
+INTERVALO_CONSULTA_MAX_SEG = 10
+JANELA_AGRUPAMENTO_SEG = 1.5  # IDs com consulta prevista dentro desta janela vão na mesma requisição
+VALIDADE_TOKEN_SEG = 110   # reCAPTCHA/hCaptcha expiram ~120 s após a solução; folga para preencher o formulário
+TOKENS_ANTECIPADOS = 3
+MAX_ERROS_SEGUIDOS = 5
+
+
+# === Cliente 2Captcha ===
+@dataclass
+class Solucao:
+    texto: str
+    id: str
+    latencia: float  # segundos entre o envio e a resposta
+    fonte: str = "2captcha"
+
+
+@dataclass
+class _Pendente:
+    futuro: Future
+    tipo: str
+    enviado_em: float
+    proxima_consulta: float
+
+
+class Cliente2Captcha:
+    """
+    Cliente único do 2Captcha para todo o processo.
+
+    Uma `requests.Session` com pool de conexões; os envios (in.php) rodam em threads de
+    fundo e todos os IDs em aberto são consultados juntos numa única chamada
+    `res.php?action=get&ids=...` por uma thread de consulta. O intervalo entre consultas
+    acompanha a média móvel do tempo de solução de cada tipo de captcha.
+
+    Os métodos `imagem`, `recaptcha` e `hcaptcha` não bloqueiam: devolvem um `Future` que
+    resolve em `Solucao`. Em código assíncrono use `await Cliente2Captcha.aguardar(futuro)`.
+    """
+
+    def __init__(self, api_key: str | None = None, timeout_seg: float = TIMEOUT_SOLUCAO_SEG):
+        self.api_key = api_key or API_KEY_2CAPTCHA
+        self.timeout_seg = timeout_seg
+        self.sessao = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=2, pool_maxsize=16)
+        self.sessao.mount("http://", adaptador)
+        self.sessao.mount("https://", adaptador)
+
+        self.media_seg = dict(MEDIA_INICIAL_SEG)
+        self._pendentes: dict[str, _Pendente] = {}
+        self._cond = threading.Condition()
+        self._envios = ThreadPoolExecutor(max_workers=8, thread_name_prefix="2captcha-envio")
+        self._thread: threading.Thread | None = None
+
+    # --- API pública ---
+    def imagem(self, imagem: bytes | Path) -> Future:
+        if isinstance(imagem, (str, Path)):
+            imagem = Path(imagem).read_bytes()
+        return self.enviar("imagem", method="base64", body=base64.b64encode(imagem).decode("utf-8"))
+
+    def recaptcha(self, sitekey: str, url: str) -> Future:
+        return self.enviar("recaptcha", method="userrecaptcha", googlekey=sitekey, pageurl=url)
+
+    def hcaptcha(self, sitekey: str, url: str) -> Future:
+        return self.enviar("hcaptcha", method="hcaptcha", sitekey=sitekey, pageurl=url)
+
+    def resolver_imagem(self, imagem: bytes | Path) -> Solucao:
+        return self.imagem(imagem).result()
+
+    @staticmethod
+    async def aguardar(futuro: Future) -> Solucao:
+        return await asyncio.wrap_future(futuro)
+
+    def reportar(self, solucao: Solucao, correta: bool):
+        """reportgood/reportbad: respostas erradas são reembolsadas e o 2Captcha ajusta quem resolve."""
+        if solucao.fonte != "2captcha" or not solucao.id:
+            return
+        self._envios.submit(self._reportar, solucao.id, "reportgood" if correta else "reportbad")
+
+    def enviar(self, tipo: str, **params) -> Future:
+        """Enfileira um captcha (parâmetros do in.php) e devolve o Future da solução."""
+        futuro: Future = Future()
+        self._envios.submit(self._enviar, futuro, tipo, params)
+        return futuro
+
+    # --- Envio ---
+    def _enviar(self, futuro: Future, tipo: str, params: dict):
+        try:
+            resp = self.sessao.post(
+                URL_2CAPTCHA_IN, data={"key": self.api_key, "json": 1, **params}, timeout=TIMEOUT_HTTP_SEG
+            )
+            resp.raise_for_status()
+            data = resp.json()
+            if data.get("status") != 1:
+                raise RuntimeError(f"Falha ao enfileirar captcha: {data}")
+        except Exception as e:
+            futuro.set_exception(e)
+            return
+
+        agora = time.monotonic()
+        primeira = max(PRIMEIRA_CONSULTA_MIN_SEG, 0.8 * self.media_seg.get(tipo, PRIMEIRA_CONSULTA_MIN_SEG))
+        with self._cond:
+            self._pendentes[data["request"]] = _Pendente(futuro, tipo, agora, agora + primeira)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop_consulta, name="2captcha-consulta", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _reportar(self, captcha_id: str, acao: str):
+        try:
+            resp = self.sessao.get(
+                URL_2CAPTCHA_RES,
+                params={"key": self.api_key, "action": acao, "id": captcha_id, "json": 1},
+                timeout=TIMEOUT_HTTP_SEG,
+            )
+            resp.raise_for_status()
+        except Exception as e:
+            logger.debug(f"[2Captcha] Falha no {acao} de {captcha_id}: {type(e).__name__}: {e}")
+
+    # --- Consulta em lote ---
+    def _loop_consulta(self):
+        while True:
+            with self._cond:
+                while not self._pendentes:
+                    self._cond.wait()
+                agora = time.monotonic()
+                proxima = min(p.proxima_consulta for p in self._pendentes.values())
+                if proxima > agora:
+                    self._cond.wait(proxima - agora)
+                    continue
+                ids = [i for i, p in self._pendentes.items() if p.proxima_consulta <= agora + JANELA_AGRUPAMENTO_SEG]
+
+            try:
+                respostas = self._consultar(ids)
+            except Exception as e:
+                logger.warning(f"[2Captcha] Falha na consulta de {len(ids)} ID(s): {type(e).__name__}: {e}")
+                respostas = {}
+            self._processar(ids, respostas)
+
+    def _consultar(self, ids: list[str]) -> dict[str, str]:
+        resp = self.sessao.get(
+            URL_2CAPTCHA_RES,
+            params={"key": self.api_key, "action": "get", "ids": ",".join(ids), "json": 1},
+            timeout=TIMEOUT_HTTP_SEG,
+        )
+        resp.raise_for_status()
+        data = resp.json()
+        partes = str(data.get("request", "")).split("|")
+        if len(partes) == len(ids):
+            return dict(zip(ids, partes))
+        if data.get("status") == 0 and len(partes) == 1 and len(ids) == 1:
+            return {ids[0]: partes[0]}
+        if data.get("status") == 0 and partes[0].startswith("ERROR"):
+            raise RuntimeError(f"Erro 2Captcha: {data}")
+        # resposta com '|' no texto: consulta um a um para não embaralhar
+        respostas = {}
+        for captcha_id in ids:
+            resp = self.sessao.get(
+                URL_2CAPTCHA_RES,
+                params={"key": self.api_key, "action": "get", "id": captcha_id, "json": 1},
+                timeout=TIMEOUT_HTTP_SEG,
+            )
+            resp.raise_for_status()
+            respostas[captcha_id] = str(resp.json().get("request", ""))
+        return respostas
+
+    def _processar(self, ids: list[str], respostas: dict[str, str]):
+        agora = time.monotonic()
+        concluidos: list[tuple[Future, Solucao | Exception]] = []
+        with self._cond:
+            for captcha_id in ids:
+                pendente = self._pendentes.get(captcha_id)
+                if pendente is None:
+                    continue
+                resposta = respostas.get(captcha_id, "CAPCHA_NOT_READY")
+                latencia = agora - pendente.enviado_em
+
+                if resposta == "CAPCHA_NOT_READY":
+                    if latencia >= self.timeout_seg:
+                        del self._pendentes[captcha_id]
+                        concluidos.append((pendente.futuro, TimeoutError("Timeout aguardando solução do 2Captcha")))
+                        continue
+                    media = self.media_seg.get(pendente.tipo, PRIMEIRA_CONSULTA_MIN_SEG)
+                    intervalo = min(INTERVALO_CONSULTA_MAX_SEG, max(INTERVALO_CONSULTA_MIN_SEG, 0.2 * media))
+                    pendente.proxima_consulta = agora + intervalo
+                    continue
+
+                del self._pendentes[captcha_id]
+                if resposta.startswith("ERROR") or not resposta:
+                    concluidos.append((pendente.futuro, RuntimeError(f"Erro 2Captcha ({captcha_id}): {resposta}")))
+                    continue
+                media = self.media_seg.get(pendente.tipo, latencia)
+                self.media_seg[pendente.tipo] = (1 - PESO_MEDIA) * media + PESO_MEDIA * latencia
+                concluidos.append((pendente.futuro, Solucao(resposta.strip(), captcha_id, round(latencia, 1))))
+
+        # fora do lock: callbacks dos futures (pool de tokens, asyncio) podem chamar o cliente de novo
+        for futuro, resultado in concluidos:
+            if isinstance(resultado, Exception):
+                futuro.set_exception(resultado)
+            else:
+                futuro.set_result(resultado)
+
+
+_CLIENTE: Cliente2Captcha | None = None
+_CLIENTE_LOCK = threading.Lock()
+
+
+def cliente_2captcha() -> Cliente2Captcha:
+    """Cliente compartilhado pelo processo (uma sessão HTTP e uma thread de consulta)."""
+    global _CLIENTE
+    with _CLIENTE_LOCK:
+        if _CLIENTE is None:
+            _CLIENTE = Cliente2Captcha()
+        return _CLIENTE
+
+
+# === Pool de tokens ===
+class PoolTokens:
+    """
+    Mantém até `tamanho` tokens de captcha (reCAPTCHA/hCaptcha) sendo resolvidos à frente
+    da demanda. Esses tokens dependem só do sitekey + URL da página, não do CNPJ, então
+    podem ser pedidos antes do formulário precisar deles.
+
+    `resolver()` faz uma solução completa (envio + espera) e devolve o token; roda em
+    threads de fundo. `obter()` entrega o token pronto mais antigo ainda dentro de
+    `validade_seg` (os vencidos são descartados) e só bloqueia se nenhum estiver pronto.
+
+    `restantes` é quantos tokens ainda serão pedidos (ex.: CNPJs na fila): o pool não
+    resolve além disso, para não pagar por tokens que vão vencer sem uso.
+    """
+
+    def __init__(
+        self,
+        resolver: Callable[[], str],
+        tamanho: int = TOKENS_ANTECIPADOS,
+        restantes: int | None = None,
+        validade_seg: float = VALIDADE_TOKEN_SEG,
+        nome: str = "captcha",
+    ):
+        self.resolver = resolver
+        self.tamanho = max(1, tamanho)
+        self.restantes = restantes
+        self.validade_seg = validade_seg
+        self.nome = nome
+
+        self._prontos: deque[tuple[float, str]] = deque()  # (resolvido_em, token), do mais antigo ao mais novo
+        self._pendentes: set[Future] = set()
+        self._cond = threading.Condition()
+        self._erros_seguidos = 0
+        self._ultimo_erro: Exception | None = None
+        self._encerrado = False
+        self._executor = ThreadPoolExecutor(max_workers=self.tamanho, thread_name_prefix=f"pool-{nome}")
+
+        with self._cond:
+            self._repor()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.encerrar()
+        return False
+
+    def demandar(self, quantidade: int = 1):
+        """Avisa que mais `quantidade` tokens serão pedidos (ex.: rodada de reprocessamento)."""
+        with self._cond:
+            if self.restantes is not None:
+                self.restantes += quantidade
+            self._repor()
+
+    def obter(self, timeout: float | None = None) -> str:
+        limite = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                self._descartar_vencidos()
+                if self._prontos:
+                    resolvido_em, token = self._prontos.popleft()
+                    if self.restantes is not None:
+                        self.restantes = max(0, self.restantes - 1)
+                    self._repor()
+                    logger.debug(f"[{self.nome}] Token entregue com {time.monotonic() - resolvido_em:.0f}s de idade.")
+                    return token
+
+                if self._erros_seguidos >= MAX_ERROS_SEGUIDOS:
+                    raise RuntimeError(f"[{self.nome}] {self._erros_seguidos} falhas seguidas ao resolver captcha") from self._ultimo_erro
+
+                self._repor()
+                if not self._pendentes:
+                    # quem pede agora conta como demanda, mesmo além de `restantes`
+                    self._submeter()
+
+                espera = None if limite is None else limite - time.monotonic()
+                if espera is not None and espera <= 0:
+                    raise TimeoutError(f"[{self.nome}] Nenhum token pronto em {timeout}s")
+                self._cond.wait(espera)
+
+    def encerrar(self):
+        with self._cond:
+            self._encerrado = True
+            self._prontos.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    # --- Internos (chamados com o lock) ---
+    def _alvo(self) -> int:
+        return self.tamanho if self.restantes is None else min(self.tamanho, self.restantes)
+
+    def _repor(self):
+        if self._encerrado or self._erros_seguidos >= MAX_ERROS_SEGUIDOS:
+            return
+        while len(self._prontos) + len(self._pendentes) < self._alvo():
+            self._submeter()
+
+    def _submeter(self):
+        futuro = self._executor.submit(self.resolver)
+        self._pendentes.add(futuro)
+        futuro.add_done_callback(self._concluido)
+
+    def _descartar_vencidos(self):
+        agora = time.monotonic()
+        while self._prontos and agora - self._prontos[0][0] > self.validade_seg:
+            self._prontos.popleft()
+            logger.warning(f"[{self.nome}] Token vencido descartado.")
+
+    def _concluido(self, futuro: Future):
+        with self._cond:
+            self._pendentes.discard(futuro)
+            if futuro.cancelled() or self._encerrado:
+                return
+            erro = futuro.exception()
+            if erro is None:
+                self._prontos.append((time.monotonic(), futuro.result()))
+                self._erros_seguidos = 0
+            else:
+                self._erros_seguidos += 1
+                self._ultimo_erro = erro
+                logger.warning(f"[{self.nome}] Falha ao resolver captcha ({self._erros_seguidos}x): {type(erro).__name__}: {erro}")
+            self._descartar_vencidos()
+            self._repor()
+            self._cond.notify_all()
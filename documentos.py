@@ -0,0 +1,57 @@
+import os
+from pathlib import Path
+
+import fitz  # PyMuPDF
+
+
+# === PDFs em memória ===
+def abrir_pdf(pdf: bytes | Path):
+    """Abre o PDF direto dos bytes (`fitz.open(stream=...)`) ou do caminho, sem arquivo temporário."""
+    if isinstance(pdf, (bytes, bytearray)):
+        return fitz.open(stream=pdf, filetype="pdf")
+    return fitz.open(pdf)
+
+
+def descrever(pdf: bytes | Path) -> str:
+    # para mensagens de log: nome do arquivo ou tamanho do conteúdo em memória
+    return pdf.name if isinstance(pdf, Path) else f"PDF em memória ({len(pdf)} bytes)"
+
+
+# === Busca de texto ===
+def ordem_paginas(total: int, primeiro: str = "inicio") -> list[int]:
+    """Índices na ordem de busca: a ponta indicada ("inicio" ou "fim"), a outra ponta e depois o miolo."""
+    if total <= 2:
+        return list(range(total)) if primeiro == "inicio" else list(range(total))[::-1]
+    pontas = [0, total - 1] if primeiro == "inicio" else [total - 1, 0]
+    return pontas + list(range(1, total - 1))
+
+
+def blocos_por_pagina(pdf: bytes | Path, primeiro: str = "inicio"):
+    """
+    Gera os blocos de texto de cada página, na ordem de `ordem_paginas`. O texto
+    de cada página só é extraído quando ela é pedida: quem para no primeiro acerto não
+    paga pelas demais.
+    """
+    with abrir_pdf(pdf) as doc:
+        for indice in ordem_paginas(doc.page_count, primeiro):
+            # blocos: (x0, y0, x1, y1, texto, número, tipo); tipo 1 é imagem
+            yield [b[4] for b in doc[indice].get_text("blocks") if b[6] == 0]
+
+
+# === Gravação ===
+def gravar_atomico(destino: Path, conteudo: bytes) -> Path:
+    """
+    Grava a certidão uma única vez, já com o nome final: escreve num temporário da
+    mesma pasta e troca com `os.replace`, assim quem lê a pasta nunca vê arquivo pela
+    metade.
+    """
+    destino = Path(destino)
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    temp = destino.with_name(f".{destino.stem}.{os.getpid()}.tmp{destino.suffix}")
+    try:
+        temp.write_bytes(conteudo)
+        os.replace(temp, destino)
+    except BaseException:
+        temp.unlink(missing_ok=True)
+        raise
+    return destino
@@ -0,0 +1,389 @@
+import sys
+import math
+import asyncio
+import sqlite3
+import time
+import atexit
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from loguru import logger
+
+from estado import BANCO
+
+# === Configurações ===
+ORCAMENTO_PADRAO_SEG = 30.0
+JS_IMAGEM_CARREGADA = "img => img.complete && img.naturalWidth > 0"
+LOTE_GRAVACAO = 50          # medições acumuladas antes de ir para o banco
+JANELA_DIAS = 7
+
+# Timeout adaptativo: aprendido das esperas bem-sucedidas de cada (portal, etapa)
+TIMEOUT_ADAPTATIVO = True
+MIN_AMOSTRAS = 30           # abaixo disso vale o orçamento configurado
+MARGEM_P99 = 1.5            # timeout ≥ p99 × margem
+MARGEM_P50 = 3.0            # ... e ≥ p50 × margem (protege distribuições muito estreitas)
+PISO_TIMEOUT_SEG = 2.0
+TETO_FATOR = 3.0            # nunca passa de orçamento × fator
+FRACAO_QUASE_TIMEOUT = 0.8  # sucesso com duração ≥ 80% do timeout em vigor: a cauda está sendo cortada
+TAXA_QUASE_TIMEOUT_MAX = 0.02
+CACHE_PERCENTIS_SEG = 600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS esperas (
+    portal        TEXT NOT NULL,
+    etapa         TEXT NOT NULL,            -- resultado, download, nova_aba, captcha...
+    duracao_seg   REAL NOT NULL,
+    ok            INTEGER NOT NULL,         -- 0: estourou o timeout
+    timeout_seg   REAL,                     -- timeout em vigor na espera
+    registrado_em TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_esperas_portal ON esperas (portal, etapa, registrado_em);
+"""
+
+
+@dataclass
+class Percentis:
+    amostras: int           # esperas bem-sucedidas na janela
+    p50: float
+    p95: float
+    p99: float
+    taxa_timeout: float
+    taxa_quase_timeout: float  # sucessos que chegaram perto do timeout em vigor
+
+
+def _percentil(ordenados: list[float], p: float) -> float:
+    # nearest-rank
+    return ordenados[max(0, math.ceil(p / 100 * len(ordenados)) - 1)]
+
+
+def timeout_adaptativo(percentis: Percentis | None, orcamento_seg: float) -> float:
+    """
+    Timeout de uma etapa a partir do histórico: folga sobre o p99 (e o p50), entre
+    PISO_TIMEOUT_SEG e orçamento × TETO_FATOR. Sem amostras suficientes, o orçamento.
+    """
+    if percentis is None or percentis.amostras < MIN_AMOSTRAS:
+        return orcamento_seg
+    aprendido = max(percentis.p99 * MARGEM_P99, percentis.p50 * MARGEM_P50, PISO_TIMEOUT_SEG)
+    if percentis.taxa_quase_timeout > TAXA_QUASE_TIMEOUT_MAX:
+        # sucessos encostando no limite: o portal está lento (não travado) e o timeout
+        # corta a cauda, então o p99 subestima. Não encurta abaixo do orçamento.
+        aprendido = max(aprendido, orcamento_seg)
+    return min(aprendido, orcamento_seg * TETO_FATOR)
+
+
+def _timeout(e: Exception) -> bool:
+    # playwright.sync_api.TimeoutError e playwright.async_api.TimeoutError têm o mesmo nome
+    return type(e).__name__ == "TimeoutError"
+
+
+# === Registro das medições ===
+class RegistroEsperas:
+    """
+    Grava em lote, no banco do estado, quanto cada espera levou de fato, e devolve os
+    percentis p50/p95/p99 por (portal, etapa) usados nos timeouts adaptativos.
+    """
+
+    def __init__(self, caminho: Path = BANCO):
+        self.caminho = Path(caminho)
+        self._pendentes: list[tuple] = []
+        self._percentis: dict[str, tuple[float, dict[str, Percentis]]] = {}
+        self._lock = threading.Lock()
+        with self._conectar() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.executescript(SCHEMA)
+            colunas = {r["name"] for r in con.execute("PRAGMA table_info(esperas)")}
+            if "timeout_seg" not in colunas:
+                con.execute("ALTER TABLE esperas ADD COLUMN timeout_seg REAL")
+        atexit.register(self.gravar)
+
+    @contextmanager
+    def _conectar(self):
+        con = sqlite3.connect(self.caminho, timeout=30)
+        con.row_factory = sqlite3.Row
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def registrar(self, portal: str, etapa: str, duracao: float, ok: bool, timeout_seg: float | None = None):
+        if self.enfileirar(portal, etapa, duracao, ok, timeout_seg):
+            self.gravar()
+
+    def enfileirar(self, portal: str, etapa: str, duracao: float, ok: bool, timeout_seg: float | None = None) -> bool:
+        """Só acumula a medição (sem I/O); True quando o lote encheu e `gravar()` deve ser chamado."""
+        with self._lock:
+            self._pendentes.append(
+                (portal, etapa, round(duracao, 3), int(ok), timeout_seg, datetime.now().isoformat(timespec="seconds"))
+            )
+            return len(self._pendentes) >= LOTE_GRAVACAO
+
+    def gravar(self):
+        with self._lock:
+            pendentes, self._pendentes = self._pendentes, []
+        if not pendentes:
+            return
+        with self._conectar() as con:
+            con.executemany(
+                "INSERT INTO esperas (portal, etapa, duracao_seg, ok, timeout_seg, registrado_em) VALUES (?, ?, ?, ?, ?, ?)",
+                pendentes,
+            )
+
+    def percentis_em_cache(self, portal: str) -> dict[str, Percentis] | None:
+        """Os percentis do cache, se ainda valem; None quando é preciso consultar o banco."""
+        with self._lock:
+            em_cache = self._percentis.get(portal)
+            if em_cache and time.monotonic() - em_cache[0] < CACHE_PERCENTIS_SEG:
+                return em_cache[1]
+        return None
+
+    def percentis(self, portal: str, dias: int = JANELA_DIAS) -> dict[str, Percentis]:
+        """Percentis por etapa do portal nos últimos `dias` (em cache por CACHE_PERCENTIS_SEG)."""
+        em_cache = self.percentis_em_cache(portal)
+        if em_cache is not None:
+            return em_cache
+
+        desde = (datetime.now() - timedelta(days=dias)).isoformat(timespec="seconds")
+        duracoes: dict[str, list[float]] = {}
+        timeouts: dict[str, int] = {}
+        quase: dict[str, int] = {}
+        with self._conectar() as con:
+            for r in con.execute(
+                "SELECT etapa, duracao_seg, ok, timeout_seg FROM esperas WHERE portal = ? AND registrado_em >= ?",
+                (portal, desde),
+            ):
+                etapa = r["etapa"]
+                if not r["ok"]:
+                    timeouts[etapa] = timeouts.get(etapa, 0) + 1
+                    continue
+                duracoes.setdefault(etapa, []).append(r["duracao_seg"])
+                if r["timeout_seg"] and r["duracao_seg"] >= r["timeout_seg"] * FRACAO_QUASE_TIMEOUT:
+                    quase[etapa] = quase.get(etapa, 0) + 1
+
+        resultado = {}
+        for etapa in duracoes.keys() | timeouts.keys():
+            ordenados = sorted(duracoes.get(etapa, []))
+            total = len(ordenados) + timeouts.get(etapa, 0)
+            resultado[etapa] = Percentis(
+                amostras=len(ordenados),
+                p50=_percentil(ordenados, 50) if ordenados else 0.0,
+                p95=_percentil(ordenados, 95) if ordenados else 0.0,
+                p99=_percentil(ordenados, 99) if ordenados else 0.0,
+                taxa_timeout=timeouts.get(etapa, 0) / total,
+                taxa_quase_timeout=quase.get(etapa, 0) / len(ordenados) if ordenados else 0.0,
+            )
+        with self._lock:
+            self._percentis[portal] = (time.monotonic(), resultado)
+        return resultado
+
+    def resumo(self, dias: int = JANELA_DIAS, portal: str | None = None) -> list[dict]:
+        self.gravar()
+        sql = """
+            SELECT portal, etapa, COUNT(*) AS esperas, AVG(duracao_seg) AS media_seg,
+                   MAX(duracao_seg) AS max_seg, 1.0 - AVG(ok) AS taxa_timeout
+            FROM esperas WHERE registrado_em >= ?
+        """
+        params: list = [(datetime.now() - timedelta(days=dias)).isoformat(timespec="seconds")]
+        if portal:
+            sql += " AND portal = ?"
+            params.append(portal)
+        with self._conectar() as con:
+            return [dict(r) for r in con.execute(sql + " GROUP BY portal, etapa ORDER BY portal, etapa", params)]
+
+
+_REGISTRO: RegistroEsperas | None = None
+_REGISTRO_LOCK = threading.Lock()
+
+
+def registro_esperas() -> RegistroEsperas:
+    global _REGISTRO
+    with _REGISTRO_LOCK:
+        if _REGISTRO is None:
+            _REGISTRO = RegistroEsperas()
+        return _REGISTRO
+
+
+async def registro_esperas_async() -> RegistroEsperas:
+    # a criação abre o banco: só a primeira chamada vai para uma thread
+    return _REGISTRO or await asyncio.to_thread(registro_esperas)
+
+
+# === Esperas por condição ===
+class Esperas:
+    """
+    Esperas de um portal por condições concretas (elemento visível, mensagem de
+    resultado, download, nova aba, resposta de rede) no lugar de `sleep` fixo. Cada
+    etapa tem seu orçamento em segundos (`orcamentos`, com `padrao_seg` para as demais)
+    e toda espera registra quanto levou e se estourou o timeout.
+
+    Com TIMEOUT_ADAPTATIVO, o timeout de cada etapa sai dos percentis das execuções
+    anteriores (`timeout_adaptativo`): etapa travada aborta logo, etapa lenta mas
+    saudável não é cortada. O orçamento vale até haver MIN_AMOSTRAS.
+    """
+
+    def __init__(self, portal: str, orcamentos: dict[str, float] | None = None, padrao_seg: float = ORCAMENTO_PADRAO_SEG):
+        self.portal = portal
+        self.orcamentos = orcamentos or {}
+        self.padrao_seg = padrao_seg
+
+    def timeout_seg(self, etapa: str) -> float:
+        orcamento = self.orcamentos.get(etapa, self.padrao_seg)
+        if not TIMEOUT_ADAPTATIVO:
+            return orcamento
+        return timeout_adaptativo(registro_esperas().percentis(self.portal).get(etapa), orcamento)
+
+    @contextmanager
+    def medir(self, etapa: str):
+        """Mede a espera da etapa; entrega o timeout em ms a usar dentro do bloco."""
+        limite = self.timeout_seg(etapa)
+        inicio = time.monotonic()
+        try:
+            yield limite * 1000
+        except Exception as e:
+            if _timeout(e):
+                registro_esperas().registrar(self.portal, etapa, time.monotonic() - inicio, False, limite)
+                logger.debug(f"[{self.portal}] Espera '{etapa}' estourou {limite:.1f}s")
+            raise
+        registro_esperas().registrar(self.portal, etapa, time.monotonic() - inicio, True, limite)
+
+    def visivel(self, locator, etapa: str):
+        with self.medir(etapa) as timeout:
+            locator.wait_for(state="visible", timeout=timeout)
+
+    def imagem(self, page, locator, etapa: str):
+        """Imagem visível e já carregada (ex.: captcha antes do screenshot)."""
+        with self.medir(etapa) as timeout:
+            locator.wait_for(state="visible", timeout=timeout)
+            page.wait_for_function(JS_IMAGEM_CARREGADA, arg=locator.element_handle(), timeout=timeout)
+
+    def primeiro(self, etapa: str, **alternativas) -> str:
+        """
+        Espera a primeira de várias mensagens/elementos aparecer (ex.: sucesso, erro,
+        diálogo) e devolve o nome da que apareceu.
+        """
+        combinado = None
+        for locator in alternativas.values():
+            combinado = locator if combinado is None else combinado.or_(locator)
+        with self.medir(etapa) as timeout:
+            combinado.first.wait_for(state="visible", timeout=timeout)
+        for nome, locator in alternativas.items():
+            if locator.first.is_visible():
+                return nome
+        return next(iter(alternativas))
+
+    def condicao(self, page, expressao: str, etapa: str, arg=None):
+        """Predicado JavaScript sobre o DOM (`page.wait_for_function`)."""
+        with self.medir(etapa) as timeout:
+            return page.wait_for_function(expressao, arg=arg, timeout=timeout)
+
+    def navegar(self, page, url: str, etapa: str = "abertura", ate: str = "domcontentloaded"):
+        with self.medir(etapa) as timeout:
+            page.goto(url, wait_until=ate, timeout=timeout)
+
+    def carregamento(self, page, etapa: str, estado: str = "load"):
+        with self.medir(etapa) as timeout:
+            page.wait_for_load_state(estado, timeout=timeout)
+
+    @contextmanager
+    def evento(self, alvo, evento: str, etapa: str, predicate=None):
+        """
+        `with esperas.evento(page, "download", "download") as info:` dispara a ação dentro do
+        bloco; na saída aguarda o evento (download, page, response...) em `alvo`.
+        """
+        with self.medir(etapa) as timeout:
+            with alvo.expect_event(evento, predicate=predicate, timeout=timeout) as info:
+                yield info
+
+    def resposta(self, page, predicado, etapa: str):
+        """`with esperas.resposta(page, lambda r: "/api/" in r.url, "consulta") as info:`"""
+        return self.evento(page, "response", etapa, predicate=predicado)
+
+    # --- Variantes para o event loop (playwright.async_api) ---
+    # O timeout sai dos percentis em cache e a medição só é enfileirada; consulta de
+    # percentis vencidos e gravação do lote cheio vão para uma thread.
+    async def timeout_seg_async(self, etapa: str) -> float:
+        orcamento = self.orcamentos.get(etapa, self.padrao_seg)
+        if not TIMEOUT_ADAPTATIVO:
+            return orcamento
+        registro = await registro_esperas_async()
+        percentis = registro.percentis_em_cache(self.portal)
+        if percentis is None:
+            percentis = await asyncio.to_thread(registro.percentis, self.portal)
+        return timeout_adaptativo(percentis.get(etapa), orcamento)
+
+    async def _registrar_async(self, etapa: str, duracao: float, ok: bool, limite: float):
+        registro = await registro_esperas_async()
+        if registro.enfileirar(self.portal, etapa, duracao, ok, limite):
+            await asyncio.to_thread(registro.gravar)
+
+    @asynccontextmanager
+    async def medir_async(self, etapa: str):
+        """Como `medir`, sem I/O no event loop: `async with esperas.medir_async(etapa) as timeout:`."""
+        limite = await self.timeout_seg_async(etapa)
+        inicio = time.monotonic()
+        try:
+            yield limite * 1000
+        except Exception as e:
+            if _timeout(e):
+                await self._registrar_async(etapa, time.monotonic() - inicio, False, limite)
+                logger.debug(f"[{self.portal}] Espera '{etapa}' estourou {limite:.1f}s")
+            raise
+        await self._registrar_async(etapa, time.monotonic() - inicio, True, limite)
+
+    async def visivel_async(self, locator, etapa: str):
+        async with self.medir_async(etapa) as timeout:
+            await locator.wait_for(state="visible", timeout=timeout)
+
+    async def imagem_async(self, page, locator, etapa: str):
+        async with self.medir_async(etapa) as timeout:
+            await locator.wait_for(state="visible", timeout=timeout)
+            await page.wait_for_function(JS_IMAGEM_CARREGADA, arg=await locator.element_handle(), timeout=timeout)
+
+    async def primeiro_async(self, etapa: str, **alternativas) -> str:
+        combinado = None
+        for locator in alternativas.values():
+            combinado = locator if combinado is None else combinado.or_(locator)
+        async with self.medir_async(etapa) as timeout:
+            await combinado.first.wait_for(state="visible", timeout=timeout)
+        for nome, locator in alternativas.items():
+            if await locator.first.is_visible():
+                return nome
+        return next(iter(alternativas))
+
+    async def condicao_async(self, page, expressao: str, etapa: str, arg=None):
+        async with self.medir_async(etapa) as timeout:
+            return await page.wait_for_function(expressao, arg=arg, timeout=timeout)
+
+    async def navegar_async(self, page, url: str, etapa: str = "abertura", ate: str = "domcontentloaded"):
+        async with self.medir_async(etapa) as timeout:
+            await page.goto(url, wait_until=ate, timeout=timeout)
+
+    async def carregamento_async(self, page, etapa: str, estado: str = "load"):
+        async with self.medir_async(etapa) as timeout:
+            await page.wait_for_load_state(estado, timeout=timeout)
+
+    @asynccontextmanager
+    async def evento_async(self, alvo, evento: str, etapa: str, predicate=None):
+        """`async with esperas.evento_async(page, "download", "download") as info:`; depois `await info.value`."""
+        async with self.medir_async(etapa) as timeout:
+            async with alvo.expect_event(evento, predicate=predicate, timeout=timeout) as info:
+                yield info
+
+
+# === Linha de comando ===
+if __name__ == "__main__":
+    dias = int(sys.argv[1]) if len(sys.argv) > 1 else JANELA_DIAS
+    registro = registro_esperas()
+    print(
+        f"{'portal':<14} {'etapa':<14} {'esperas':>8} {'p50':>7} {'p95':>7} {'p99':>7} "
+        f"{'máx.':>8} {'timeouts':>9} {'quase':>7}"
+    )
+    for r in registro.resumo(dias):
+        p = registro.percentis(r["portal"], dias).get(r["etapa"])
+        print(
+            f"{r['portal']:<14} {r['etapa']:<14} {r['esperas']:>8} {p.p50:>6.1f}s {p.p95:>6.1f}s {p.p99:>6.1f}s "
+            f"{r['max_seg']:>7.1f}s {r['taxa_timeout']:>9.1%} {p.taxa_quase_timeout:>7.1%}"
+        )
@@ -0,0 +1,287 @@
+import re
+import sys
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Iterable
+
+import pandas as pd
+from loguru import logger
+
+from planilha import GravadorPlanilha, normalizar_documento
+
+# === Configurações ===
+BANCO = Path("certidoes.db")
+PLANILHA = Path("base_certidoes.xlsx")
+COL_CNPJ = "CNPJ"
+COL_VALIDADE = "VALIDADE CERTIDÃO"
+COL_RAZAO = "RAZÃO SOCIAL"
+COL_STATUS = "STATUS"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS certidoes (
+    cnpj          TEXT NOT NULL,            -- documento normalizado (chave)
+    aba           TEXT NOT NULL,            -- portal / aba da planilha
+    documento     TEXT,                     -- documento como veio da planilha (CPF fica com 11 dígitos)
+    razao_social  TEXT,
+    validade      TEXT,                     -- valor gravado na coluna VALIDADE (data ou texto, ex.: COM DÉBITO)
+    validade_iso  TEXT,                     -- validade como AAAA-MM-DD, quando for data
+    status        TEXT,
+    pdf_path      TEXT,
+    tentativas    INTEGER NOT NULL DEFAULT 0,
+    duracao_seg   REAL,
+    atualizado_em TEXT,
+    PRIMARY KEY (cnpj, aba)
+);
+CREATE INDEX IF NOT EXISTS ix_certidoes_validade ON certidoes (validade_iso);
+CREATE TABLE IF NOT EXISTS importacoes (
+    aba           TEXT PRIMARY KEY,
+    mtime         REAL NOT NULL              -- mtime da planilha na última importação da aba
+);
+"""
+
+
+# === Utilitários ===
+def validade_para_iso(valor) -> str | None:
+    """Converte 'dd/mm/aaaa' (ou datetime vindo do Excel) para 'aaaa-mm-dd'; None se não for data."""
+    if valor is None:
+        return None
+    if isinstance(valor, (datetime, date)):
+        return valor.strftime("%Y-%m-%d")
+    m = re.search(r"(\d{2})/(\d{2})/(\d{4})", str(valor))
+    if m:
+        return f"{m.group(3)}-{m.group(2)}-{m.group(1)}"
+    m = re.match(r"\s*(\d{4})-(\d{2})-(\d{2})", str(valor))
+    if m:
+        return f"{m.group(1)}-{m.group(2)}-{m.group(3)}"
+    return None
+
+
+def _texto(valor) -> str | None:
+    if valor is None or (isinstance(valor, float) and pd.isna(valor)):
+        return None
+    if isinstance(valor, (datetime, date)):
+        return valor.strftime("%d/%m/%Y")
+    texto = str(valor).strip()
+    return texto or None
+
+
+# === Estado das certidões ===
+class EstadoCertidoes:
+    """
+    Registro das certidões em SQLite: uma linha por (CNPJ, aba/portal) com validade,
+    status, PDF, tentativas e tempo gasto. Os scripts leem e gravam aqui (consultas e
+    gravações em milissegundos); a planilha é importada uma vez e regenerada sob demanda.
+    """
+
+    _CAMPOS = ("documento", "razao_social", "validade", "validade_iso", "status", "pdf_path", "tentativas", "duracao_seg")
+
+    def __init__(self, caminho: Path = BANCO):
+        self.caminho = Path(caminho)
+        self._lock = threading.Lock()
+        with self._conectar() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.executescript(SCHEMA)
+
+    @contextmanager
+    def _conectar(self):
+        # uma conexão por operação: seguro entre threads e entre processos (WAL + timeout)
+        con = sqlite3.connect(self.caminho, timeout=30)
+        con.row_factory = sqlite3.Row
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    # --- Importação / exportação da planilha ---
+    def importar_planilha(self, planilha: Path = PLANILHA, abas: list[str] | None = None) -> int:
+        """
+        Copia as abas da planilha para o banco. CNPJs já conhecidos só têm a razão social
+        atualizada (validade/status do banco são preservados). Retorna o total de linhas lidas.
+        """
+        mtime = Path(planilha).stat().st_mtime  # antes da leitura: uma gravação durante ela reimporta depois
+        planilhas = pd.read_excel(planilha, sheet_name=abas if abas else None, dtype=str)
+        if not isinstance(planilhas, dict):
+            planilhas = {abas[0]: planilhas}
+
+        agora = datetime.now().isoformat(timespec="seconds")
+        total = 0
+        with self._conectar() as con:
+            for aba, df in planilhas.items():
+                con.execute(
+                    "INSERT INTO importacoes (aba, mtime) VALUES (?, ?) ON CONFLICT (aba) DO UPDATE SET mtime = excluded.mtime",
+                    (aba, mtime),
+                )
+                if COL_CNPJ not in df.columns:
+                    logger.warning(f"[Estado] Aba {aba} sem coluna {COL_CNPJ}; ignorada.")
+                    continue
+                linhas = []
+                for _, row in df.dropna(subset=[COL_CNPJ]).iterrows():
+                    cnpj = normalizar_documento(row[COL_CNPJ])
+                    if not cnpj:
+                        continue
+                    validade = _texto(row.get(COL_VALIDADE))
+                    linhas.append((
+                        cnpj, aba, re.sub(r"\D", "", str(row[COL_CNPJ])), _texto(row.get(COL_RAZAO)),
+                        validade, validade_para_iso(validade), _texto(row.get(COL_STATUS)), agora,
+                    ))
+                antes = con.execute("SELECT COUNT(*) FROM certidoes WHERE aba = ?", (aba,)).fetchone()[0]
+                con.executemany(
+                    """
+                    INSERT INTO certidoes (cnpj, aba, documento, razao_social, validade, validade_iso, status, atualizado_em)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (cnpj, aba) DO UPDATE SET razao_social = COALESCE(excluded.razao_social, razao_social)
+                    """,
+                    linhas,
+                )
+                total += len(linhas)
+                novos = con.execute("SELECT COUNT(*) FROM certidoes WHERE aba = ?", (aba,)).fetchone()[0] - antes
+                logger.info(f"[Estado] Aba {aba}: {len(linhas)} linha(s) importada(s), {novos} CNPJ(s) novo(s).")
+        return total
+
+    def sincronizar_planilha(self, abas: list[str], planilha: Path = PLANILHA) -> int:
+        """
+        Importa as abas nunca importadas ou cuja planilha mudou desde a última importação,
+        para que CNPJs incluídos na planilha cheguem aos scripts e ao agendador. Como em
+        `importar_planilha`, validade/status já no banco são preservados. Retorna as linhas lidas.
+        """
+        planilha = Path(planilha)
+        if not planilha.exists():
+            return 0
+        mtime = planilha.stat().st_mtime
+        with self._conectar() as con:
+            importadas = dict(con.execute("SELECT aba, mtime FROM importacoes").fetchall())
+        pendentes = [aba for aba in abas if importadas.get(aba) != mtime or not self.contar(aba)]
+        return self.importar_planilha(planilha, pendentes) if pendentes else 0
+
+    def exportar_planilha(self, planilha: Path = PLANILHA, abas: list[str] | None = None) -> int:
+        """Regrava validade/status do banco nas abas da planilha (uma única gravação)."""
+        gravador = GravadorPlanilha(planilha, max_pendentes=sys.maxsize, intervalo_seg=None)
+        total = 0
+        for row in self.listar(abas):
+            valores = {COL_VALIDADE: row["validade"]}
+            if row["status"] is not None:
+                valores[COL_STATUS] = row["status"]
+            gravador.registrar(row["aba"], row["cnpj"], valores)
+            total += 1
+        gravador.flush()
+        return total
+
+    # --- Leitura ---
+    def carregar_aba(self, aba: str, planilha: Path = PLANILHA) -> pd.DataFrame:
+        """
+        DataFrame no formato que os scripts já usam (RAZÃO SOCIAL, CNPJ, VALIDADE, STATUS).
+        A aba é (re)importada da planilha na primeira vez e sempre que o arquivo mudar.
+        """
+        with self._lock:
+            self.sincronizar_planilha([aba], planilha)
+
+        with self._conectar() as con:
+            df = pd.read_sql_query(
+                """
+                SELECT razao_social, documento, validade, status
+                FROM certidoes WHERE aba = ? ORDER BY rowid
+                """,
+                con,
+                params=(aba,),
+            )
+        return df.rename(columns={
+            "razao_social": COL_RAZAO,
+            "documento": COL_CNPJ,
+            "validade": COL_VALIDADE,
+            "status": COL_STATUS,
+        })
+
+    def contar(self, aba: str) -> int:
+        with self._conectar() as con:
+            return con.execute("SELECT COUNT(*) FROM certidoes WHERE aba = ?", (aba,)).fetchone()[0]
+
+    def obter(self, aba: str, cnpj: str) -> dict | None:
+        with self._conectar() as con:
+            row = con.execute(
+                "SELECT * FROM certidoes WHERE aba = ? AND cnpj = ?", (aba, normalizar_documento(cnpj))
+            ).fetchone()
+        return dict(row) if row else None
+
+    def listar(self, abas: list[str] | None = None) -> list[dict]:
+        sql = "SELECT * FROM certidoes"
+        params: tuple = ()
+        if abas:
+            sql += f" WHERE aba IN ({','.join('?' * len(abas))})"
+            params = tuple(abas)
+        with self._conectar() as con:
+            return [dict(r) for r in con.execute(sql + " ORDER BY aba, rowid", params)]
+
+    def vencendo_ate(self, limite: date, abas: list[str] | None = None) -> list[dict]:
+        """Certidões com validade até `limite` (inclusive), da que vence primeiro para a última."""
+        sql = "SELECT * FROM certidoes WHERE validade_iso IS NOT NULL AND validade_iso <= ?"
+        params: list = [limite.strftime("%Y-%m-%d")]
+        if abas:
+            sql += f" AND aba IN ({','.join('?' * len(abas))})"
+            params += list(abas)
+        with self._conectar() as con:
+            return [dict(r) for r in con.execute(sql + " ORDER BY validade_iso", params)]
+
+    # --- Gravação ---
+    def registrar(self, aba: str, cnpj: str, **campos):
+        """
+        Atualiza (ou cria) a linha do CNPJ na aba numa transação. Só os campos informados
+        são alterados: validade, status, pdf_path, tentativas, duracao_seg, razao_social.
+        """
+        with self._conectar() as con:
+            self._gravar(con, aba, cnpj, campos)
+
+    def registrar_lote(self, registros: Iterable[tuple[str, str, dict]]) -> int:
+        """Como `registrar`, para vários (aba, cnpj, campos) numa única transação. Retorna quantos."""
+        total = 0
+        with self._conectar() as con:
+            for aba, cnpj, campos in registros:
+                total += self._gravar(con, aba, cnpj, dict(campos))
+        return total
+
+    def _gravar(self, con, aba: str, cnpj: str, campos: dict) -> int:
+        chave = normalizar_documento(cnpj)
+        if not chave:
+            return 0
+        desconhecidos = set(campos) - set(self._CAMPOS)
+        if desconhecidos:
+            raise ValueError(f"Campos desconhecidos: {sorted(desconhecidos)}")
+        if "validade" in campos:
+            campos["validade"] = _texto(campos["validade"])
+            campos["validade_iso"] = validade_para_iso(campos["validade"])
+        if "pdf_path" in campos and campos["pdf_path"] is not None:
+            campos["pdf_path"] = str(campos["pdf_path"])
+        campos.setdefault("documento", re.sub(r"\D", "", str(cnpj)))
+
+        nomes = list(campos)
+        # atualizado_em sempre entra: sem campos informados o SET não fica vazio
+        atribuicoes = [f"{n} = excluded.{n}" for n in nomes if n != "documento"] + ["atualizado_em = excluded.atualizado_em"]
+        con.execute(
+            f"""
+            INSERT INTO certidoes (cnpj, aba, {', '.join(nomes + ['atualizado_em'])})
+            VALUES (?, ?, {', '.join('?' * (len(nomes) + 1))})
+            ON CONFLICT (cnpj, aba) DO UPDATE SET {', '.join(atribuicoes)}
+            """,
+            (chave, aba, *campos.values(), datetime.now().isoformat(timespec="seconds")),
+        )
+        return 1
+
+
+# === Linha de comando ===
+if __name__ == "__main__":
+    estado = EstadoCertidoes()
+    comando = sys.argv[1] if len(sys.argv) > 1 else ""
+
+    if comando == "importar":
+        logger.info(f"{estado.importar_planilha(PLANILHA, sys.argv[2:] or None)} linha(s) importada(s).")
+    elif comando == "exportar":
+        logger.info(f"{estado.exportar_planilha(PLANILHA, sys.argv[2:] or None)} linha(s) exportada(s) para {PLANILHA}.")
+    elif comando == "vencendo":
+        dias = int(sys.argv[2]) if len(sys.argv) > 2 else 7
+        for row in estado.vencendo_ate(date.today() + timedelta(days=dias), sys.argv[3:] or None):
+            print(f"{row['validade']}  {row['aba']:<14} {row['documento']}  {row['razao_social'] or ''}")
+    else:
+        print("uso: python estado.py [importar [ABA...] | exportar [ABA...] | vencendo [DIAS [ABA...]]]")
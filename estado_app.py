@@ -0,0 +1,51 @@
+import threading
+from pathlib import Path
+
+from esperas import Esperas
+from estado import EstadoCertidoes
+from estrategias import Estrategias
+from planilha import GravadorPlanilha
+from pos_processamento import PosProcessamento
+
+
+# === Estado compartilhado de um app ===
+class EstadoApp:
+    """
+    Banco, esperas, estratégias, pós-processamento e gravador da planilha de um portal.
+
+    O objeto pode ser criado na importação do script (`APP = EstadoApp(ABA, PLANILHA, ...)`),
+    mas nada é aberto até `iniciar()`, chamado pelo fluxo principal. Os processos do
+    pós-processamento usam spawn e reimportam o script principal como __mp_main__: lá
+    não se pode abrir o banco nem a planilha, nem registrar atexit/SIGTERM.
+    """
+
+    def __init__(
+        self,
+        aba: str,
+        planilha: Path,
+        orcamento_esperas: dict[str, float] | None = None,
+        estrategias: tuple[str, ...] = (),
+        criar_colunas: bool = False,
+    ):
+        self.aba = aba
+        self.planilha = planilha
+        self.orcamento_esperas = orcamento_esperas
+        self.acoes = estrategias
+        self.criar_colunas = criar_colunas
+        self.estado: EstadoCertidoes | None = None
+        self.esperas: Esperas | None = None
+        self.estrategias: dict[str, Estrategias] = {}
+        self.pos: PosProcessamento | None = None
+        self.gravador: GravadorPlanilha | None = None
+        self._lock = threading.Lock()
+
+    def iniciar(self) -> "EstadoApp":
+        """Cria tudo uma única vez; chamadas seguintes não fazem nada."""
+        with self._lock:
+            if self.estado is None:
+                self.esperas = Esperas(self.aba, self.orcamento_esperas)
+                self.estrategias = {acao: Estrategias(self.aba, acao) for acao in self.acoes}
+                self.pos = PosProcessamento(self.aba)
+                self.gravador = GravadorPlanilha(self.planilha, criar_colunas=self.criar_colunas)
+                self.estado = EstadoCertidoes()
+        return self
@@ -0,0 +1,141 @@
+import sys
+import asyncio
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Awaitable, Callable
+
+from loguru import logger
+
+from estado import BANCO
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS estrategias (
+    portal         TEXT NOT NULL,
+    acao           TEXT NOT NULL,           -- ex.: radio_cnpj, campo_cnpj
+    estrategia     TEXT NOT NULL,
+    sucessos       INTEGER NOT NULL DEFAULT 0,
+    falhas         INTEGER NOT NULL DEFAULT 0,
+    ultimo_sucesso TEXT,
+    PRIMARY KEY (portal, acao, estrategia)
+);
+"""
+
+
+# === Ranking de estratégias ===
+class Estrategias:
+    """
+    Ranking, persistido no banco do estado, das estratégias alternativas de uma ação
+    num portal (ex.: os vários jeitos de marcar o radio 'CNPJ'). `executar` tenta
+    primeiro a que funcionou por último (nesta ou em execuções anteriores) e só desce
+    para as outras quando ela falha, sem pagar a cada CNPJ os timeouts das que já se
+    sabe que não funcionam. Se o portal mudar, a nova que funcionar passa à frente
+    logo no primeiro acerto.
+    """
+
+    def __init__(self, portal: str, acao: str, caminho: Path = BANCO):
+        self.portal = portal
+        self.acao = acao
+        self.caminho = Path(caminho)
+        self._lock = threading.Lock()
+        with self._conectar() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.executescript(SCHEMA)
+            self._placar = {
+                r["estrategia"]: [r["sucessos"], r["falhas"], r["ultimo_sucesso"]]
+                for r in con.execute(
+                    "SELECT estrategia, sucessos, falhas, ultimo_sucesso FROM estrategias WHERE portal = ? AND acao = ?",
+                    (portal, acao),
+                )
+            }
+
+    @contextmanager
+    def _conectar(self):
+        con = sqlite3.connect(self.caminho, timeout=30)
+        con.row_factory = sqlite3.Row
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def ordem(self, nomes: list[str]) -> list[str]:
+        """
+        As que já funcionaram, da mais recente para a mais antiga; depois as nunca
+        tentadas e, por último, as que só falharam (essas duas na ordem declarada).
+        """
+        with self._lock:
+            placar = {n: self._placar.get(n, [0, 0, None]) for n in nomes}
+        ja_funcionaram = sorted((n for n in nomes if placar[n][2]), key=lambda n: placar[n][2], reverse=True)
+        nunca_tentadas = [n for n in nomes if not placar[n][2] and not placar[n][1]]
+        so_falharam = [n for n in nomes if not placar[n][2] and placar[n][1]]
+        return ja_funcionaram + nunca_tentadas + so_falharam
+
+    def _registrar(self, estrategia: str, ok: bool):
+        agora = datetime.now().isoformat()
+        with self._lock:
+            placar = self._placar.setdefault(estrategia, [0, 0, None])
+            placar[0 if ok else 1] += 1
+            if ok:
+                placar[2] = agora
+        with self._conectar() as con:
+            con.execute(
+                f"""
+                INSERT INTO estrategias (portal, acao, estrategia, sucessos, falhas, ultimo_sucesso)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (portal, acao, estrategia) DO UPDATE SET
+                    {'sucessos = sucessos + 1, ultimo_sucesso = excluded.ultimo_sucesso' if ok else 'falhas = falhas + 1'}
+                """,
+                (
+                    self.portal, self.acao, estrategia, int(ok), int(not ok),
+                    agora if ok else None,
+                ),
+            )
+
+    def executar(self, estrategias: dict[str, Callable]):
+        """
+        Chama as estratégias (funções sem argumentos) na ordem do ranking até uma
+        devolver um resultado verdadeiro, que é retornado. Exceção ou resultado falso
+        contam como falha. None quando nenhuma funciona.
+        """
+        for nome in self.ordem(list(estrategias)):
+            try:
+                resultado = estrategias[nome]()
+            except Exception as e:
+                logger.debug(f"[{self.portal}] {self.acao}: '{nome}' falhou ({type(e).__name__})")
+                resultado = None
+            self._registrar(nome, bool(resultado))
+            if resultado:
+                return resultado
+        return None
+
+    async def executar_async(self, estrategias: dict[str, Callable[[], Awaitable]]):
+        """Como `executar`, com estratégias assíncronas; o placar é gravado numa thread."""
+        for nome in self.ordem(list(estrategias)):
+            try:
+                resultado = await estrategias[nome]()
+            except Exception as e:
+                logger.debug(f"[{self.portal}] {self.acao}: '{nome}' falhou ({type(e).__name__})")
+                resultado = None
+            await asyncio.to_thread(self._registrar, nome, bool(resultado))
+            if resultado:
+                return resultado
+        return None
+
+
+# === Linha de comando ===
+if __name__ == "__main__":
+    with sqlite3.connect(BANCO) as con:
+        con.executescript(SCHEMA)
+        filtro = sys.argv[1] if len(sys.argv) > 1 else None
+        linhas = con.execute(
+            "SELECT portal, acao, estrategia, sucessos, falhas, ultimo_sucesso FROM estrategias"
+            + (" WHERE portal = ?" if filtro else "")
+            + " ORDER BY portal, acao, sucessos DESC",
+            (filtro,) if filtro else (),
+        ).fetchall()
+    print(f"{'portal':<10} {'ação':<14} {'estratégia':<16} {'sucessos':>9} {'falhas':>7}  último sucesso")
+    for portal, acao, estrategia, sucessos, falhas, ultimo in linhas:
+        print(f"{portal:<10} {acao:<14} {estrategia:<16} {sucessos:>9} {falhas:>7}  {ultimo or '-'}")
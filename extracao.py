@@ -0,0 +1,170 @@
+import re
+import sys
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Sequence
+
+import lxml.html
+from loguru import logger
+
+from documentos import blocos_por_pagina, descrever
+
+# === Padrões comuns ===
+RE_EMISSAO = r"(?:emitid[ao]|expedi[çc][ãa]o|emiss[ãa]o)[^\n\d]{0,40}?(?:\d{2}:\d{2}(?::\d{2})?[^\n\d]{0,15})?(\d{2}/\d{2}/\d{4})"
+RE_NUMERO = (
+    r"(?:certid[ãa]o\s+n(?:[º°]|o\.|\.\s*[º°]?)|c[óo]digo\s+de\s+controle(?:\s+da\s+certid[ãa]o)?|certifica[çc][ãa]o\s+n[úu]mero)"
+    r"\s*:?\s*([A-Z0-9./-]*\d[A-Z0-9./-]*)"
+)
+SITUACOES = (  # a primeira que aparecer no texto vale; as mais específicas vêm antes
+    ("POSITIVA COM EFEITOS DE NEGATIVA", r"positiva\s+com\s+efeitos?\s+de\s+negativa"),
+    ("POSITIVA", r"certid[ãa]o\s+positiva"),
+    ("NEGATIVA", r"certid[ãa]o\s+negativa|nada\s+consta"),
+)
+
+
+@dataclass(frozen=True)
+class PadroesCertidao:
+    validade: re.Pattern
+    emissao: re.Pattern
+    numero: re.Pattern
+    situacoes: tuple[tuple[str, re.Pattern], ...]
+    pagina: str = "inicio"      # página por onde começa a busca no PDF: "inicio" ou "fim"
+    ancora: str | None = None   # trecho (minúsculo) perto da validade
+
+
+def padroes(validade: str, pagina: str = "inicio", ancora: str | None = None,
+            emissao: str = RE_EMISSAO, numero: str = RE_NUMERO,
+            situacoes: tuple[tuple[str, str], ...] = SITUACOES) -> PadroesCertidao:
+    """Compila, uma vez, os padrões de um portal (todos sem diferenciar maiúsculas)."""
+    return PadroesCertidao(
+        validade=re.compile(validade, re.I),
+        emissao=re.compile(emissao, re.I),
+        numero=re.compile(numero, re.I),
+        situacoes=tuple((rotulo, re.compile(padrao, re.I)) for rotulo, padrao in situacoes),
+        pagina=pagina,
+        ancora=ancora.lower() if ancora else None,
+    )
+
+
+# === Registro por portal (chave = aba da planilha) ===
+PADROES: dict[str, PadroesCertidao] = {
+    "SEFAZ CONT": padroes(r"Válida até:\s*(\d{2}/\d{2}/\d{4})", ancora="válida até"),
+    "SEFAZ N CONT": padroes(r"Válida até:\s*(\d{2}/\d{2}/\d{4})", ancora="válida até"),
+    "PMM": padroes(r"VÁLIDA ATÉ \s*(\d{2}/\d{2}/\d{4})", ancora="válida até"),
+    "CDT": padroes(r"Validade:\s*(\d{2}/\d{2}/\d{4})", ancora="validade"),
+    # positiva com efeitos de negativa ocupa várias páginas; o "Válida até" fica na última
+    "RFB": padroes(r"Válida até (\d{2}/\d{2}/\d{4})", pagina="fim", ancora="válida até"),
+    "FALÊNCIA": padroes(r"VÁLIDA ATÉ:\s*(\d{2}/\d{2}/\d{4})", ancora="válida até"),
+    "MTE": padroes(r"Válida até:\s*(\d{2}/\d{2}/\d{4})", ancora="válida até"),
+    # CRF vem do HTML: "Validade: 01/03/2025 a 30/03/2025" (vale a data final)
+    "CRF": padroes(
+        r"Validade:\s*\d{2}/\d{2}/\d{4}\s*a\s*(\d{2}/\d{2}/\d{4})", ancora="validade",
+        emissao=r"obtida\s+em\s*:?\s*(\d{2}/\d{2}/\d{4})",
+        situacoes=(("REGULAR", r"est[áa]\s+regular"), ("IRREGULAR", r"irregular")),
+    ),
+}
+
+
+# === Resultado ===
+@dataclass
+class DadosCertidao:
+    validade: str = ""      # dd/mm/aaaa
+    emissao: str = ""       # dd/mm/aaaa
+    numero: str = ""
+    situacao: str = ""      # NEGATIVA, POSITIVA, POSITIVA COM EFEITOS DE NEGATIVA, REGULAR...
+    paginas_lidas: int = field(default=0, compare=False)
+
+    @property
+    def completo(self) -> bool:
+        return all((self.validade, self.emissao, self.numero, self.situacao))
+
+    def resumo(self) -> str:
+        partes = [f"validade {self.validade or '?'}"]
+        if self.situacao:
+            partes.append(self.situacao)
+        if self.numero:
+            partes.append(f"nº {self.numero}")
+        return ", ".join(partes)
+
+
+# === Extração ===
+def _grupo(padrao: re.Pattern, texto: str) -> str:
+    achado = padrao.search(texto)
+    return achado.group(1) if achado else ""
+
+
+def _ler_texto(dados: DadosCertidao, p: PadroesCertidao, texto: str, blocos: Sequence[str] = ()):
+    """Preenche, numa passada sobre o mesmo texto, os campos que ainda faltam."""
+    if not dados.validade and p.ancora:
+        # primeiro só os blocos com a âncora (e o seguinte, onde às vezes fica a data)
+        for i, bloco in enumerate(blocos):
+            if p.ancora in bloco.lower():
+                dados.validade = _grupo(p.validade, "\n".join(blocos[i:i + 2]))
+                if dados.validade:
+                    break
+    dados.validade = dados.validade or _grupo(p.validade, texto)
+    dados.emissao = dados.emissao or _grupo(p.emissao, texto)
+    dados.numero = dados.numero or _grupo(p.numero, texto)
+    if not dados.situacao:
+        dados.situacao = next((rotulo for rotulo, padrao in p.situacoes if padrao.search(texto)), "")
+
+
+def extrair_certidao(origem: bytes | Path | str, portal: str) -> DadosCertidao:
+    """
+    Validade, emissão, número e situação da certidão em PDF (bytes ou caminho), com os
+    padrões de `portal`. As páginas são lidas sob demanda, a partir da ponta configurada;
+    a leitura para quando todos os campos apareceram ou, achada a validade, depois das
+    duas pontas (onde ficam os demais dados). Erros de leitura viram um registro vazio,
+    com aviso no log. Texto e HTML têm funções próprias, logo abaixo.
+    """
+    p = PADROES[portal]
+    dados = DadosCertidao()
+    if isinstance(origem, str):
+        origem = Path(origem)
+
+    try:
+        for posicao, blocos in enumerate(blocos_por_pagina(origem, p.pagina)):
+            _ler_texto(dados, p, "\n".join(blocos), blocos)
+            dados.paginas_lidas += 1
+            if dados.completo or (dados.validade and posicao >= 1):
+                break
+    except Exception as e:
+        logger.warning(f"[{portal}] Erro ao ler o PDF {descrever(origem)}: {e}")
+    return dados
+
+
+def extrair_certidao_texto(texto: str, portal: str) -> DadosCertidao:
+    """Como `extrair_certidao`, sobre o texto já extraído da certidão."""
+    dados = DadosCertidao()
+    _ler_texto(dados, PADROES[portal], texto)
+    return dados
+
+
+def extrair_certidao_html(html: str | bytes, portal: str) -> DadosCertidao:
+    """Como `extrair_certidao`, sobre o HTML da certidão: lê só o texto visível, sem as tags."""
+    if isinstance(html, bytes):
+        # bytes sem <meta charset> o lxml lê como latin-1; UTF-8 válido é decodificado aqui
+        try:
+            html = html.decode("utf-8")
+        except UnicodeDecodeError:
+            pass
+    try:
+        texto = " ".join(lxml.html.fromstring(html).text_content().split())
+    except Exception as e:
+        logger.warning(f"[{portal}] Erro ao ler o HTML da certidão: {type(e).__name__}: {e}")
+        return DadosCertidao()
+    return extrair_certidao_texto(texto, portal)
+
+
+# === Linha de comando ===
+if __name__ == "__main__":
+    # python extracao.py RFB certidao.pdf [outra.html ...]
+    if len(sys.argv) < 3 or sys.argv[1] not in PADROES:
+        print(f"uso: python extracao.py <{'|'.join(PADROES)}> arquivo.pdf|arquivo.html [...]")
+        sys.exit(1)
+    for arquivo in sys.argv[2:]:
+        if arquivo.lower().endswith((".html", ".htm")):
+            dados = extrair_certidao_html(Path(arquivo).read_bytes(), sys.argv[1])
+        else:
+            dados = extrair_certidao(Path(arquivo), sys.argv[1])
+        print(f"{arquivo}: {dados.resumo()} (emissão {dados.emissao or '?'}, {dados.paginas_lidas} página(s) lida(s))")
@@ -0,0 +1,144 @@
+import sys
+import sqlite3
+import time
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from loguru import logger
+
+from captcha import Solucao
+from estado import BANCO
+
+# === Configurações ===
+CUSTO_POR_SOLUCAO = {"2captcha": 0.001, "ocr": 0.0}  # USD por captcha de imagem
+TEMPO_TENTATIVA_SEG = 8.0     # recarregar o formulário e reenviar quando o portal recusa a resposta
+JANELA_DIAS = 7
+MIN_AMOSTRAS = 20             # abaixo disso a fonte ainda não é comparada
+CACHE_PREFERENCIA_SEG = 300
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS captchas (
+    portal        TEXT NOT NULL,
+    fonte         TEXT NOT NULL,            -- ocr | 2captcha
+    cnpj          TEXT,
+    captcha_id    TEXT,
+    latencia_seg  REAL,
+    aceito        INTEGER NOT NULL,         -- 1: o portal aceitou a resposta; 0: recusou
+    custo         REAL NOT NULL DEFAULT 0,
+    registrado_em TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_captchas_portal ON captchas (portal, registrado_em);
+"""
+
+
+# === Métricas de captcha ===
+class MetricasCaptcha:
+    """
+    Histórico de cada resposta de captcha enviada a um portal: fonte (OCR local ou
+    2Captcha), tempo de solução, se o portal aceitou e quanto custou. Fica no mesmo
+    banco do estado das certidões.
+
+    Além do relatório (`resumo`), `fonte_preferida` compara as fontes pelo tempo
+    esperado até uma resposta aceita, contando o tempo perdido a cada recusa.
+    """
+
+    def __init__(self, caminho: Path = BANCO):
+        self.caminho = Path(caminho)
+        self._preferencias: dict[str, tuple[float, str | None]] = {}
+        self._lock = threading.Lock()
+        with self._conectar() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.executescript(SCHEMA)
+
+    @contextmanager
+    def _conectar(self):
+        con = sqlite3.connect(self.caminho, timeout=30)
+        con.row_factory = sqlite3.Row
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def registrar(self, portal: str, solucao: Solucao, aceito: bool, cnpj: str = ""):
+        with self._conectar() as con:
+            con.execute(
+                """
+                INSERT INTO captchas (portal, fonte, cnpj, captcha_id, latencia_seg, aceito, custo, registrado_em)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    portal, solucao.fonte, cnpj or None, solucao.id or None, solucao.latencia, int(aceito),
+                    CUSTO_POR_SOLUCAO.get(solucao.fonte, 0.0), datetime.now().isoformat(timespec="seconds"),
+                ),
+            )
+
+    def resumo(self, dias: int = JANELA_DIAS, portal: str | None = None) -> list[dict]:
+        """Por portal e fonte: respostas, taxa de recusa, latência média, custo total e por certidão."""
+        sql = """
+            SELECT portal, fonte,
+                   COUNT(*)                     AS respostas,
+                   SUM(aceito)                  AS aceitas,
+                   1.0 - AVG(aceito)            AS taxa_recusa,
+                   AVG(latencia_seg)            AS latencia_media,
+                   SUM(custo)                   AS custo_total,
+                   SUM(custo) / NULLIF(SUM(aceito), 0) AS custo_por_certidao
+            FROM captchas
+            WHERE registrado_em >= ?
+        """
+        params: list = [(datetime.now() - timedelta(days=dias)).isoformat(timespec="seconds")]
+        if portal:
+            sql += " AND portal = ?"
+            params.append(portal)
+        with self._conectar() as con:
+            return [dict(r) for r in con.execute(sql + " GROUP BY portal, fonte ORDER BY portal, fonte", params)]
+
+    def fonte_preferida(self, portal: str) -> str | None:
+        """
+        Fonte com menor tempo esperado por resposta aceita, (latência + tempo de uma
+        tentativa) / taxa de aceite, nos últimos JANELA_DIAS. None sem amostras suficientes.
+        """
+        with self._lock:
+            em_cache = self._preferencias.get(portal)
+            if em_cache and time.monotonic() - em_cache[0] < CACHE_PREFERENCIA_SEG:
+                return em_cache[1]
+
+        tempos = {}
+        for linha in self.resumo(portal=portal):
+            if linha["respostas"] < MIN_AMOSTRAS:
+                continue
+            aceite = 1.0 - linha["taxa_recusa"]
+            tempos[linha["fonte"]] = (linha["latencia_media"] + TEMPO_TENTATIVA_SEG) / aceite if aceite else float("inf")
+        preferida = min(tempos, key=tempos.get) if len(tempos) > 1 else None
+        if preferida:
+            logger.debug(f"[Métricas] {portal}: {', '.join(f'{f} {t:.1f}s' for f, t in tempos.items())} → {preferida}")
+
+        with self._lock:
+            self._preferencias[portal] = (time.monotonic(), preferida)
+        return preferida
+
+
+_METRICAS: MetricasCaptcha | None = None
+_METRICAS_LOCK = threading.Lock()
+
+
+def metricas_captcha() -> MetricasCaptcha:
+    global _METRICAS
+    with _METRICAS_LOCK:
+        if _METRICAS is None:
+            _METRICAS = MetricasCaptcha()
+        return _METRICAS
+
+
+# === Linha de comando ===
+if __name__ == "__main__":
+    dias = int(sys.argv[1]) if len(sys.argv) > 1 else JANELA_DIAS
+    print(f"{'portal':<14} {'fonte':<9} {'resp.':>6} {'recusa':>7} {'latência':>9} {'custo':>8} {'US$/certidão':>13}")
+    for r in metricas_captcha().resumo(dias):
+        por_certidao = f"{r['custo_por_certidao']:.4f}" if r["custo_por_certidao"] is not None else "-"
+        print(
+            f"{r['portal']:<14} {r['fonte']:<9} {r['respostas']:>6} {r['taxa_recusa']:>7.1%} "
+            f"{r['latencia_media'] or 0:>8.1f}s {r['custo_total']:>8.3f} {por_certidao:>13}"
+        )
@@ -0,0 +1,89 @@
+import asyncio
+import traceback
+from typing import Awaitable, Callable, Iterable
+
+from loguru import logger
+from playwright.async_api import async_playwright
+
+from captcha import Cliente2Captcha, Solucao, cliente_2captcha
+from ocr_captcha import disponivel, resolver_local, usar_ocr
+
+
+# === Motor assíncrono ===
+class MotorAsync:
+    """
+    Executa um fluxo assíncrono (playwright.async_api) para vários CNPJs ao mesmo tempo
+    num único processo, browser e event loop. Cada CNPJ em andamento usa um contexto
+    isolado (cookies/sessão próprios) de um conjunto de `concorrencia` contextos.
+
+    O fluxo recebe `(motor, page, context, item)`; pelo motor ele acessa
+    `motor.resolver_captcha_imagem`, que aguarda o cliente 2Captcha compartilhado sem
+    bloquear o event loop.
+    """
+
+    def __init__(
+        self,
+        concorrencia: int = 10,
+        headless: bool = False,
+        opcoes_launch: dict | None = None,
+        opcoes_contexto: dict | None = None,
+        nome: str = "async",
+    ):
+        self.concorrencia = concorrencia
+        self.headless = headless
+        self.opcoes_launch = opcoes_launch or {}
+        self.opcoes_contexto = opcoes_contexto or {}
+        self.nome = nome
+        self.captcha = cliente_2captcha()
+
+    def executar(self, itens: Iterable, fluxo: Callable[..., Awaitable], preparar_pagina: Callable | None = None):
+        asyncio.run(self._executar(list(itens), fluxo, preparar_pagina))
+
+    async def _executar(self, itens: list, fluxo, preparar_pagina):
+        if not itens:
+            return
+        logger.info(f"[{self.nome}] {len(itens)} item(ns), até {self.concorrencia} em andamento.")
+
+        async with async_playwright() as p:
+            browser = await p.chromium.launch(headless=self.headless, **self.opcoes_launch)
+            slots: asyncio.Queue = asyncio.Queue()
+
+            async def novo_page(context):
+                page = await context.new_page()
+                if preparar_pagina:
+                    await preparar_pagina(page)
+                return page
+
+            contextos = []
+            for _ in range(min(self.concorrencia, len(itens))):
+                context = await browser.new_context(**self.opcoes_contexto)
+                contextos.append(context)
+                slots.put_nowait((context, await novo_page(context)))
+
+            async def processar(item):
+                context, page = await slots.get()
+                try:
+                    if page.is_closed():
+                        page = await novo_page(context)
+                    await fluxo(self, page, context, item)
+                except Exception as e:
+                    logger.error(f"[{self.nome}] {item} → ERRO: {type(e).__name__}: {e}")
+                    traceback.print_exc()
+                finally:
+                    slots.put_nowait((context, page))
+
+            try:
+                await asyncio.gather(*(processar(item) for item in itens))
+            finally:
+                for context in contextos:
+                    await context.close()
+                await browser.close()
+
+    # === 2Captcha (image captcha) ===
+    async def resolver_captcha_imagem(self, imagem: bytes, portal: str | None = None) -> Solucao:
+        # com `portal`, tenta antes o OCR local (se as métricas não o descartaram para ele)
+        if portal and disponivel() and usar_ocr(portal):
+            local = await asyncio.to_thread(resolver_local, portal, imagem)
+            if local:
+                return local
+        return await Cliente2Captcha.aguardar(self.captcha.imagem(imagem))
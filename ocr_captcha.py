@@ -0,0 +1,274 @@
+import re
+import sys
+import json
+import time
+import random
+import threading
+from pathlib import Path
+from uuid import uuid4
+
+from loguru import logger
+
+from captcha import Solucao, cliente_2captcha
+from metricas import metricas_captcha
+
+try:
+    import cv2
+    import numpy as np
+    import pytesseract
+except ImportError:  # OCR local fica desligado; tudo vai para o 2Captcha
+    cv2 = np = pytesseract = None
+
+# === Configurações ===
+PASTA_CERTIDOES = Path("certidoes_baixadas")
+CALIBRACAO = Path("ocr_calibracao.json")
+PASTA_ROTULADOS = "rotulados"          # certidoes_baixadas/<ABA>/rotulados/<texto>_<id>.png
+PRECISAO_MINIMA = 0.9                  # a calibração escolhe o menor limiar que mantém esta taxa de acerto
+MIN_AMOSTRAS_CALIBRACAO = 20
+EXPLORACAO_OCR = 0.1                   # fração de captchas que ainda tenta o OCR quando o 2Captcha está na frente
+PADRAO = {"variante": "otsu", "psm": 7, "limiar": 90.0, "caracteres": "", "tamanhos": [4, 8]}
+
+
+# === Pré-processamento ===
+def _cinza_ampliado(img):
+    cinza = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    return cv2.resize(cinza, None, fx=3, fy=3, interpolation=cv2.INTER_CUBIC)
+
+
+def _texto_escuro(binaria):
+    # o tesseract lê melhor texto preto em fundo branco
+    return cv2.bitwise_not(binaria) if binaria.mean() < 127 else binaria
+
+
+def _otsu(img):
+    cinza = cv2.GaussianBlur(_cinza_ampliado(img), (3, 3), 0)
+    _, binaria = cv2.threshold(cinza, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return _texto_escuro(binaria)
+
+
+def _adaptativo(img):
+    cinza = cv2.medianBlur(_cinza_ampliado(img), 3)
+    binaria = cv2.adaptiveThreshold(cinza, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 10)
+    return _texto_escuro(binaria)
+
+
+def _sem_linhas(img):
+    # abertura morfológica remove riscos finos que cruzam os caracteres
+    binaria = cv2.bitwise_not(_otsu(img))
+    aberta = cv2.morphologyEx(binaria, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)))
+    return cv2.bitwise_not(aberta)
+
+
+VARIANTES = {"otsu": _otsu, "adaptativo": _adaptativo, "sem_linhas": _sem_linhas}
+
+
+# === Reconhecimento ===
+def normalizar_resposta(texto: str) -> str:
+    return re.sub(r"\W", "", texto or "")
+
+
+def _carregar_imagem(imagem: bytes | Path):
+    dados = Path(imagem).read_bytes() if isinstance(imagem, (str, Path)) else imagem
+    return cv2.imdecode(np.frombuffer(dados, np.uint8), cv2.IMREAD_COLOR)
+
+
+def _ocr(img, variante: str, psm: int, caracteres: str) -> tuple[str, float]:
+    config = f"--psm {psm} --oem 1"
+    if caracteres:
+        config += f" -c tessedit_char_whitelist={caracteres}"
+    dados = pytesseract.image_to_data(VARIANTES[variante](img), config=config, output_type=pytesseract.Output.DICT)
+    palavras = [(p, float(c)) for p, c in zip(dados["text"], dados["conf"]) if p.strip() and float(c) >= 0]
+    if not palavras:
+        return "", 0.0
+    return normalizar_resposta("".join(p for p, _ in palavras)), min(c for _, c in palavras)
+
+
+_tesseract_ok: bool | None = None
+_calibracao: dict | None = None
+_lock = threading.Lock()
+
+
+def disponivel() -> bool:
+    global _tesseract_ok
+    if _tesseract_ok is None:
+        _tesseract_ok = False
+        if pytesseract is not None:
+            try:
+                pytesseract.get_tesseract_version()
+                _tesseract_ok = True
+            except Exception as e:
+                logger.warning(f"[OCR] Tesseract indisponível ({type(e).__name__}); usando só o 2Captcha.")
+    return _tesseract_ok
+
+
+def perfil(portal: str) -> dict:
+    global _calibracao
+    with _lock:
+        if _calibracao is None:
+            _calibracao = json.loads(CALIBRACAO.read_text(encoding="utf-8")) if CALIBRACAO.exists() else {}
+    return {**PADRAO, **_calibracao.get(portal, {})}
+
+
+def _formato_ok(texto: str, conf: dict) -> bool:
+    minimo, maximo = conf["tamanhos"]
+    if not minimo <= len(texto) <= maximo:
+        return False
+    return not conf["caracteres"] or all(c in conf["caracteres"] for c in texto)
+
+
+def resolver_local(portal: str, imagem: bytes | Path) -> Solucao | None:
+    """Tenta o OCR local; None quando não há OCR ou a confiança fica abaixo do limiar do portal."""
+    if not disponivel():
+        return None
+    conf = perfil(portal)
+    inicio = time.monotonic()
+    try:
+        texto, confianca = _ocr(_carregar_imagem(imagem), conf["variante"], conf["psm"], conf["caracteres"])
+    except Exception as e:
+        logger.debug(f"[OCR] {portal}: falha no OCR local: {type(e).__name__}: {e}")
+        return None
+    if confianca < conf["limiar"] or not _formato_ok(texto, conf):
+        logger.debug(f"[OCR] {portal}: '{texto}' (confiança {confianca:.0f}) recusado; indo para o 2Captcha.")
+        return None
+    return Solucao(texto, "", round(time.monotonic() - inicio, 3), fonte="ocr")
+
+
+def usar_ocr(portal: str) -> bool:
+    # o OCR sai da frente quando as recusas do portal o deixam mais lento que o 2Captcha,
+    # mas segue sendo tentado de vez em quando para as métricas refletirem recalibrações
+    if metricas_captcha().fonte_preferida(portal) != "2captcha":
+        return True
+    return random.random() < EXPLORACAO_OCR
+
+
+def resolver_imagem(portal: str, imagem: bytes | Path) -> Solucao:
+    """OCR local primeiro (milissegundos, sem custo); 2Captcha quando a confiança é baixa."""
+    local = resolver_local(portal, imagem) if disponivel() and usar_ocr(portal) else None
+    return local or cliente_2captcha().resolver_imagem(imagem)
+
+
+def confirmar_captcha(portal: str, solucao: Solucao, aceito: bool, imagem: bytes | Path | None = None, cnpj: str = ""):
+    """
+    Resultado da resposta no portal: entra nas métricas, é reportado ao 2Captcha
+    (reportgood/reportbad) e, se aceito, a imagem vira amostra rotulada para o OCR.
+    """
+    try:
+        metricas_captcha().registrar(portal, solucao, aceito, cnpj)
+    except Exception as e:
+        logger.debug(f"[Métricas] Falha ao registrar captcha de {portal}: {type(e).__name__}: {e}")
+    cliente_2captcha().reportar(solucao, aceito)
+    if aceito and imagem is not None:
+        rotular_captcha(portal, imagem, solucao.texto)
+
+
+def rotular_captcha(portal: str, imagem: bytes | Path, texto: str):
+    """Guarda um captcha aceito pelo portal com a resposta no nome (amostra para `calibrar`)."""
+    texto = normalizar_resposta(texto)
+    if not texto:
+        return
+    pasta = PASTA_CERTIDOES / portal.replace(" ", "_") / PASTA_ROTULADOS
+    pasta.mkdir(parents=True, exist_ok=True)
+    dados = Path(imagem).read_bytes() if isinstance(imagem, (str, Path)) else imagem
+    (pasta / f"{texto}_{uuid4().hex[:8]}.png").write_bytes(dados)
+
+
+# === Calibração ===
+def amostras_rotuladas(portal: str) -> list[tuple[Path, str]]:
+    pasta = PASTA_CERTIDOES / portal.replace(" ", "_") / PASTA_ROTULADOS
+    return [(p, p.stem.rsplit("_", 1)[0]) for p in sorted(pasta.glob("*.png"))]
+
+
+def _melhor_limiar(resultados: list[tuple[float, bool]]) -> tuple[float, int, float]:
+    """Menor limiar de confiança com precisão >= PRECISAO_MINIMA → (limiar, acertos aceitos, precisão)."""
+    melhor = (101.0, 0, 0.0)
+    acertos = 0
+    for n, (confianca, acertou) in enumerate(sorted(resultados, key=lambda r: -r[0]), start=1):
+        acertos += acertou
+        if acertos / n >= PRECISAO_MINIMA and acertos > melhor[1]:
+            melhor = (confianca, acertos, acertos / n)
+    return melhor
+
+
+def calibrar(portal: str) -> dict | None:
+    """
+    Avalia cada pré-processamento × modo de página do tesseract nos captchas rotulados do
+    portal e grava em CALIBRACAO a combinação que resolve mais captchas localmente com
+    precisão >= PRECISAO_MINIMA, junto com o limiar de confiança correspondente.
+    """
+    amostras = amostras_rotuladas(portal)
+    if len(amostras) < MIN_AMOSTRAS_CALIBRACAO:
+        logger.warning(f"[OCR] {portal}: {len(amostras)} amostra(s) rotulada(s); mínimo {MIN_AMOSTRAS_CALIBRACAO}.")
+        return None
+
+    rotulos = [texto for _, texto in amostras]
+    caracteres = "".join(sorted(set("".join(rotulos))))
+    tamanhos = [min(map(len, rotulos)), max(map(len, rotulos))]
+    imagens = [_carregar_imagem(p) for p, _ in amostras]
+
+    melhor = None
+    for variante in VARIANTES:
+        for psm in (7, 8, 13):
+            resultados = []
+            for img, rotulo in zip(imagens, rotulos):
+                texto, confianca = _ocr(img, variante, psm, caracteres)
+                resultados.append((confianca, texto == rotulo))
+            limiar, aceitos, precisao = _melhor_limiar(resultados)
+            logger.info(
+                f"[OCR] {portal} {variante}/psm {psm}: {sum(a for _, a in resultados)}/{len(amostras)} corretos; "
+                f"limiar {limiar:.0f} resolve {aceitos} localmente (precisão {precisao:.0%})"
+            )
+            if melhor is None or aceitos > melhor["cobertura"]:
+                melhor = {
+                    "variante": variante, "psm": psm, "limiar": limiar, "caracteres": caracteres,
+                    "tamanhos": tamanhos, "cobertura": aceitos, "precisao": round(precisao, 3),
+                    "amostras": len(amostras),
+                }
+
+    global _calibracao
+    with _lock:
+        dados = json.loads(CALIBRACAO.read_text(encoding="utf-8")) if CALIBRACAO.exists() else {}
+        dados[portal] = melhor
+        CALIBRACAO.write_text(json.dumps(dados, indent=2, ensure_ascii=False), encoding="utf-8")
+        _calibracao = dados
+    logger.success(
+        f"[OCR] {portal}: {melhor['variante']}/psm {melhor['psm']}, limiar {melhor['limiar']:.0f} → "
+        f"{melhor['cobertura']}/{len(amostras)} sem 2Captcha."
+    )
+    return melhor
+
+
+def rotular_com_2captcha(portal: str, limite: int = 100) -> int:
+    """
+    Primeira carga de amostras: envia ao 2Captcha os `captcha_*.png` já salvos do portal
+    (todos de uma vez; o cliente consulta em lote) e guarda as respostas como rótulos.
+    """
+    pasta = PASTA_CERTIDOES / portal.replace(" ", "_")
+    arquivos = sorted(pasta.glob("captcha_*.png"))[:limite]
+    cliente = cliente_2captcha()
+    futuros = [(p, cliente.imagem(p)) for p in arquivos]
+    total = 0
+    for caminho, futuro in futuros:
+        try:
+            rotular_captcha(portal, caminho, futuro.result().texto)
+            total += 1
+        except Exception as e:
+            logger.warning(f"[OCR] {caminho.name}: {type(e).__name__}: {e}")
+    return total
+
+
+# === Linha de comando ===
+if __name__ == "__main__":
+    comando = sys.argv[1] if len(sys.argv) > 1 else ""
+    portais = sys.argv[2:] or ["CDT", "CRF", "PMM"]
+
+    if comando == "calibrar":
+        if not disponivel():
+            sys.exit("Instale o tesseract (e opencv-python/pytesseract) para calibrar.")
+        for portal in portais:
+            calibrar(portal)
+    elif comando == "rotular":
+        limite = int(portais.pop()) if portais and portais[-1].isdigit() else 100
+        for portal in portais or ["CDT", "CRF", "PMM"]:
+            logger.info(f"[OCR] {portal}: {rotular_com_2captcha(portal, limite)} captcha(s) rotulado(s).")
+    else:
+        print("uso: python ocr_captcha.py [calibrar [ABA...] | rotular [ABA...] [LIMITE]]")
@@ -0,0 +1,223 @@
+import queue
+import threading
+import traceback
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable
+
+from loguru import logger
+from playwright.sync_api import sync_playwright
+
+
+# === Pool de navegadores ===
+def executar_em_paralelo(
+    itens: Iterable,
+    processar_item: Callable,
+    workers: int = 1,
+    headless: bool = False,
+    opcoes_launch: dict | None = None,
+    opcoes_contexto: dict | None = None,
+    preparar_pagina: Callable | None = None,
+    nome: str = "worker",
+):
+    """
+    Processa `itens` com até `workers` navegadores isolados consumindo a mesma fila.
+
+    Cada worker roda numa thread própria, com seu próprio sync_playwright, browser,
+    context e page (a API síncrona do Playwright não pode ser compartilhada entre threads).
+    `processar_item(page, context, item)` é chamado para cada item; exceções são logadas e
+    o worker segue para o próximo. `preparar_pagina(page)` roda uma vez por página aberta.
+    """
+    fila: queue.Queue = queue.Queue()
+    for item in itens:
+        fila.put(item)
+    total = fila.qsize()
+    workers = max(1, min(workers, total))
+    if not total:
+        return
+
+    def novo_page(context):
+        page = context.new_page()
+        if preparar_pagina:
+            preparar_pagina(page)
+        return page
+
+    def trabalhar(n: int):
+        try:
+            consumir(n)
+        except Exception as e:
+            # falha ao abrir o navegador: os itens restantes ficam para os outros workers
+            logger.error(f"[{nome}-{n}] Worker encerrado: {type(e).__name__}: {e}")
+
+    def consumir(n: int):
+        with sync_playwright() as p:
+            browser = p.chromium.launch(headless=headless, **(opcoes_launch or {}))
+            context = browser.new_context(**(opcoes_contexto or {}))
+            page = novo_page(context)
+            try:
+                while True:
+                    try:
+                        item = fila.get_nowait()
+                    except queue.Empty:
+                        return
+                    try:
+                        if page.is_closed():
+                            page = novo_page(context)
+                        processar_item(page, context, item)
+                    except Exception as e:
+                        logger.error(f"[{nome}-{n}] {item} → ERRO: {type(e).__name__}: {e}")
+                        traceback.print_exc()
+                    finally:
+                        fila.task_done()
+            finally:
+                context.close()
+                browser.close()
+
+    logger.info(f"[{nome}] {total} item(ns) em {workers} navegador(es) paralelos.")
+    threads = [
+        threading.Thread(target=trabalhar, args=(n,), name=f"{nome}-{n}", daemon=True)
+        for n in range(1, workers + 1)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    if not fila.empty():
+        logger.error(f"[{nome}] {fila.qsize()} item(ns) não processado(s): nenhum navegador disponível.")
+
+
+# === Pipeline de captcha ===
+@dataclass
+class _Etapa:
+    slot: int
+    item: Any
+    tentativa: int
+    dados: Any
+    solucao: Future
+
+
+def executar_em_pipeline(
+    itens: Iterable,
+    preparar: Callable,
+    resolver: Callable,
+    concluir: Callable,
+    desistir: Callable | None = None,
+    max_tentativas: int = 1,
+    workers: int = 1,
+    headless: bool = False,
+    opcoes_launch: dict | None = None,
+    opcoes_contexto: dict | None = None,
+    nome: str = "pipeline",
+):
+    """
+    Como `executar_em_paralelo`, mas sobrepõe a espera do captcha com o trabalho do item anterior.
+
+    Cada worker alterna entre dois contexts (o captcha fica preso à sessão que o gerou):
+    enquanto o item k envia o formulário e baixa o PDF num deles, o captcha do item k+1 já
+    foi capturado no outro e está sendo resolvido numa thread de fundo.
+
+      preparar(page, item) -> dados                          abre o formulário e captura o captcha
+      resolver(dados) -> resposta                            roda fora da thread do navegador (2Captcha)
+      concluir(page, context, item, dados, resposta, tentativa) -> bool
+                                                             envia e baixa; False = captcha recusado
+      desistir(item, tentativas, erro)                       chamado após `max_tentativas` falhas
+
+    Falhas (retorno False ou exceção) voltam para a fila do próprio worker com um captcha novo.
+    """
+    fila: queue.Queue = queue.Queue()
+    for item in itens:
+        fila.put(item)
+    total = fila.qsize()
+    workers = max(1, min(workers, total))
+    if not total:
+        return
+
+    resolvedores = ThreadPoolExecutor(max_workers=2 * workers, thread_name_prefix=f"{nome}-captcha")
+
+    def trabalhar(n: int):
+        try:
+            consumir(n)
+        except Exception as e:
+            logger.error(f"[{nome}-{n}] Worker encerrado: {type(e).__name__}: {e}")
+
+    def consumir(n: int):
+        retentar: deque = deque()
+
+        def proximo():
+            if retentar:
+                return retentar.popleft()
+            try:
+                return fila.get_nowait(), 1
+            except queue.Empty:
+                return None
+
+        def falhou(item, tentativa: int, erro: Exception | None = None):
+            if tentativa < max_tentativas:
+                retentar.append((item, tentativa + 1))
+                return
+            logger.error(f"[{nome}-{n}] {item} → Excedeu o número máximo de tentativas.")
+            if desistir:
+                try:
+                    desistir(item, tentativa, erro)
+                except Exception as e:
+                    logger.error(f"[{nome}-{n}] {item} → ERRO ao registrar falha: {type(e).__name__}: {e}")
+
+        with sync_playwright() as p:
+            browser = p.chromium.launch(headless=headless, **(opcoes_launch or {}))
+            contextos = [browser.new_context(**(opcoes_contexto or {})) for _ in range(2)]
+            paginas = [context.new_page() for context in contextos]
+
+            def iniciar(slot: int) -> _Etapa | None:
+                while (proximo_item := proximo()) is not None:
+                    item, tentativa = proximo_item
+                    try:
+                        if paginas[slot].is_closed():
+                            paginas[slot] = contextos[slot].new_page()
+                        dados = preparar(paginas[slot], item)
+                        return _Etapa(slot, item, tentativa, dados, resolvedores.submit(resolver, dados))
+                    except Exception as e:
+                        logger.error(f"[{nome}-{n}] {item} → ERRO: {type(e).__name__}: {e}")
+                        traceback.print_exc()
+                        falhou(item, tentativa, e)
+                return None
+
+            try:
+                atual = iniciar(0)
+                while atual is not None:
+                    # o captcha do próximo já vai para o resolvedor antes de esperarmos o atual
+                    seguinte = iniciar(1 - atual.slot)
+                    erro = None
+                    try:
+                        resposta = atual.solucao.result()
+                        ok = concluir(
+                            paginas[atual.slot], contextos[atual.slot], atual.item, atual.dados, resposta, atual.tentativa
+                        )
+                    except Exception as e:
+                        logger.error(f"[{nome}-{n}] {atual.item} → ERRO: {type(e).__name__}: {e}")
+                        traceback.print_exc()
+                        ok, erro = False, e
+                    if not ok:
+                        falhou(atual.item, atual.tentativa, erro)
+                    atual = seguinte or iniciar(atual.slot)
+            finally:
+                for context in contextos:
+                    context.close()
+                browser.close()
+
+    logger.info(f"[{nome}] {total} item(ns) em {workers} navegador(es), captcha do próximo resolvido em paralelo.")
+    threads = [
+        threading.Thread(target=trabalhar, args=(n,), name=f"{nome}-{n}", daemon=True)
+        for n in range(1, workers + 1)
+    ]
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        resolvedores.shutdown(wait=False, cancel_futures=True)
+
+    if not fila.empty():
+        logger.error(f"[{nome}] {fila.qsize()} item(ns) não processado(s): nenhum navegador disponível.")
@@ -0,0 +1,254 @@
+import os
+import re
+import sys
+import atexit
+import signal
+import threading
+import time
+from pathlib import Path
+
+from filelock import FileLock
+from loguru import logger
+from openpyxl import load_workbook
+
+# === Configurações ===
+COL_CNPJ = "CNPJ"
+MAX_PENDENTES = 50        # grava a cada N resultados
+INTERVALO_FLUSH_SEG = 120  # ... ou a cada T segundos
+LOCK_TIMEOUT_SEG = 300     # espera máxima pelo lock da planilha (outro portal gravando)
+TENTATIVAS_SUBSTITUIR = 5  # Windows recusa o replace enquanto alguém lê o arquivo
+
+
+# === Utilitários ===
+def normalizar_documento(doc) -> str:
+    """
+    Mantém só os dígitos e completa com zeros à esquerda (CNPJ lido como número
+    perde os zeros iniciais). Retorna "" para células vazias.
+    """
+    numeros = re.sub(r"\D", "", str(doc if doc is not None else ""))
+    return numeros.zfill(14) if numeros else ""
+
+
+def _mapear_cabecalhos(ws):
+    colunas = {cell.value: idx for idx, cell in enumerate(next(ws.iter_rows(min_row=1, max_row=1)), start=1)}
+    return colunas
+
+
+class IndiceCnpj:
+    """
+    Índice de uma aba: CNPJ normalizado → linhas da planilha (todas, inclusive
+    duplicadas) e nome da coluna → posição. Construído uma vez e reaproveitado
+    em todas as gravações enquanto o arquivo não mudar.
+    """
+
+    def __init__(self, ws, col_cnpj: str = COL_CNPJ):
+        self.colunas = _mapear_cabecalhos(ws)
+        self.linhas: dict[str, list[int]] = {}
+        idx_cnpj = self.colunas.get(col_cnpj)
+        if not idx_cnpj:
+            return
+        for num, (valor,) in enumerate(ws.iter_rows(min_row=2, min_col=idx_cnpj, max_col=idx_cnpj, values_only=True), start=2):
+            chave = normalizar_documento(valor)
+            if chave:
+                self.linhas.setdefault(chave, []).append(num)
+
+        duplicados = {c: l for c, l in self.linhas.items() if len(l) > 1}
+        if duplicados:
+            logger.debug(f"[Planilha] Aba {ws.title}: {len(duplicados)} CNPJ(s) em mais de uma linha; todas serão atualizadas.")
+
+    def __contains__(self, cnpj: str) -> bool:
+        return normalizar_documento(cnpj) in self.linhas
+
+    def linhas_de(self, cnpj: str) -> list[int]:
+        return self.linhas.get(normalizar_documento(cnpj), [])
+
+
+def _assinatura(caminho: Path):
+    # muda sempre que alguém (outro script, usuário) regravar o arquivo
+    estado = caminho.stat()
+    return estado.st_mtime_ns, estado.st_size
+
+
+def _salvar_atomico(wb, caminho: Path):
+    # grava num temporário da mesma pasta e troca de uma vez: quem lê (pd.read_excel) nunca vê arquivo pela metade
+    temp = caminho.with_name(f".{caminho.stem}.{os.getpid()}.tmp{caminho.suffix}")
+    wb.save(temp)
+    for tentativa in range(1, TENTATIVAS_SUBSTITUIR + 1):
+        try:
+            os.replace(temp, caminho)
+            return
+        except PermissionError:
+            if tentativa == TENTATIVAS_SUBSTITUIR:
+                temp.unlink(missing_ok=True)
+                raise
+            logger.warning(f"[Planilha] {caminho.name} em uso; nova tentativa em {tentativa}s...")
+            time.sleep(tentativa)
+
+
+def _instalar_sigterm():
+    # SIGTERM (agendador do SO) vira SystemExit para que o atexit rode e grave o que estiver pendente
+    if threading.current_thread() is not threading.main_thread():
+        return
+    try:
+        if signal.getsignal(signal.SIGTERM) in (signal.SIG_DFL, None):
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+    except (ValueError, AttributeError):
+        pass
+
+
+# === Gravador em lote ===
+class GravadorPlanilha:
+    """
+    Acumula as atualizações de validade/status em memória e grava tudo na planilha
+    numa única passada: a cada `max_pendentes` resultados, a cada `intervalo_seg`
+    segundos ou no fim da execução. Em caso de erro, Ctrl-C ou SIGTERM o que estiver
+    pendente é gravado pelo atexit.
+
+    Vários portais podem rodar ao mesmo tempo: cada gravação pega o lock
+    `<planilha>.lock`, relê o arquivo do disco, aplica apenas as células deste
+    processo e substitui o arquivo de forma atômica. Assim as abas atualizadas
+    pelos outros scripts nunca são sobrescritas.
+    """
+
+    def __init__(
+        self,
+        caminho: Path,
+        max_pendentes: int = MAX_PENDENTES,
+        intervalo_seg: float | None = INTERVALO_FLUSH_SEG,
+        criar_colunas: bool = False,
+        col_cnpj: str = COL_CNPJ,
+    ):
+        self.caminho = Path(caminho)
+        self.max_pendentes = max_pendentes
+        self.intervalo_seg = intervalo_seg
+        self.criar_colunas = criar_colunas
+        self.col_cnpj = col_cnpj
+
+        self._pendentes: dict[tuple[str, str], dict[str, object]] = {}
+        self._lock = threading.RLock()
+        self._ultimo_flush = time.monotonic()
+        self._parar = threading.Event()
+        self._thread = None
+        self._indices: dict[str, IndiceCnpj] = {}
+        self._assinatura = None
+        self._lock_arquivo = FileLock(f"{self.caminho}.lock", timeout=LOCK_TIMEOUT_SEG)
+
+        atexit.register(self._flush_final)
+        _instalar_sigterm()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+        return False
+
+    def registrar(self, aba: str, cnpj: str, valores: dict):
+        """Enfileira `valores` ({coluna: valor}) para a linha do CNPJ na aba."""
+        chave = normalizar_documento(cnpj)
+        if not chave:
+            logger.warning(f"[Planilha] Documento vazio ignorado: {cnpj!r}")
+            return
+
+        with self._lock:
+            self._pendentes.setdefault((aba, chave), {}).update(valores)
+            vencido = False
+            if self.intervalo_seg is not None:  # None: só grava por quantidade ou no flush explícito
+                self._iniciar_temporizador()
+                vencido = time.monotonic() - self._ultimo_flush >= self.intervalo_seg
+            if len(self._pendentes) >= self.max_pendentes or vencido:
+                self.flush()
+
+    def flush(self):
+        with self._lock:
+            if not self._pendentes:
+                self._ultimo_flush = time.monotonic()
+                return
+            pendentes, self._pendentes = self._pendentes, {}
+            try:
+                with self._lock_arquivo:
+                    self._aplicar(pendentes)
+            except Exception:
+                # devolve para a fila sem sobrescrever o que chegou depois
+                for chave, valores in pendentes.items():
+                    self._pendentes[chave] = {**valores, **self._pendentes.get(chave, {})}
+                raise
+            self._ultimo_flush = time.monotonic()
+            logger.info(f"[Planilha] {len(pendentes)} atualização(ões) gravada(s) em {self.caminho.name}")
+
+    def _aplicar(self, pendentes: dict[tuple[str, str], dict[str, object]]):
+        por_aba: dict[str, dict[str, dict[str, object]]] = {}
+        for (aba, cnpj), valores in pendentes.items():
+            por_aba.setdefault(aba, {})[cnpj] = valores
+
+        assinatura = _assinatura(self.caminho)
+        wb = load_workbook(self.caminho)
+        try:
+            for aba, itens in por_aba.items():
+                if aba not in wb.sheetnames:
+                    logger.error(f"[Planilha] Aba '{aba}' não encontrada em {self.caminho}.")
+                    continue
+                ws = wb[aba]
+                indice = self._indice(ws, assinatura)
+                colunas = indice.colunas
+                if self.col_cnpj not in colunas:
+                    logger.error(f"[Planilha] Coluna {self.col_cnpj} não encontrada na aba {aba}.")
+                    continue
+
+                for nome in {col for valores in itens.values() for col in valores}:
+                    if nome in colunas:
+                        continue
+                    if self.criar_colunas:
+                        colunas[nome] = ws.max_column + 1
+                        ws.cell(row=1, column=colunas[nome], value=nome)
+                    else:
+                        logger.error(f"[Planilha] Coluna {nome} não encontrada na aba {aba}.")
+
+                for cnpj, valores in itens.items():
+                    linhas = indice.linhas_de(cnpj)
+                    if not linhas:
+                        logger.warning(f"[Planilha] {cnpj} não encontrado na aba {aba}.")
+                        continue
+                    for num in linhas:
+                        for nome, valor in valores.items():
+                            if nome in colunas:
+                                ws.cell(row=num, column=colunas[nome], value=valor)
+
+            _salvar_atomico(wb, self.caminho)
+        except Exception:
+            self._indices.clear()
+            raise
+        finally:
+            wb.close()
+
+        # o arquivo acabou de ser gravado por nós: os índices continuam válidos
+        self._assinatura = _assinatura(self.caminho)
+
+    def _indice(self, ws, assinatura) -> IndiceCnpj:
+        if assinatura != self._assinatura:
+            self._indices.clear()
+            self._assinatura = assinatura
+        if ws.title not in self._indices:
+            self._indices[ws.title] = IndiceCnpj(ws, self.col_cnpj)
+        return self._indices[ws.title]
+
+    def _iniciar_temporizador(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._loop_temporizador, name="gravador-planilha", daemon=True)
+            self._thread.start()
+
+    def _loop_temporizador(self):
+        while not self._parar.wait(self.intervalo_seg):
+            try:
+                with self._lock:
+                    if self._pendentes and time.monotonic() - self._ultimo_flush >= self.intervalo_seg:
+                        self.flush()
+            except Exception as e:
+                logger.error(f"[Planilha] Falha no flush periódico: {type(e).__name__}: {e}")
+
+    def _flush_final(self):
+        self._parar.set()
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"[Planilha] Falha ao gravar pendências no encerramento: {type(e).__name__}: {e}")
@@ -0,0 +1,138 @@
+import os
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Callable
+
+from loguru import logger
+
+from documentos import gravar_atomico
+from extracao import DadosCertidao, extrair_certidao
+
+# === Configurações ===
+PROCESSOS = min(os.cpu_count() or 1, 61)  # 61: limite do ProcessPoolExecutor no Windows
+PENDENTES_POR_PROCESSO = 4                 # PDFs na fila por processo antes de o navegador esperar
+
+
+@dataclass
+class Tarefa:
+    portal: str                 # aba; escolhe os padrões em extracao.PADROES
+    cnpj: str
+    conteudo: bytes
+    pasta: Path
+    modelo_nome: str            # ex.: "cdt_{cnpj}_{validade}.pdf" ({validade} como AAAAMMDD)
+    nome_erro: str | None = "erro_{cnpj}.pdf"  # None: sem validade, grava com modelo_nome mesmo
+    detalhes: dict = field(default_factory=dict)  # repassados ao resultado (ex.: tentativas)
+
+
+@dataclass
+class Resultado:
+    cnpj: str
+    dados: DadosCertidao
+    destino: Path
+    detalhes: dict
+
+
+# === Trabalho de cada processo ===
+def processar_tarefa(tarefa: Tarefa) -> Resultado:
+    """Extrai os dados do PDF e o grava, uma vez, com o nome final."""
+    dados = extrair_certidao(tarefa.conteudo, tarefa.portal)
+    if dados.validade or tarefa.nome_erro is None:
+        validade = datetime.strptime(dados.validade, "%d/%m/%Y").strftime("%Y%m%d") if dados.validade else ""
+        nome = tarefa.modelo_nome.format(cnpj=tarefa.cnpj, validade=validade)
+    else:
+        nome = tarefa.nome_erro.format(cnpj=tarefa.cnpj)
+    destino = gravar_atomico(tarefa.pasta / nome, tarefa.conteudo)
+    return Resultado(tarefa.cnpj, dados, destino, tarefa.detalhes)
+
+
+# === Etapa de pós-processamento ===
+class PosProcessamento:
+    """
+    Fila de PDFs processados num ProcessPoolExecutor (um processo por núcleo): o worker
+    do navegador entrega os bytes com `enviar` e segue para o próximo CNPJ enquanto o
+    PyMuPDF trabalha em outro processo. `concluir(resultado)` roda neste processo, numa
+    thread consumidora própria (não na thread de gerência do pool, que só repassa o que
+    terminou), onde ficam o estado e o gravador da planilha. Se o pool quebrar, o PDF é
+    processado aqui mesmo, também nessa thread. `aguardar()` esvazia a fila; chame antes
+    do GRAVADOR.flush().
+
+    Os processos usam spawn (ver estado_app.EstadoApp sobre o que isso exige do script).
+    """
+
+    def __init__(self, nome: str, processos: int = PROCESSOS):
+        self.nome = nome
+        self.processos = max(1, processos)
+        self._executor: ProcessPoolExecutor | None = None
+        self._consumidor: threading.Thread | None = None
+        self._concluidos: queue.Queue = queue.Queue()  # (futuro ou None, tarefa, concluir); None encerra
+        self._lock = threading.Lock()
+        self._vagas = threading.Semaphore(self.processos * PENDENTES_POR_PROCESSO)
+
+    def _pool(self) -> ProcessPoolExecutor:
+        # criado no primeiro envio: importar o módulo (inclusive nos filhos) não abre processos
+        with self._lock:
+            if self._executor is None:
+                # spawn: um fork com as threads do Playwright vivas pode travar o filho
+                self._executor = ProcessPoolExecutor(self.processos, mp_context=multiprocessing.get_context("spawn"))
+                logger.info(f"[{self.nome}] Pós-processamento em {self.processos} processo(s).")
+            return self._executor
+
+    def _entregar(self, item):
+        # a thread consumidora nasce com o primeiro resultado; daemon: aguardar() é quem a encerra
+        with self._lock:
+            if self._consumidor is None:
+                self._consumidor = threading.Thread(target=self._consumir, name=f"{self.nome}-pos", daemon=True)
+                self._consumidor.start()
+        self._concluidos.put(item)
+
+    def enviar(self, tarefa: Tarefa, concluir: Callable[[Resultado], None]):
+        self._vagas.acquire()  # fila cheia: o navegador espera em vez de acumular PDFs na memória
+        try:
+            futuro = self._pool().submit(processar_tarefa, tarefa)
+        except Exception as e:
+            self._vagas.release()
+            logger.warning(f"[{self.nome}] {tarefa.cnpj}: pool indisponível ({type(e).__name__}); processando aqui.")
+            self._entregar((None, tarefa, concluir))
+            return
+        futuro.add_done_callback(lambda f: self._terminou(f, tarefa, concluir))
+
+    def _terminou(self, futuro: Future, tarefa: Tarefa, concluir: Callable[[Resultado], None]):
+        # roda na thread de gerência do pool: só libera a vaga e repassa
+        self._vagas.release()
+        self._entregar((futuro, tarefa, concluir))
+
+    def _consumir(self):
+        while True:
+            item = self._concluidos.get()
+            if item is None:
+                return
+            futuro, tarefa, concluir = item
+            resultado = None
+            if futuro is not None:
+                try:
+                    resultado = futuro.result()
+                except Exception as e:
+                    logger.warning(f"[{self.nome}] {tarefa.cnpj}: pós-processamento falhou ({type(e).__name__}: {e}); processando aqui.")
+            self._concluir(tarefa, concluir, resultado)
+
+    def _concluir(self, tarefa: Tarefa, concluir: Callable[[Resultado], None], resultado: Resultado | None):
+        try:
+            concluir(resultado or processar_tarefa(tarefa))
+        except Exception as e:
+            logger.error(f"[{self.nome}] {tarefa.cnpj} → ERRO no pós-processamento: {type(e).__name__}: {e}")
+
+    def aguardar(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)  # depois disto todos os resultados já estão na fila
+        with self._lock:
+            consumidor, self._consumidor = self._consumidor, None
+        if consumidor is not None:
+            self._concluidos.put(None)
+            consumidor.join()
@@ -0,0 +1,281 @@
+import base64
+import json
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# === Configurações ===
+TIMEOUT_HTTP_SEG = 30
+TIPOS_IGNORADOS = {"image", "stylesheet", "script", "font", "media", "manifest", "websocket"}
+CABECALHOS_IGNORADOS = {"cookie", "content-length", "host", "accept-encoding", "connection"}
+MIN_TAMANHO_VALOR = 8      # valores de resposta mais curtos não são tratados como ids encadeados
+MAX_TAMANHO_VALOR = 512
+PDF_BASE64 = "JVBERi"      # "%PDF" em base64
+RE_RECUSA = re.compile(r"N[ãa]o foi poss[íi]vel concluir a a[çc][ãa]o", re.I)
+RE_MARCADOR = re.compile(r"\{\{(cnpj|cnpj_formatado|r(\d+):([^}]*))\}\}")
+
+
+class ErroApiRfb(RuntimeError):
+    """O backend não respondeu como na gravação (formato mudou ou sessão caiu): usar a interface."""
+
+
+class RecusaRfb(RuntimeError):
+    """O backend respondeu normalmente, mas recusou emitir a certidão do CNPJ."""
+
+
+@dataclass
+class Chamada:
+    indice: int                     # posição na gravação; as referências {{rN:...}} usam este número
+    metodo: str
+    url: str                        # com marcadores {{cnpj}} / {{rN:caminho}}
+    corpo: str | None
+    cabecalhos: dict[str, str]
+    chaves: frozenset[str] | None   # chaves de primeiro nível do JSON gravado
+    pdf: str | None = None          # "binario" ou caminho do campo base64 com o PDF
+
+
+@dataclass
+class ModeloApi:
+    chamadas: list[Chamada] = field(default_factory=list)
+
+
+# === Utilitários ===
+def formatar_cnpj(cnpj: str) -> str:
+    return f"{cnpj[:2]}.{cnpj[2:5]}.{cnpj[5:8]}/{cnpj[8:12]}-{cnpj[12:]}"
+
+
+def _json(conteudo: bytes):
+    try:
+        return json.loads(conteudo)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def _achatar(dados, prefixo: str = ""):
+    """(caminho, valor) de cada escalar de um JSON; caminho no formato 'a.b.0.c'."""
+    if isinstance(dados, dict):
+        for chave, valor in dados.items():
+            yield from _achatar(valor, f"{prefixo}{chave}.")
+    elif isinstance(dados, list):
+        for i, valor in enumerate(dados):
+            yield from _achatar(valor, f"{prefixo}{i}.")
+    elif dados is not None:
+        yield prefixo[:-1], str(dados)
+
+
+def _valor(dados, caminho: str):
+    for parte in caminho.split(".") if caminho else []:
+        dados = dados[int(parte)] if isinstance(dados, list) else dados[parte]
+    return dados
+
+
+def _campo_pdf(dados) -> str | None:
+    for caminho, valor in _achatar(dados):
+        if valor.startswith(PDF_BASE64):
+            return caminho
+    return None
+
+
+# === Gravação (Playwright) ===
+class GravadorChamadas:
+    """
+    Registra as requisições que a SPA faz enquanto um CNPJ é emitido pela interface.
+    Os corpos das respostas só são lidos em `modelo()`, depois do fluxo, para não
+    bloquear os handlers do Playwright; `modelo()` também desliga a gravação.
+
+    O que dá para capturar: respostas de XHR/fetch (JSON, PDF em base64 num campo ou
+    PDF binário) e downloads cuja URL é a de uma requisição gravada — o Playwright não
+    entrega `body()` de um download, então o conteúdo vem do arquivo baixado e a
+    requisição (método, corpo, cabeçalhos) vem do evento correspondente. Um download
+    de URL `blob:` (PDF montado no navegador) não tem requisição para repetir: nesse
+    caso só serve a gravação se o PDF também vier numa resposta JSON.
+    """
+
+    def __init__(self, page):
+        self.page = page
+        self.requisicoes = []
+        self.downloads: dict[str, object] = {}  # url → Download
+        self._ativo = True
+        # download costuma terminar como requisição abortada (requestfailed), não finished
+        page.on("requestfinished", self._gravar)
+        page.on("requestfailed", self._gravar)
+        page.on("download", self._baixado)
+
+    def _gravar(self, requisicao):
+        if requisicao.resource_type not in TIPOS_IGNORADOS:
+            self.requisicoes.append(requisicao)
+
+    def _baixado(self, download):
+        self.downloads[download.url] = download
+
+    def parar(self):
+        """Remove os listeners da página (pode ser chamado mais de uma vez)."""
+        if not self._ativo:
+            return
+        self._ativo = False
+        for evento, handler in (("requestfinished", self._gravar), ("requestfailed", self._gravar), ("download", self._baixado)):
+            self.page.remove_listener(evento, handler)
+
+    def _conteudo(self, req) -> tuple[bytes, str] | None:
+        """(corpo, content-type) da resposta; para downloads, os bytes do arquivo baixado."""
+        resposta = req.response()
+        tipo = resposta.headers.get("content-type", "").lower() if resposta is not None else ""
+        download = self.downloads.get(req.url)
+        try:
+            if download is not None:
+                return Path(download.path()).read_bytes(), tipo
+            if resposta is None:
+                return None
+            return resposta.body(), tipo
+        except Exception:
+            return None
+
+    def modelo(self, cnpj: str) -> ModeloApi | None:
+        """
+        Monta as chamadas necessárias para repetir a emissão de outro CNPJ: as que levam o
+        CNPJ e as que fornecem valores (ids, tokens) usados adiante, até a que devolveu o
+        PDF. None se a gravação não tiver um PDF.
+        """
+        self.parar()
+        formatado = formatar_cnpj(cnpj)
+        chamadas: list[Chamada] = []
+        respostas: dict[int, object] = {}
+
+        for indice, req in enumerate(self.requisicoes):
+            lido = self._conteudo(req)
+            if lido is None:
+                continue
+            conteudo, tipo = lido
+            url, corpo = req.url, req.post_data
+
+            # valores de respostas anteriores reaproveitados nesta requisição
+            for anterior, dados in respostas.items():
+                for caminho, valor in _achatar(dados):
+                    if not MIN_TAMANHO_VALOR <= len(valor) <= MAX_TAMANHO_VALOR or valor in (cnpj, formatado):
+                        continue
+                    marcador = f"{{{{r{anterior}:{caminho}}}}}"
+                    url = url.replace(valor, marcador)
+                    corpo = corpo.replace(valor, marcador) if corpo else corpo
+            for valor, marcador in ((formatado, "{{cnpj_formatado}}"), (cnpj, "{{cnpj}}")):
+                url = url.replace(valor, marcador)
+                corpo = corpo.replace(valor, marcador) if corpo else corpo
+
+            dados = _json(conteudo)
+            pdf = "binario" if "pdf" in tipo or conteudo[:5] == b"%PDF-" else _campo_pdf(dados)
+            if isinstance(dados, (dict, list)):
+                respostas[indice] = dados
+
+            chamadas.append(Chamada(
+                indice=indice,
+                metodo=req.method,
+                url=url,
+                corpo=corpo,
+                cabecalhos={
+                    k: v for k, v in req.all_headers().items()
+                    if k.lower() not in CABECALHOS_IGNORADOS and not k.startswith(":")
+                },
+                chaves=frozenset(dados) if isinstance(dados, dict) else None,
+                pdf=pdf,
+            ))
+            if pdf:
+                break
+        else:
+            return None
+
+        # de trás para frente: fica a chamada do PDF e tudo de que ela depende
+        necessarias: set[int] = set()
+        for chamada in reversed(chamadas):
+            texto = chamada.url + (chamada.corpo or "")
+            if chamada.pdf or chamada.indice in necessarias or "{{cnpj" in texto:
+                necessarias.add(chamada.indice)
+                necessarias.update(int(m.group(2)) for m in RE_MARCADOR.finditer(texto) if m.group(2))
+        return ModeloApi([c for c in chamadas if c.indice in necessarias])
+
+
+# === Repetição direta no backend ===
+class ClienteApiRfb:
+    """
+    Repete as chamadas gravadas com os cookies da sessão do navegador, trocando o CNPJ e
+    os valores encadeados. Qualquer divergência de formato vira `ErroApiRfb`, para o
+    chamador voltar à interface.
+    """
+
+    def __init__(self, modelo: ModeloApi, cookies: list[dict]):
+        self.modelo = modelo
+        self.sessao = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=4)
+        self.sessao.mount("https://", adaptador)
+        self.sessao.mount("http://", adaptador)
+        for c in cookies:
+            self.sessao.cookies.set(c["name"], c["value"], domain=c.get("domain"), path=c.get("path", "/"))
+
+    @staticmethod
+    def _preencher(texto: str | None, cnpj: str, respostas: dict[int, object]) -> str | None:
+        if texto is None:
+            return None
+
+        def trocar(m: re.Match) -> str:
+            if m.group(1) == "cnpj":
+                return cnpj
+            if m.group(1) == "cnpj_formatado":
+                return formatar_cnpj(cnpj)
+            try:
+                return str(_valor(respostas[int(m.group(2))], m.group(3)))
+            except (KeyError, IndexError, ValueError, TypeError):
+                raise ErroApiRfb(f"Valor '{m.group(3)}' ausente na resposta {m.group(2)}")
+
+        return RE_MARCADOR.sub(trocar, texto)
+
+    def emitir(self, cnpj: str) -> bytes:
+        respostas: dict[int, object] = {}
+        for chamada in self.modelo.chamadas:
+            url = self._preencher(chamada.url, cnpj, respostas)
+            corpo = self._preencher(chamada.corpo, cnpj, respostas)
+            rotulo = f"{chamada.metodo} {urlsplit(url).path}"
+            try:
+                resp = self.sessao.request(
+                    chamada.metodo, url,
+                    data=corpo.encode("utf-8") if corpo is not None else None,
+                    headers=chamada.cabecalhos,
+                    timeout=TIMEOUT_HTTP_SEG,
+                )
+            except requests.RequestException as e:
+                raise ErroApiRfb(f"{rotulo}: {type(e).__name__}: {e}") from e
+
+            if resp.status_code in (401, 403):
+                raise ErroApiRfb(f"{rotulo}: sessão recusada (HTTP {resp.status_code})")
+            if resp.content[:5] != b"%PDF-" and RE_RECUSA.search(resp.content[:4000].decode("utf-8", "replace")):
+                raise RecusaRfb("Não foi possível concluir a ação")
+            if resp.status_code >= 400:
+                raise ErroApiRfb(f"{rotulo}: HTTP {resp.status_code}")
+
+            if chamada.pdf == "binario":
+                if resp.content[:5] != b"%PDF-":
+                    raise ErroApiRfb(f"{rotulo}: a resposta não é mais um PDF")
+                return resp.content
+
+            dados = _json(resp.content)
+            if chamada.chaves is not None and not (isinstance(dados, dict) and chamada.chaves <= dados.keys()):
+                raise ErroApiRfb(f"{rotulo}: formato da resposta mudou")
+            if chamada.pdf:
+                try:
+                    conteudo = base64.b64decode(_valor(dados, chamada.pdf))
+                except Exception:
+                    conteudo = b""
+                if conteudo[:5] != b"%PDF-":
+                    raise ErroApiRfb(f"{rotulo}: campo '{chamada.pdf}' não traz mais o PDF")
+                return conteudo
+            if isinstance(dados, (dict, list)):
+                respostas[chamada.indice] = dados
+
+        raise ErroApiRfb("Nenhuma chamada devolveu o PDF")
+
+    def descrever(self) -> str:
+        return " → ".join(f"{c.metodo} {urlsplit(c.url).path}" for c in self.modelo.chamadas)
+
+    def fechar(self):
+        self.sessao.close()
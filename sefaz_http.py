@@ -0,0 +1,269 @@
+import re
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Iterable
+
+import lxml.html
+import requests
+from loguru import logger
+from requests.adapters import HTTPAdapter
+
+from documentos import gravar_atomico
+from extracao import extrair_certidao, extrair_certidao_texto
+
+# === Configurações ===
+CONCORRENCIA_HTTP = 16
+TIMEOUT_HTTP_SEG = 30
+USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36"
+)
+RE_LABEL_DOCUMENTO = re.compile(r"CPF\s+ou\s+CNPJ", re.I)
+RE_LABEL_CND_COMPLETA = re.compile(r"CND\s+completa", re.I)
+RE_BOTAO_EMITIR = re.compile(r"Emitir", re.I)
+
+
+class ErroSefazHttp(RuntimeError):
+    pass
+
+
+@dataclass
+class FormularioSefaz:
+    action: str
+    metodo: str
+    campos: dict[str, str]              # hidden + valores padrão do formulário
+    campo_documento: str
+    cnd_completa: tuple[str, str] | None
+    botao: tuple[str, str] | None
+
+
+@dataclass
+class EmissaoHttp:
+    conteudo: bytes
+    tipo: str   # "pdf" | "html"
+    texto: str  # texto do HTML (vazio para PDF)
+
+
+# === Descoberta do formulário ===
+def _html(resp: requests.Response) -> str:
+    # sem charset no cabeçalho o requests assume latin-1; o "Válida até" precisa vir certo
+    if "charset" not in resp.headers.get("Content-Type", "").lower():
+        resp.encoding = resp.apparent_encoding
+    return resp.text
+
+
+def _texto(el) -> str:
+    return " ".join(el.text_content().split())
+
+
+def _input_do_label(arvore, label):
+    alvo = label.get("for")
+    if alvo:
+        achados = arvore.xpath("//*[@id=$id]", id=alvo)
+        if achados:
+            return achados[0]
+    dentro = label.xpath(".//input")
+    if dentro:
+        return dentro[0]
+    seguinte = label.xpath("following::input[1]")
+    return seguinte[0] if seguinte else None
+
+
+def _input_por_label(arvore, padrao: re.Pattern):
+    for label in arvore.xpath("//label"):
+        if padrao.search(_texto(label)):
+            el = _input_do_label(arvore, label)
+            if el is not None and el.get("name"):
+                return el
+    return None
+
+
+def descobrir_formulario(html: str | bytes, url: str) -> FormularioSefaz:
+    """Localiza, pelos rótulos visíveis, os campos que o fluxo do navegador preenche."""
+    arvore = lxml.html.fromstring(html)
+    arvore.make_links_absolute(url)
+
+    campo_doc = _input_por_label(arvore, RE_LABEL_DOCUMENTO)
+    if campo_doc is None:
+        raise ErroSefazHttp("Campo 'CPF ou CNPJ' não encontrado no formulário")
+    formularios = campo_doc.xpath("ancestor::form[1]")
+    if not formularios:
+        raise ErroSefazHttp("Campo 'CPF ou CNPJ' fora de um <form>")
+    form = formularios[0]
+
+    campos = {nome: valor for nome, valor in form.form_values()}
+
+    cnd_completa = None
+    el = _input_por_label(form, RE_LABEL_CND_COMPLETA)
+    if el is not None:
+        cnd_completa = (el.get("name"), el.get("value") or "on")
+
+    botao = None
+    for el in form.xpath(".//input[@type='submit' or @type='button'] | .//button"):
+        if el.get("name") and RE_BOTAO_EMITIR.search(el.get("value") or _texto(el)):
+            botao = (el.get("name"), el.get("value") or _texto(el))
+            break
+
+    return FormularioSefaz(
+        action=form.action or url,
+        metodo=(form.method or "POST").upper(),
+        campos=campos,
+        campo_documento=campo_doc.get("name"),
+        cnd_completa=cnd_completa,
+        botao=botao,
+    )
+
+
+# === Cliente ===
+class ClienteSefazHttp:
+    """
+    Emite a CND da SEFAZ-AM sem navegador: abre o formulário uma vez por sessão, descobre
+    os campos e envia o POST de cada documento. Cada thread tem a sua `requests.Session`
+    (cookies/JSESSIONID próprios) sobre um pool de conexões; `emitir_em_lote` roda
+    `concorrencia` emissões ao mesmo tempo.
+    """
+
+    def __init__(self, url: str, concorrencia: int = CONCORRENCIA_HTTP, nome: str = "sefaz-http"):
+        self.url = url
+        self.concorrencia = concorrencia
+        self.nome = nome
+        self._local = threading.local()
+
+    def _sessao(self) -> requests.Session:
+        sessao = getattr(self._local, "sessao", None)
+        if sessao is None:
+            sessao = requests.Session()
+            adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=4)
+            sessao.mount("http://", adaptador)
+            sessao.mount("https://", adaptador)
+            sessao.headers["User-Agent"] = USER_AGENT
+            self._local.sessao = sessao
+            self._local.formulario = None
+        return sessao
+
+    def _formulario(self, renovar: bool = False) -> FormularioSefaz:
+        sessao = self._sessao()
+        if renovar or self._local.formulario is None:
+            resp = sessao.get(self.url, timeout=TIMEOUT_HTTP_SEG)
+            resp.raise_for_status()
+            self._local.formulario = descobrir_formulario(_html(resp), resp.url)
+        return self._local.formulario
+
+    def emitir(self, documento: str) -> EmissaoHttp:
+        for tentativa in (1, 2):
+            form = self._formulario(renovar=tentativa > 1)
+            dados = {**form.campos, form.campo_documento: documento}
+            if form.cnd_completa:
+                dados[form.cnd_completa[0]] = form.cnd_completa[1]
+            if form.botao:
+                dados[form.botao[0]] = form.botao[1]
+
+            if form.metodo == "GET":
+                resp = self._sessao().get(form.action, params=dados, timeout=TIMEOUT_HTTP_SEG)
+            else:
+                resp = self._sessao().post(form.action, data=dados, headers={"Referer": self.url}, timeout=TIMEOUT_HTTP_SEG)
+            resp.raise_for_status()
+
+            emissao = self._interpretar(resp)
+            if emissao is not None:
+                return emissao
+            # voltou o próprio formulário: sessão expirada/token trocado → abre de novo uma vez
+        raise ErroSefazHttp("O portal devolveu o formulário em vez da certidão")
+
+    def _interpretar(self, resp: requests.Response) -> EmissaoHttp | None:
+        if "pdf" in resp.headers.get("Content-Type", "").lower() or resp.content[:5] == b"%PDF-":
+            return EmissaoHttp(resp.content, "pdf", "")
+
+        arvore = lxml.html.fromstring(_html(resp))
+        arvore.make_links_absolute(resp.url)
+        # certidão embutida como PDF (iframe/embed/object)
+        for src in arvore.xpath("//iframe/@src | //embed/@src | //object/@data"):
+            if "pdf" in src.lower():
+                pdf = self._sessao().get(src, timeout=TIMEOUT_HTTP_SEG)
+                pdf.raise_for_status()
+                if pdf.content[:5] == b"%PDF-":
+                    return EmissaoHttp(pdf.content, "pdf", "")
+        if _input_por_label(arvore, RE_LABEL_DOCUMENTO) is not None:
+            return None
+        return EmissaoHttp(resp.content, "html", _texto(arvore))
+
+    def emitir_em_lote(self, documentos: Iterable[str], tratar: Callable[[str, EmissaoHttp], bool]) -> list[str]:
+        """
+        Emite todos os documentos em paralelo; `tratar(documento, emissao)` grava o resultado
+        e devolve False quando ele não serve (ex.: sem validade). Retorna os documentos que
+        falharam, para o fluxo do navegador.
+        """
+        documentos = list(documentos)
+        if not documentos:
+            return []
+        inicio = time.monotonic()
+        falhas: list[str] = []
+
+        def processar(documento: str) -> bool:
+            try:
+                return tratar(documento, self.emitir(documento))
+            except Exception as e:
+                logger.warning(f"[{self.nome}] {documento} → HTTP falhou: {type(e).__name__}: {e}")
+                return False
+
+        with ThreadPoolExecutor(max_workers=self.concorrencia, thread_name_prefix=self.nome) as executor:
+            futuros = {executor.submit(processar, doc): doc for doc in documentos}
+            for futuro in as_completed(futuros):
+                if not futuro.result():
+                    falhas.append(futuros[futuro])
+
+        duracao = time.monotonic() - inicio
+        logger.info(
+            f"[{self.nome}] {len(documentos) - len(falhas)}/{len(documentos)} emitido(s) por HTTP em {duracao:.1f}s "
+            f"({len(documentos) / duracao * 60:.0f}/min); {len(falhas)} para o navegador."
+        )
+        return falhas
+
+
+# === Gravação da certidão ===
+class FinalizadorSefaz:
+    """
+    Grava a certidão emitida (PDF do navegador ou resposta HTTP) com o nome definitivo
+    `{prefixo}_{doc}_{AAAAMMDD}` e repassa a validade a `salvar(doc, validade, pdf_path=...)`.
+    Compartilhado pelas abas SEFAZ CONT e SEFAZ N CONT, que só diferem em aba e prefixo.
+    """
+
+    def __init__(self, aba: str, prefixo: str, pasta: Path, salvar: Callable[..., None]):
+        self.aba = aba
+        self.prefixo = prefixo
+        self.pasta = pasta
+        self.salvar = salvar
+
+    def _gravar(self, doc: str, validade: str, conteudo: bytes, extensao: str) -> Path:
+        validade_formatada = datetime.strptime(validade, "%d/%m/%Y").strftime("%Y%m%d")
+        destino = gravar_atomico(self.pasta / f"{self.prefixo}_{doc}_{validade_formatada}.{extensao}", conteudo)
+        self.salvar(doc, validade, pdf_path=destino)
+        return destino
+
+    def finalizar_pdf(self, doc: str, pdf_bytes: bytes) -> bool:
+        # A validade sai direto dos bytes; o PDF é gravado uma vez, já com o nome definitivo
+        dados = extrair_certidao(pdf_bytes, self.aba)
+        if dados.validade:
+            self._gravar(doc, dados.validade, pdf_bytes, "pdf")
+            logger.success(f"{doc} → Sucesso: {dados.resumo()}")
+            return True
+
+        gravar_atomico(self.pasta / f"erro_{doc}.pdf", pdf_bytes)
+        logger.warning(f"{doc} → Não foi possível extrair validade.")
+        return False
+
+    def finalizar_emissao_http(self, doc: str, emissao: EmissaoHttp) -> bool:
+        if emissao.tipo == "pdf":
+            return self.finalizar_pdf(doc, emissao.conteudo)
+
+        # certidão devolvida como HTML: guarda a página e lê a validade do texto
+        dados = extrair_certidao_texto(emissao.texto, self.aba)
+        if not dados.validade:
+            return False
+        self._gravar(doc, dados.validade, emissao.conteudo, "html")
+        logger.success(f"{doc} → Sucesso (HTTP): {dados.resumo()}")
+        return True